@@ -0,0 +1,195 @@
+"""
+Batch entry point of the numerical calculation.
+
+run_calculations solves arrays of configurations (parameters are broadcast together)
+and returns a NumPy structured array with fixed-width fields, see get_result_dtype,
+so callers index fields of all configurations at once instead of looping over dicts:
+
+    results = run_calculations(1.0, b=np.stack(service_moments), b_w=b_w, b_c=b_c, b_d=b_d,
+                               num_channels=3, workers=4)
+    w1 = results['w'][:, 0]
+
+run_calculation_grid solves a grid of grid.AXES and returns the results with the shape
+of the grid and its labels. Solves use the calculation cache and run in chunks over
+a process pool, with warm_start each chunk is solved as a continuation along its rows.
+"""
+import contextlib
+import math
+
+import numpy as np
+
+from cache import cached_run_calculation, get_calc_cache
+from grid import iter_grid, make_grid_point
+from parallel import process_pool
+from sweep import get_parallel_params
+
+# number of moments of waiting and sojourn times returned by the solver
+NUM_MOMENTS = 3
+
+
+def get_result_dtype(p_size: int = 10, max_channels: int = 1) -> np.dtype:
+    """
+    Structured dtype of calculation results.
+    :param p_size: number of state probabilities
+    :param max_channels: maximum number of channels of configurations,
+        servers_busy_probs of configurations with fewer channels are padded with zeros
+    :return: dtype with fields w, v (NUM_MOMENTS moments), p (p_size), warmup_prob, cold_prob,
+        cold_delay_prob, servers_busy_probs (max_channels + 1), num_of_iter, process_time,
+        warm_started, cache_hit
+    """
+    return np.dtype([
+        ('w', 'f8', (NUM_MOMENTS,)),
+        ('v', 'f8', (NUM_MOMENTS,)),
+        ('p', 'f8', (p_size,)),
+        ('warmup_prob', 'f8'),
+        ('cold_prob', 'f8'),
+        ('cold_delay_prob', 'f8'),
+        ('servers_busy_probs', 'f8', (max_channels + 1,)),
+        ('num_of_iter', 'i8'),
+        ('process_time', 'f8'),
+        ('warm_started', '?'),
+        ('cache_hit', '?'),
+    ])
+
+
+def _fixed(values, width: int) -> np.ndarray:
+    """
+    Real parts of values padded with zeros (or cut) to width.
+    """
+    row = np.zeros(width)
+    values = np.real(np.asarray(values[:width]))
+    row[:len(values)] = values
+    return row
+
+
+def _solve_rows(params: dict, p_size: int, accuracy, warm_start: bool, calc_cache,
+                max_channels: int) -> np.ndarray:
+    """
+    Solve configurations of a chunk in order, each row is written to the structured array.
+    :param params: arrays of configurations, see _flatten_params
+    :return: structured array of the chunk
+    """
+    rows = np.zeros(len(params['arrival_rate']), dtype=get_result_dtype(p_size, max_channels))
+    state = None
+    for i, row in enumerate(rows):
+        stat = cached_run_calculation(
+            arrival_rate=float(params['arrival_rate'][i]), b=params['b'][i].tolist(),
+            b_w=params['b_w'][i].tolist(), b_c=params['b_c'][i].tolist(),
+            b_d=params['b_d'][i].tolist(), num_channels=int(params['num_channels'][i]),
+            p_size=p_size, accuracy=accuracy, warm_start=state, return_state=warm_start,
+            cache=calc_cache)
+        state = stat.pop('solver_state', None)
+
+        row['w'] = _fixed(stat['w'], NUM_MOMENTS)
+        row['v'] = _fixed(stat['v'], NUM_MOMENTS)
+        row['p'] = _fixed(stat['p'], p_size)
+        row['warmup_prob'] = np.real(stat['warmup_prob'])
+        row['cold_prob'] = np.real(stat['cold_prob'])
+        row['cold_delay_prob'] = np.real(stat['cold_delay_prob'])
+        row['servers_busy_probs'] = _fixed(stat['servers_busy_probs'], max_channels + 1)
+        # cache hits have no iterations and are not warm-started
+        row['num_of_iter'] = stat.get('num_of_iter') or 0
+        row['process_time'] = stat['process_time']
+        row['warm_started'] = bool(stat.get('warm_started', False)) and not stat['cache_hit']
+        row['cache_hit'] = stat['cache_hit']
+    return rows
+
+
+def _flatten_params(arrival_rate, b, b_w, b_c, b_d, num_channels) -> tuple[dict, tuple]:
+    """
+    Broadcast parameters of configurations together.
+    :return: ({name: array with configurations along the first axis}, shape of configurations)
+    """
+    moments = {'b': np.asarray(b, dtype=float), 'b_w': np.asarray(b_w, dtype=float),
+               'b_c': np.asarray(b_c, dtype=float), 'b_d': np.asarray(b_d, dtype=float)}
+    arrival_rate = np.asarray(arrival_rate, dtype=float)
+    num_channels = np.asarray(num_channels)
+    for name, value in moments.items():
+        if value.ndim == 0 or value.shape[-1] != NUM_MOMENTS:
+            raise ValueError(f"{name} must have {NUM_MOMENTS} moments along the last axis, "
+                             f"got shape {value.shape}")
+
+    shape = np.broadcast_shapes(arrival_rate.shape, num_channels.shape,
+                                *[value.shape[:-1] for value in moments.values()])
+    size = math.prod(shape)
+    params = {name: np.broadcast_to(value, shape + (NUM_MOMENTS,)).reshape(size, NUM_MOMENTS)
+              for name, value in moments.items()}
+    params['arrival_rate'] = np.broadcast_to(arrival_rate, shape).reshape(size)
+    params['num_channels'] = np.broadcast_to(num_channels, shape).reshape(size).astype(np.int64)
+    return params, shape
+
+
+def run_calculations(arrival_rate, b, b_w, b_c, b_d, num_channels, p_size: int = 10,
+                     accuracy: float = None, warm_start: bool = False, workers: int = 1,
+                     blas_threads=1, chunksize: int = None, calc_cache=None,
+                     executor=None) -> np.ndarray:
+    """
+    Numerical calculation of many configurations.
+    Args:
+        arrival_rate: arrival rates, array of configuration shape or scalar.
+        b, b_w, b_c, b_d: moments of service, warm-up, cooling and delay times,
+            arrays of configuration shape + (3,) or (3,).
+        num_channels: numbers of channels, array of configuration shape or scalar.
+        p_size (int): number of state probabilities.
+        accuracy (float): stopping tolerance of iterations, None - solver default.
+        warm_start (bool): solve configurations of a chunk as a continuation in row order,
+            see run_one_calc_vs_sim.run_calculation.
+        workers (int): worker processes, 1 - solve in this process.
+        blas_threads: BLAS/OpenMP threads per worker, None - do not limit.
+        chunksize (int): configurations per task, by default 4 tasks per worker.
+        calc_cache: CalcCache or None.
+        executor: running pool of parallel.process_pool to reuse across calls,
+            None - a pool of workers is started if workers > 1.
+    Returns:
+        np.ndarray: structured array of configuration shape with get_result_dtype fields.
+    """
+    params, shape = _flatten_params(arrival_rate, b, b_w, b_c, b_d, num_channels)
+    size = len(params['arrival_rate'])
+    max_channels = int(np.max(params['num_channels'], initial=1))
+    results = np.zeros(size, dtype=get_result_dtype(p_size, max_channels))
+
+    workers = max(1, min(workers, size))
+    if chunksize is None:
+        chunksize = max(1, math.ceil(size / (4 * workers)))
+    bounds = [(start, min(start + chunksize, size)) for start in range(0, size, chunksize)]
+    chunks = [{name: value[start:stop] for name, value in params.items()}
+              for start, stop in bounds]
+    args = (p_size, accuracy, warm_start, calc_cache, max_channels)
+
+    if executor is None and workers <= 1:
+        for (start, stop), chunk in zip(bounds, chunks):
+            results[start:stop] = _solve_rows(chunk, *args)
+    else:
+        pool = (contextlib.nullcontext(executor) if executor is not None
+                else process_pool(workers, blas_threads))
+        with pool as pool_executor:
+            futures = [pool_executor.submit(_solve_rows, chunk, *args) for chunk in chunks]
+            for (start, stop), future in zip(bounds, futures):
+                results[start:stop] = future.result()
+
+    return results.reshape(shape)
+
+
+def run_calculation_grid(qp: dict, axes: dict[str, np.ndarray], p_size: int = 10) -> dict:
+    """
+    Numerical calculation of all points of a grid, see grid.py. The 'parallel',
+    'calculation' (accuracy, warm_start) and 'cache' sections of parameters are used.
+    :param qp: dictionary of parameters
+    :param axes: {path: array of values}, the last axis changes fastest
+    :return: {'dims': list of axis paths, 'coords': axes,
+        'results': structured array of the grid shape, see get_result_dtype}
+    """
+    points = [make_grid_point(qp, values) for _index, values in iter_grid(axes)]
+    shape = tuple(len(values) for values in axes.values())
+    parallel = get_parallel_params(qp)
+    calc_params = qp.get('calculation') or {}
+
+    results = run_calculations(
+        arrival_rate=[point['arrival_rate'] for point in points],
+        b=[point['b'] for point in points], b_w=[point['b_w'] for point in points],
+        b_c=[point['b_c'] for point in points], b_d=[point['b_d'] for point in points],
+        num_channels=[point['num_channels'] for point in points], p_size=p_size,
+        accuracy=calc_params.get('accuracy'), warm_start=calc_params.get('warm_start', False),
+        workers=parallel['workers'], blas_threads=parallel['blas_threads'],
+        calc_cache=get_calc_cache(qp))
+    return {'dims': list(axes), 'coords': dict(axes), 'results': results.reshape(shape)}
@@ -0,0 +1,322 @@
+"""
+Benchmarks of the solver and simulator hot paths.
+
+    python benchmark.py run --output bench/base.json [--quick]
+    python benchmark.py compare bench/base.json bench/new.json --threshold 0.1
+
+'run' measures over a grid of channels, utilization and service CV:
+- time and number of iterations of run_calculation,
+- throughput of one replication of VacationQueueingSystemSimulator ('sim') and of the
+  NumPy simulator of vacation_sim.py ('sim_numpy'), jobs per second,
+and the end-to-end time of run_all with reduced parameters. Results and versions
+of Python, numpy and most-queue are saved as JSON.
+'compare' matches entries of two results and flags regressions beyond the threshold,
+exit code is 1 if there are any.
+"""
+import contextlib
+import datetime
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from run_one_calc_vs_sim import run_calculation, simulate_replication
+from utils import calc_moments_by_mean_and_coev, read_parameters_from_yaml
+
+# axes of the benchmark grid, other parameters are taken at 'base' of base_parameters.yaml
+GRIDS = {
+    'full': {
+        'channels': [1, 2, 3, 5, 10, 20, 30],
+        'utilization': [0.1, 0.3, 0.5, 0.7, 0.85, 0.95],
+        'service_cv': [0.5, 1.2, 2.0],
+    },
+    'quick': {
+        'channels': [1, 3, 10, 30],
+        'utilization': [0.1, 0.7, 0.95],
+        'service_cv': [1.2],
+    },
+}
+
+# simulated jobs per replication of the throughput benchmark
+SIM_JOBS = 20_000
+
+# measured values and whether larger is better
+METRICS = {
+    'calc': {'time': False, 'num_of_iter': False},
+    'sim': {'jobs_per_second': True},
+    'sim_numpy': {'jobs_per_second': True},
+    'run_all': {'time': False},
+}
+
+
+def get_point_params(qp: dict, channels: int, utilization: float, service_cv: float) -> dict:
+    """
+    Arguments of run_calculation for a benchmark point.
+    """
+    service_mean = channels*utilization/qp['arrival_rate']
+    return {
+        'arrival_rate': qp['arrival_rate'],
+        'b': calc_moments_by_mean_and_coev(service_mean, service_cv),
+        'b_w': calc_moments_by_mean_and_coev(qp['warmup']['mean']['base'],
+                                             qp['warmup']['cv']['base']),
+        'b_c': calc_moments_by_mean_and_coev(qp['cooling']['mean']['base'],
+                                             qp['cooling']['cv']['base']),
+        'b_d': calc_moments_by_mean_and_coev(qp['delay']['mean']['base'],
+                                             qp['delay']['cv']['base']),
+        'num_channels': channels,
+    }
+
+
+def iter_grid_points(grid: dict):
+    """
+    Points of the benchmark grid as dicts with channels, utilization, service_cv.
+    """
+    for channels in grid['channels']:
+        for utilization in grid['utilization']:
+            for service_cv in grid['service_cv']:
+                yield {'channels': channels, 'utilization': utilization,
+                       'service_cv': service_cv}
+
+
+def measure(func, repeat: int) -> tuple[float, object]:
+    """
+    Best wall time of repeated calls, output of the solver and simulator is suppressed.
+    :return: (min time in seconds, result of the last call)
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_calculation(qp: dict, grid: dict, repeat: int) -> list[dict]:
+    """
+    Time and number of iterations of run_calculation at every point of the grid.
+    """
+    entries = []
+    for point in iter_grid_points(grid):
+        params = get_point_params(qp, **point)
+        elapsed, stat = measure(lambda: run_calculation(**params), repeat)
+        entries.append(dict(point, time=elapsed, num_of_iter=int(stat['num_of_iter'])))
+        print(f"calc n={point['channels']:2d} rho={point['utilization']:.2f} "
+              f"cv={point['service_cv']:.2f}: {elapsed:8.3f} s, {stat['num_of_iter']} iterations")
+    return entries
+
+
+def bench_simulation(qp: dict, grid: dict, repeat: int, num_of_jobs: int = SIM_JOBS,
+                     engine: str = 'most_queue') -> list[dict]:
+    """
+    Throughput of one seeded replication of the simulator at every point of the grid.
+    :param engine: simulation engine, see run_one_calc_vs_sim.ENGINES
+    """
+    entries = []
+    for point in iter_grid_points(grid):
+        params = get_point_params(qp, **point)
+        elapsed, _stat = measure(
+            lambda: simulate_replication(**params, num_of_jobs=num_of_jobs, seed=1,
+                                         engine=engine), repeat)
+        entries.append(dict(point, time=elapsed, jobs_per_second=num_of_jobs/elapsed))
+        print(f"sim {engine} n={point['channels']:2d} rho={point['utilization']:.2f} "
+              f"cv={point['service_cv']:.2f}: {num_of_jobs/elapsed:10.0f} jobs/s")
+    return entries
+
+
+def get_reduced_qp(qp: dict, workers: int) -> dict:
+    """
+    Parameters of the end-to-end benchmark: 3 points per axis, short simulations,
+    fixed seed, no caches, so every point is really computed.
+    """
+    qp = json.loads(json.dumps(qp))
+    qp['jobs_per_sim'] = 5000
+    qp['sim_to_average'] = 2
+    qp['channels']['max'] = 3
+    qp['utilization']['num_points'] = 2
+    qp['service']['cv']['num_points'] = 2
+    for name in ('warmup', 'cooling', 'delay'):
+        for moment in ('mean', 'cv'):
+            qp[name][moment]['num_points'] = 3
+    qp['parallel'] = dict(qp.get('parallel') or {}, workers=workers)
+    qp['simulation'] = dict(qp.get('simulation') or {}, seed=1, precision={'enabled': False})
+    qp['cache'] = dict(qp.get('cache') or {}, enabled=False, sim_enabled=False)
+    for sweep in (qp.get('sweeps') or {}).values():
+        sweep['enabled'] = False
+    qp['plots'] = dict(qp.get('plots') or {}, dpi=72)
+    return qp
+
+
+def bench_run_all(qp: dict, workers: int) -> dict:
+    """
+    Wall time of run_all with reduced parameters in a temporary results folder.
+    """
+    from main import run_all
+
+    reduced_qp = get_reduced_qp(qp, workers)
+    with tempfile.TemporaryDirectory() as results_folder:
+        elapsed, _ = measure(lambda: run_all(reduced_qp, results_folder=results_folder), 1)
+    print(f"run_all: {elapsed:.2f} s with {workers} workers")
+    return {'time': elapsed, 'workers': workers}
+
+
+def get_environment() -> dict:
+    """
+    Versions and machine of the benchmark run.
+    """
+    def version(package):
+        try:
+            return importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            return None
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cur_dir, check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'most_queue': version('most-queue'),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(qp: dict, output: str, grid_name: str = 'full', repeat: int = 3,
+        workers: int = 2, sections=('calc', 'sim', 'sim_numpy', 'run_all')) -> dict:
+    """
+    Run benchmarks and save results as JSON.
+    :param qp: dictionary of parameters, 'base' values of distributions are used
+    :param output: path of the JSON file
+    :param grid_name: key of GRIDS
+    :param repeat: calls per point, the best time is kept
+    :param workers: worker processes of the run_all benchmark
+    :param sections: benchmarks to run, keys of METRICS
+    :return: results
+    """
+    grid = GRIDS[grid_name]
+    results = {'environment': get_environment(), 'grid': grid_name, 'repeat': repeat}
+    if 'calc' in sections:
+        results['calc'] = bench_calculation(qp, grid, repeat)
+    if 'sim' in sections:
+        results['sim'] = bench_simulation(qp, grid, repeat)
+    if 'sim_numpy' in sections:
+        results['sim_numpy'] = bench_simulation(qp, grid, repeat, engine='numpy')
+    if 'run_all' in sections:
+        results['run_all'] = [bench_run_all(qp, workers)]
+
+    out_dir = os.path.dirname(os.path.abspath(output))
+    os.makedirs(out_dir, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved benchmark results to {output}")
+    return results
+
+
+def _entry_key(entry: dict) -> tuple:
+    return tuple(entry.get(name) for name in ('channels', 'utilization', 'service_cv'))
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1) -> list[dict]:
+    """
+    Compare two benchmark results entry by entry.
+    A regression is a change of a metric to the worse side by more than threshold,
+    relative to the base value.
+    :param base: results of run
+    :param new: results of run
+    :param threshold: relative tolerance, 0.1 - 10%
+    :return: list of regressions: section, point, metric, base and new values, change
+    """
+    regressions = []
+    for section, metrics in METRICS.items():
+        base_entries = {_entry_key(entry): entry for entry in base.get(section, [])}
+        new_entries = {_entry_key(entry): entry for entry in new.get(section, [])}
+        common = [key for key in base_entries if key in new_entries]
+        if not common:
+            continue
+
+        for metric, larger_is_better in metrics.items():
+            ratios = []
+            for key in common:
+                base_value = base_entries[key][metric]
+                new_value = new_entries[key][metric]
+                if not base_value:
+                    continue
+                change = new_value/base_value - 1.0
+                ratios.append(new_value/base_value)
+                worse = -change if larger_is_better else change
+                if worse > threshold:
+                    regressions.append({'section': section, 'point': key, 'metric': metric,
+                                        'base': base_value, 'new': new_value, 'change': change})
+            if ratios:
+                mean_change = float(np.exp(np.mean(np.log(ratios)))) - 1.0
+                print(f"{section:>8} {metric:>16}: {len(ratios):4d} points, "
+                      f"geometric mean change {mean_change:+7.1%}")
+    return regressions
+
+
+def print_regressions(regressions: list[dict], threshold: float):
+    """
+    Print regressions found by compare.
+    """
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}")
+        return
+    print(f"{len(regressions)} regressions beyond {threshold:.0%}:")
+    for reg in regressions:
+        point = "" if reg['point'] == (None, None, None) else \
+            "n={} rho={} cv={} ".format(*reg['point'])
+        print(f"  {reg['section']} {point}{reg['metric']}: "
+              f"{reg['base']:.4g} -> {reg['new']:.4g} ({reg['change']:+.1%})")
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run benchmarks")
+    run_parser.add_argument('--output', default="results/benchmarks/benchmark.json")
+    run_parser.add_argument('--quick', action='store_true', help="small grid")
+    run_parser.add_argument('--repeat', type=int, default=3, help="calls per point, best is kept")
+    run_parser.add_argument('--workers', type=int, default=2,
+                            help="worker processes of the run_all benchmark")
+    run_parser.add_argument('--only', nargs='+', choices=list(METRICS), default=list(METRICS),
+                            help="benchmarks to run")
+
+    compare_parser = commands.add_parser('compare', help="compare two results")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(read_parameters_from_yaml("base_parameters.yaml"), args.output,
+            grid_name='quick' if args.quick else 'full', repeat=args.repeat,
+            workers=args.workers, sections=args.only)
+    else:
+        with open(args.base, "r", encoding="utf-8") as f:
+            base_results = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new_results = json.load(f)
+        found = compare(base_results, new_results, args.threshold)
+        print_regressions(found, args.threshold)
+        sys.exit(1 if found else 0)
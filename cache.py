@@ -0,0 +1,403 @@
+"""
+Persistent on-disk caches of run_calculation and run_simulation results.
+
+Entries are stored in SQLite databases (safe for concurrent access
+from several worker processes).
+Calculation entries are evicted in LRU order when the cache grows
+over max_entries. Their keys are canonical: all times are scaled by the arrival rate,
+so configurations that differ only in time units hit the same entry.
+Simulation entries are single replications, so the number of averaged
+replications can be increased later without recomputing the stored ones.
+"""
+import hashlib
+import json
+import os
+import time
+from importlib import metadata
+
+import numpy as np
+from most_queue.theory.calc_params import TakahashiTakamiParams
+
+from instrumentation import log, merge_timings, span
+
+from run_one_calc_vs_sim import (
+    DEFAULT_ENGINE,
+    aggregate_replications,
+    describe_seed,
+    replication_seeds,
+    run_calculation,
+    run_replications,
+    run_simulation,
+)
+from sqlite_db import SqliteDatabase
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# significant digits kept in canonical keys, to hide float noise like 0.7000000000000001
+KEY_DIGITS = 12
+
+
+def get_library_version() -> str:
+    """
+    Version of most_queue, that is a part of every cache key.
+    """
+    try:
+        return metadata.version("most_queue")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _round(value: float) -> float:
+    return float(f"{float(value):.{KEY_DIGITS}g}")
+
+
+def scale_moments(moments: list[float], scale: float) -> list[float]:
+    """
+    Scale initial moments E[X^k], k=1, 2, 3 of time X to time X*scale.
+    """
+    return [float(m) * scale ** (k + 1) for k, m in enumerate(moments)]
+
+
+def calc_key(arrival_rate: float, b: list[float], b_w: list[float], b_c: list[float],
+             b_d: list[float], num_channels: int, p_size: int = 10, accuracy: float = None) -> str:
+    """
+    Canonical hash of run_calculation parameters.
+    Times are measured in mean interarrival times (arrival rate is scaled to 1),
+    so the key is invariant to the time scale.
+    """
+    if accuracy is None:
+        accuracy = TakahashiTakamiParams().accuracy
+
+    canonical = {
+        'b': [_round(m) for m in scale_moments(b, arrival_rate)],
+        'b_w': [_round(m) for m in scale_moments(b_w, arrival_rate)],
+        'b_c': [_round(m) for m in scale_moments(b_c, arrival_rate)],
+        'b_d': [_round(m) for m in scale_moments(b_d, arrival_rate)],
+        'num_channels': int(num_channels),
+        'p_size': int(p_size),
+        'accuracy': _round(accuracy),
+        'most_queue': get_library_version(),
+    }
+    text = json.dumps(canonical, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CalcCache(SqliteDatabase):
+    """
+    SQLite-backed LRU cache of run_calculation results.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        """
+        :param path: path to the database file, directories are created if needed
+        :param max_entries: maximum number of entries, least recently used are evicted
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        super().__init__(path)
+
+    def _create_tables(self, con):
+        con.execute("CREATE TABLE IF NOT EXISTS calc "
+                    "(key TEXT PRIMARY KEY, stat TEXT NOT NULL, last_access REAL NOT NULL)")
+        con.execute("CREATE INDEX IF NOT EXISTS calc_last_access ON calc (last_access)")
+        con.execute("CREATE TABLE IF NOT EXISTS counters "
+                    "(name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        con.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_entries': self.max_entries, 'hits': 0, 'misses': 0}
+
+    def get(self, key: str):
+        """
+        Return cached stat for the key or None, updates hit/miss counters.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT stat FROM calc WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                con.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+                return None
+            self.hits += 1
+            con.execute("UPDATE calc SET last_access = ? WHERE key = ?", (time.time(), key))
+            con.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+        return json.loads(row[0])
+
+    def put(self, key: str, stat: dict):
+        """
+        Store stat for the key and evict least recently used entries over max_entries.
+        """
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO calc VALUES (?, ?, ?)",
+                        (key, json.dumps(stat), time.time()))
+            con.execute("DELETE FROM calc WHERE key IN (SELECT key FROM calc "
+                        "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters of this process and of the database (all processes and runs).
+        """
+        with self._connect() as con:
+            counters = dict(con.execute("SELECT name, value FROM counters").fetchall())
+            size = con.execute("SELECT COUNT(*) FROM calc").fetchone()[0]
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'total_hits': counters.get('hits', 0), 'total_misses': counters.get('misses', 0),
+            'size': size,
+        }
+
+    def clear(self):
+        """
+        Remove all entries and reset counters.
+        """
+        with self._connect() as con:
+            con.execute("DELETE FROM calc")
+            con.execute("UPDATE counters SET value = 0")
+        self.hits = 0
+        self.misses = 0
+
+
+class SimCache(SqliteDatabase):
+    """
+    SQLite-backed cache of single simulation replications.
+    """
+
+    def _create_tables(self, con):
+        con.execute("CREATE TABLE IF NOT EXISTS sim "
+                    "(key TEXT NOT NULL, rep INTEGER NOT NULL, stat TEXT NOT NULL, "
+                    "PRIMARY KEY (key, rep))")
+
+    def get_replications(self, key: str) -> dict:
+        """
+        Return stored replications of the key as dict {replication index: stat}.
+        """
+        with self._connect() as con:
+            rows = con.execute("SELECT rep, stat FROM sim WHERE key = ?", (key,)).fetchall()
+        return {rep: json.loads(stat) for rep, stat in rows}
+
+    def put_replication(self, key: str, rep: int, stat: dict):
+        """
+        Store statistics of replication number rep, an existing entry is kept.
+        """
+        with self._connect() as con:
+            con.execute("INSERT OR IGNORE INTO sim VALUES (?, ?, ?)",
+                        (key, int(rep), json.dumps(to_json(stat))))
+
+    def get_stats(self) -> dict:
+        """
+        Number of stored points and replications.
+        """
+        with self._connect() as con:
+            points, reps = con.execute(
+                "SELECT COUNT(DISTINCT key), COUNT(*) FROM sim").fetchone()
+        return {'points': points, 'replications': reps}
+
+
+def sim_key(arrival_rate: float, b: list[float], b_w: list[float], b_c: list[float],
+            b_d: list[float], num_channels: int, num_of_jobs: int, p_size: int = 10,
+            seed=None, engine: str = DEFAULT_ENGINE, crn: bool = False,
+            controls: bool = False) -> str:
+    """
+    Hash of run_simulation parameters (except the number of replications).
+    Replications of seeded runs are stored under their master seed,
+    replications of unseeded runs are interchangeable and share one key.
+    The engine, crn and controls are parts of the key only if they are not default,
+    so replications stored before they were added are still found.
+    """
+    if seed is not None and not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    canonical = {
+        'arrival_rate': _round(arrival_rate),
+        'b': [_round(m) for m in b],
+        'b_w': [_round(m) for m in b_w],
+        'b_c': [_round(m) for m in b_c],
+        'b_d': [_round(m) for m in b_d],
+        'num_channels': int(num_channels),
+        'num_of_jobs': int(num_of_jobs),
+        'p_size': int(p_size),
+        'seed': describe_seed(seed),
+        'most_queue': get_library_version(),
+    }
+    if engine != DEFAULT_ENGINE:
+        canonical['engine'] = engine
+    if crn:
+        canonical['crn'] = True
+    if controls:
+        canonical['controls'] = True
+    text = json.dumps(canonical, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_calc_cache(qp: dict):
+    """
+    Create the calculation cache from the 'cache' section of parameters.
+    :param qp: dictionary of parameters
+    :return: CalcCache or None, if the cache is disabled
+    """
+    params = qp.get('cache') or {}
+    if not params.get('enabled', False):
+        return None
+    path = params.get('calc_path', os.path.join('results', 'cache', 'calc.sqlite'))
+    if not os.path.isabs(path):
+        path = os.path.join(CUR_DIR, path)
+    return CalcCache(path, max_entries=params.get('max_entries', 100_000))
+
+
+def get_sim_cache(qp: dict):
+    """
+    Create the simulation cache from the 'cache' section of parameters.
+    :param qp: dictionary of parameters
+    :return: SimCache or None, if the cache is disabled
+    """
+    params = qp.get('cache') or {}
+    if not params.get('sim_enabled', False):
+        return None
+    path = params.get('sim_path', os.path.join('results', 'cache', 'sim.sqlite'))
+    if not os.path.isabs(path):
+        path = os.path.join(CUR_DIR, path)
+    return SimCache(path)
+
+
+def cached_run_calculation(arrival_rate: float, b: list[float],
+                           b_w: list[float], b_c: list[float], b_d: list[float],
+                           num_channels: int, p_size: int = 10, accuracy: float = None,
+                           warm_start: dict = None, return_state: bool = False,
+                           cache: CalcCache = None):
+    """
+    run_calculation with memoization in the on-disk cache.
+    Arguments are the same as for run_calculation, if cache is None the call is not cached.
+    Returned stat has 'cache_hit' flag, for hits process_time is the lookup time
+    and there is no solver state, timings has the only span cache_lookup.
+    """
+    if cache is None:
+        stat = run_calculation(arrival_rate=arrival_rate, b=b, b_w=b_w, b_c=b_c, b_d=b_d,
+                               num_channels=num_channels, p_size=p_size, accuracy=accuracy,
+                               warm_start=warm_start, return_state=return_state)
+        stat['cache_hit'] = False
+        return stat
+
+    num_start = time.process_time()
+    timings = {}
+    with span(timings, 'cache_lookup'):
+        key = calc_key(arrival_rate, b, b_w, b_c, b_d, num_channels,
+                       p_size=p_size, accuracy=accuracy)
+        stat = cache.get(key)
+
+    if stat is not None:
+        # stored moments are in canonical time units (arrival rate = 1)
+        stat['w'] = scale_moments(stat['w'], 1.0 / arrival_rate)
+        stat['v'] = scale_moments(stat['v'], 1.0 / arrival_rate)
+        stat['process_time'] = time.process_time() - num_start
+        stat['cache_hit'] = True
+        stat['timings'] = timings
+        return stat
+
+    stat = run_calculation(arrival_rate=arrival_rate, b=b, b_w=b_w, b_c=b_c, b_d=b_d,
+                           num_channels=num_channels, p_size=p_size, accuracy=accuracy,
+                           warm_start=warm_start, return_state=return_state)
+
+    stored = dict(stat)
+    stored.pop('solver_state', None)
+    stored['w'] = scale_moments(stat['w'], arrival_rate)
+    stored['v'] = scale_moments(stat['v'], arrival_rate)
+    cache.put(key, to_json(stored))
+
+    stat['cache_hit'] = False
+    return stat
+
+
+def get_replications(params: dict, indices, seed=None, workers: int = 1,
+                     cache: SimCache = None) -> tuple[list[dict], list[int]]:
+    """
+    Replications with given indices: stored ones are taken from the cache,
+    missing ones are simulated and stored.
+    :param params: kwargs of simulate_replication except seed
+    :param indices: indices of replications
+    :param seed: master seed of the simulation
+    :param workers: number of worker processes
+    :param cache: SimCache or None
+    :return: (list of replication stats in the order of indices,
+        list of positions of simulated replications in that list)
+    """
+    indices = list(indices)
+    stored = {}
+    key = None
+    if cache is not None:
+        key = sim_key(seed=seed, **params)
+        stored = cache.get_replications(key)
+
+    missing = [pos for pos, rep in enumerate(indices) if rep not in stored]
+    if missing:
+        if len(missing) < len(indices):
+            log(f"{len(indices) - len(missing)} replications found in cache, "
+                f"simulating {len(missing)}")
+        missing_indices = [indices[pos] for pos in missing]
+        new_replications = run_replications(params, replication_seeds(seed, missing_indices),
+                                            workers)
+        for rep, rep_stat in zip(missing_indices, new_replications):
+            if cache is not None:
+                cache.put_replication(key, rep, rep_stat)
+            stored[rep] = rep_stat
+
+    return [stored[rep] for rep in indices], missing
+
+
+def cached_run_simulation(arrival_rate: float, b: list[float],
+                          b_w: list[float], b_c: list[float], b_d: list[float],
+                          num_channels: int, num_of_jobs: int = 300_000,
+                          ave_num: int = 10, p_size: int = 10, seed=None, workers: int = 1,
+                          engine: str = DEFAULT_ENGINE, crn: bool = False,
+                          cache: SimCache = None):
+    """
+    run_simulation, that reuses replications stored in the cache
+    and simulates only the missing ones.
+    Arguments are the same as for run_simulation, if cache is None the call is not cached.
+    Returned stat has 'cached_replications' - number of replications taken from the cache,
+    process_time and timings are of the newly simulated replications.
+    """
+    if cache is None:
+        stat = run_simulation(arrival_rate=arrival_rate, b=b, b_w=b_w, b_c=b_c, b_d=b_d,
+                              num_channels=num_channels, num_of_jobs=num_of_jobs,
+                              ave_num=ave_num, p_size=p_size, seed=seed, workers=workers,
+                              engine=engine, crn=crn)
+        stat['cached_replications'] = 0
+        return stat
+
+    wall_start = time.perf_counter()
+
+    params = {
+        'arrival_rate': arrival_rate, 'b': b, 'b_w': b_w, 'b_c': b_c, 'b_d': b_d,
+        'num_channels': num_channels, 'num_of_jobs': num_of_jobs, 'p_size': p_size,
+        'engine': engine, 'crn': crn}
+    replications, missing = get_replications(params, range(ave_num), seed=seed,
+                                             workers=workers, cache=cache)
+    cached_num = ave_num - len(missing)
+
+    stat = aggregate_replications(replications)
+    stat["process_time"] = np.sum(
+        [replications[rep]["process_time"] for rep in missing])
+    # stored replications cost nothing in this run
+    stat["timings"] = dict(merge_timings(replications[rep].get("timings") for rep in missing),
+                           aggregation=stat["timings"]["aggregation"])
+    stat["wall_time"] = time.perf_counter() - wall_start
+    stat["cached_replications"] = cached_num
+
+    return stat
+
+
+def to_json(value):
+    """
+    Convert results with numpy and complex values to JSON-serializable form.
+    """
+    if isinstance(value, dict):
+        return {name: to_json(v) for name, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return to_json(value.tolist())
+    if isinstance(value, complex):
+        return value.real
+    if hasattr(value, 'item'):
+        return to_json(value.item())
+    return value
@@ -5,74 +5,35 @@ and plot the wait time averages for both calculation and simulation.
 """
 import os
 
-import numpy as np
+from grid import get_grid_axes, run_grid
 
-from run_one_calc_vs_sim import (
-    calc_moments_by_mean_and_coev,
-    run_calculation,
-    run_simulation,
-)
-from utils import calc_rel_error_percent, plot_probs, plot_w1, plot_w1_errors
 
-
-def run_cool_delay_average(qp, save_path: str = None):
+def get_cool_delay_average_axes(qp) -> dict:
     """
-    Run simulation and calculation for different cooling delay mean times
+    Axes of run_cool_delay_average grid.
     """
-    cools = np.linspace(qp['delay']['mean']['min'], qp['delay']
-                        ['mean']['max'], qp['delay']['mean']['num_points'])
-
-    w1_num = []
-    w1_sim = []
-
-    cool_probs_num = []
-    cool_probs_sim = []
-
-    total_num_time = 0
-    total_sim_time = 0
-
-    w1_rel_errors = []
-
-    service_mean = qp['channels']['base'] * \
-        qp['utilization']['base']/qp['arrival_rate']
-
-    b = calc_moments_by_mean_and_coev(
-        service_mean, qp['service']['cv']['base'])
+    return get_grid_axes(qp, {'delay.mean': None})
 
-    b_w = calc_moments_by_mean_and_coev(
-        qp['warmup']['mean']['base'], qp['warmup']['cv']['base'])
-    b_c = calc_moments_by_mean_and_coev(
-        qp['cooling']['mean']['base'], qp['cooling']['cv']['base'])
 
-    for cool_num, cool_ave in enumerate(cools):
-        print(
-            f"Start {cool_num + 1}/{len(cools)} with cooling delay={cool_ave:0.3f}... ")
-
-        b_d = calc_moments_by_mean_and_coev(
-            cool_ave, qp['delay']['cv']['base'])
-
-        num_results = run_calculation(
-            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b, b_w=b_w, b_c=b_c, b_d=b_d)
-        sim_results = run_simulation(
-            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b, b_w=b_w, b_c=b_c, b_d=b_d,
-            num_of_jobs=qp['jobs_per_sim'], ave_num=qp['sim_to_average'])
-
-        w1_num.append(num_results["w"][0])
-        w1_sim.append(sim_results["w"][0])
-        w1_rel_errors.append(calc_rel_error_percent(
-            sim_results["w"][0], num_results["w"][0]))
-
-        cool_probs_num.append(num_results["cold_delay_prob"])
-        cool_probs_sim.append(sim_results["cold_delay_prob"])
+def run_cool_delay_average(qp, save_path: str = None, results: dict = None):
+    """
+    Run simulation and calculation for different cooling delay mean times
+    Results of run_grid over get_cool_delay_average_axes(qp) may be passed precomputed.
+    """
+    if results is None:
+        results = run_grid(qp, get_cool_delay_average_axes(qp))
 
-        total_num_time += num_results["process_time"]
-        total_sim_time += sim_results["process_time"]
+    cools = results['coords']['delay.mean']
+    w1_num = results['w1_num'].tolist()
+    w1_sim = results['w1_sim'].tolist()
+    w1_rel_errors = results['w1_rel_error'].tolist()
 
-    # Print process time comparison
-    print(f"Total process time for num: {total_num_time:.4g}")
-    print(f"Total process time for sim: {total_sim_time:.4g}")
+    cool_probs_num = results['cold_delay_prob_num'].tolist()
+    cool_probs_sim = results['cold_delay_prob_sim'].tolist()
 
     if save_path:
+        from plots import plot_probs, plot_w1, plot_w1_errors
+
         wait_time_save_path = os.path.join(
             save_path, 'w1_vs_cool_delay_ave.png')
 
@@ -94,64 +55,32 @@ def run_cool_delay_average(qp, save_path: str = None):
     return cools, w1_num, w1_sim, w1_rel_errors, cool_probs_sim, cool_probs_num
 
 
-def run_cool_delay_cv(qp, save_path: str = None):
+def get_cool_delay_cv_axes(qp) -> dict:
     """
-    Run simulation and calculation for different cooling delay coefficient of variation
+    Axes of run_cool_delay_cv grid.
     """
-    cool_cvs = np.linspace(qp['delay']['cv']['min'], qp['delay']['cv']['max'],
-                           qp['delay']['cv']['num_points'])
-
-    w1_num = []
-    w1_sim = []
-    w1_rel_errors = []
-
-    cool_probs_num = []
-    cool_probs_sim = []
-
-    total_num_time = 0
-    total_sim_time = 0
-
-    service_mean = qp['channels']['base'] * \
-        qp['utilization']['base']/qp['arrival_rate']
-
-    b = calc_moments_by_mean_and_coev(
-        service_mean, qp['service']['cv']['base'])
-
-    b_w = calc_moments_by_mean_and_coev(
-        qp['warmup']['mean']['base'], qp['warmup']['cv']['base'])
-    b_c = calc_moments_by_mean_and_coev(
-        qp['cooling']['mean']['base'], qp['cooling']['cv']['base'])
-
-    for cool_num, cool_cv in enumerate(cool_cvs):
-        print(
-            f"Start {cool_num + 1}/{len(cool_cvs)} with cooling delay cv={cool_cv:0.3f}... ")
+    return get_grid_axes(qp, {'delay.cv': None})
 
-        b_d = calc_moments_by_mean_and_coev(
-            qp['delay']['mean']['base'], cool_cv)
 
-        num_results = run_calculation(
-            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b, b_w=b_w, b_c=b_c, b_d=b_d)
-        sim_results = run_simulation(
-            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b, b_w=b_w, b_c=b_c, b_d=b_d,
-            num_of_jobs=qp['jobs_per_sim'], ave_num=qp['sim_to_average'])
-
-        w1_num.append(num_results["w"][0])
-        w1_sim.append(sim_results["w"][0])
-
-        w1_rel_errors.append(calc_rel_error_percent(
-            sim_results["w"][0], num_results["w"][0]))
-
-        cool_probs_num.append(num_results["cold_delay_prob"])
-        cool_probs_sim.append(sim_results["cold_delay_prob"])
+def run_cool_delay_cv(qp, save_path: str = None, results: dict = None):
+    """
+    Run simulation and calculation for different cooling delay coefficient of variation
+    Results of run_grid over get_cool_delay_cv_axes(qp) may be passed precomputed.
+    """
+    if results is None:
+        results = run_grid(qp, get_cool_delay_cv_axes(qp))
 
-        total_num_time += num_results["process_time"]
-        total_sim_time += sim_results["process_time"]
+    cool_cvs = results['coords']['delay.cv']
+    w1_num = results['w1_num'].tolist()
+    w1_sim = results['w1_sim'].tolist()
+    w1_rel_errors = results['w1_rel_error'].tolist()
 
-    # Print process time comparison
-    print(f"Total process time for num: {total_num_time:.4g}")
-    print(f"Total process time for sim: {total_sim_time:.4g}")
+    cool_probs_num = results['cold_delay_prob_num'].tolist()
+    cool_probs_sim = results['cold_delay_prob_sim'].tolist()
 
     if save_path:
+        from plots import plot_probs, plot_w1, plot_w1_errors
+
         wait_time_save_path = os.path.join(
             save_path, 'w1_vs_cool_delay_cv.png')
 
@@ -0,0 +1,153 @@
+"""
+Cost layer of the best delay scripts (find_best_delay_w1.py, find_best_delay_tail.py).
+
+The solve grid (utilization x delay mean, other parameters at 'base') is computed once
+by batch_calc.run_calculation_grid and stored as .npz, costs do not depend on it.
+Cost parameters of any number of configurations are stacked along the first axis of
+arrays (get_cost_params), so costs of all configurations and all grid cells are evaluated
+at once and best delays are taken along the delay axis (find_best_delays) without solving.
+"""
+import json
+import os
+
+import numpy as np
+
+from batch_calc import run_calculation_grid
+from grid import AXES, get_axis_values, get_node, load_grid_results, save_grid_results
+
+DELAY_AXES = ('utilization', 'delay.mean')
+
+COST_PARAMS = ('wait_cost', 'server_cost', 'idle_bonus',
+               'sla.waiting_time', 'sla.probability', 'sla.fail_cost')
+
+
+def get_delay_axes(qp: dict) -> dict[str, np.ndarray]:
+    """
+    Axes of the solve grid, delays change fastest.
+    """
+    return {path: get_axis_values(qp, path) for path in DELAY_AXES}
+
+
+def _get_solve_signature(qp: dict) -> str:
+    """
+    Parameters of solves, that are not axes of the grid, as a JSON string.
+    A stored grid is reused only if its signature matches.
+    """
+    params = {path: get_node(qp, path)['base'] for path in AXES if path not in DELAY_AXES}
+    params['arrival_rate'] = qp['arrival_rate']
+    params['accuracy'] = (qp.get('calculation') or {}).get('accuracy')
+    return json.dumps(params, sort_keys=True)
+
+
+def solve_delay_grid(qp: dict, save_path: str = None) -> dict:
+    """
+    Numerical solutions over utilization x delay mean.
+    :param qp: dictionary of parameters
+    :param save_path: .npz file of the stored grid or None. The stored grid is loaded
+        if its axes and solve parameters match qp, otherwise the grid is solved and saved.
+    :return: {'dims', 'coords', 'results' - structured array, see batch_calc.get_result_dtype,
+        'signature'}
+    """
+    axes = get_delay_axes(qp)
+    signature = _get_solve_signature(qp)
+
+    if save_path is not None and os.path.exists(save_path):
+        grid = load_grid_results(save_path)
+        if (str(grid.get('signature')) == signature and grid['dims'] == list(axes)
+                and all(np.array_equal(grid['coords'][path], values)
+                        for path, values in axes.items())):
+            print(f"Solve grid is loaded from {save_path}")
+            return grid
+
+    grid = run_calculation_grid(qp, axes)
+    grid['signature'] = np.array(signature)
+    if save_path is not None:
+        os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+        save_grid_results(grid, save_path)
+    return grid
+
+
+def _get_value(tree: dict, path: str):
+    node = tree
+    for name in path.split('.'):
+        if not isinstance(node, dict) or name not in node:
+            return None
+        node = node[name]
+    return node
+
+
+def get_cost_params(qp: dict, cost_configs: list[dict] = None, ndim: int = 0) -> dict:
+    """
+    Cost parameters of configurations as arrays.
+    :param qp: dictionary of parameters, values of parameters missing in a configuration
+    :param cost_configs: list of configurations, each is a (nested) dict of COST_PARAMS
+        overrides, like {'wait_cost': 2.0, 'sla': {'probability': 0.95}}. None - qp only.
+    :param ndim: number of grid dimensions, arrays are shaped to broadcast against them
+    :return: {path: array of shape (number of configurations,) + (1,)*ndim}
+    """
+    cost_configs = cost_configs or [{}]
+    params = {}
+    for path in COST_PARAMS:
+        values = []
+        for config in cost_configs:
+            value = _get_value(config, path)
+            values.append(_get_value(qp, path) if value is None else value)
+        params[path] = np.array(values, dtype=float).reshape((-1,) + (1,)*ndim)
+    return params
+
+
+def calc_server_costs(results: np.ndarray, cost_params: dict, num_channels: int) -> np.ndarray:
+    """
+    Server costs of solved configurations, see calc_costs of the best delay scripts.
+    :param results: structured array of solutions
+    :param cost_params: see get_cost_params
+    :param num_channels: number of channels of solutions
+    :return: array of shape (number of configurations,) + results.shape
+    """
+    probs = results['servers_busy_probs']
+    busy = probs @ np.arange(probs.shape[-1])
+    return (cost_params['server_cost']*busy
+            - cost_params['idle_bonus']*probs[..., 0]*num_channels)
+
+
+def find_best_delays(grid: dict, total_costs: np.ndarray, wait_costs: np.ndarray,
+                     server_costs: np.ndarray) -> dict:
+    """
+    Best delays of the solve grid for every cost configuration and utilization factor.
+    :param grid: see solve_delay_grid
+    :param total_costs, wait_costs, server_costs: arrays of shape
+        (number of configurations,) + grid shape
+    :return: {'utilization', 'best_delay', 'total_cost', 'server_cost', 'wait_cost'},
+        curves are of shape (number of configurations, number of utilization factors),
+        costs are taken at the best delay
+    """
+    index = np.argmin(total_costs, axis=-1)[..., np.newaxis]
+    return {
+        'utilization': grid['coords']['utilization'],
+        'best_delay': grid['coords']['delay.mean'][index[..., 0]],
+        'total_cost': np.take_along_axis(total_costs, index, axis=-1)[..., 0],
+        'server_cost': np.take_along_axis(server_costs, index, axis=-1)[..., 0],
+        'wait_cost': np.take_along_axis(wait_costs, index, axis=-1)[..., 0],
+    }
+
+
+def get_cost_configs(qp: dict) -> list[dict]:
+    """
+    Cost configurations of the 'best_delay' section, [{}] - parameters of qp only.
+    """
+    return (qp.get('best_delay') or {}).get('cost_configs') or [{}]
+
+
+def print_best_delays(curves_by_name: dict[str, dict], cost_configs: list[dict]):
+    """
+    Best delays of every cost function and configuration, one row per utilization factor.
+    :param curves_by_name: {cost function name: see find_best_delays}
+    :param cost_configs: configurations of the curves, see get_cost_configs
+    """
+    for name, curves in curves_by_name.items():
+        for config, delays, costs in zip(cost_configs, curves['best_delay'],
+                                         curves['total_cost']):
+            print(f"{name} {json.dumps(config)}")
+            print(f"{'rho':>6} {'best delay':>11} {'total cost':>11}")
+            for rho, delay, cost in zip(curves['utilization'], delays, costs):
+                print(f"{rho:6.3f} {delay:11.3f} {cost:11.4f}")
@@ -0,0 +1,464 @@
+"""
+Confidence intervals of simulation estimates,
+precision-targeted simulation with a sequential stopping rule,
+single long runs with MSER truncation and batch means and
+replications with control variates.
+"""
+import time
+
+import numpy as np
+from scipy import stats
+
+from cache import get_replications
+from instrumentation import log, merge_timings, span
+from run_one_calc_vs_sim import DEFAULT_ENGINE, aggregate_replications
+from vacation_sim import get_gamma_params, get_state_path, simulate_trace
+
+# statistics of replications adjusted by control variates, besides state probabilities
+CONTROL_TARGETS = ('w1', 'w2', 'w3', 'v1', 'v2', 'v3',
+                   'warmup_prob', 'cold_prob', 'cold_delay_prob')
+
+
+def get_replication_value(rep: dict, name: str) -> float:
+    """
+    Value of a target statistic in replication stats.
+    :param rep: replication stats, see simulate_replication
+    :param name: 'w1', 'w2', 'w3', 'v1', 'v2', 'v3' for moments of waiting and sojourn times,
+        or a key of rep like 'cold_prob', 'warmup_prob', 'cold_delay_prob'
+    """
+    if name[0] in ('w', 'v') and name[1:].isdigit():
+        return rep[name[0]][int(name[1:]) - 1]
+    return rep[name]
+
+
+def calc_confidence_interval(values, confidence: float = 0.95) -> tuple[float, float]:
+    """
+    Student-t confidence interval of the mean of independent observations.
+    :param values: observations (replication or batch means)
+    :param confidence: confidence level
+    :return: (mean, half width), half width is inf for less than two observations
+    """
+    values = np.asarray(values, dtype=float)
+    mean = float(np.mean(values))
+    if len(values) < 2:
+        return mean, np.inf
+    std_err = np.std(values, ddof=1) / np.sqrt(len(values))
+    return mean, float(stats.t.ppf(0.5 + confidence / 2, len(values) - 1) * std_err)
+
+
+def calc_relative_half_width(mean: float, half_width: float) -> float:
+    """
+    Half width of confidence interval relative to the estimate.
+    """
+    if mean == 0:
+        return 0.0 if half_width == 0 else np.inf
+    return abs(half_width / mean)
+
+
+def run_simulation_to_precision(arrival_rate: float, b: list[float],
+                                b_w: list[float], b_c: list[float], b_d: list[float],
+                                num_channels: int, num_of_jobs: int = 50_000,
+                                rel_half_width: float = 0.02, confidence: float = 0.95,
+                                targets=('w1',), min_replications: int = 3,
+                                max_jobs: int = 3_000_000, p_size: int = 10, seed=None,
+                                workers: int = 1, engine: str = DEFAULT_ENGINE,
+                                crn: bool = False, cache=None):
+    """
+    Simulation, that adds replications until the relative half width of
+    confidence intervals of all targets is less than rel_half_width,
+    or the number of simulated jobs reaches max_jobs.
+    Args:
+        arrival_rate, b, b_w, b_c, b_d, num_channels, p_size, seed: see run_simulation
+        num_of_jobs (int): The number of jobs in one replication.
+        rel_half_width (float): Target half width of confidence intervals relative to the estimates.
+        confidence (float): Confidence level.
+        targets: Names of target statistics, see get_replication_value.
+        min_replications (int): The number of replications before the first check.
+        max_jobs (int): Cap of the total number of simulated jobs.
+        workers (int): The number of worker processes, replications are added
+            by max(workers, 1) at a time.
+        engine (str): simulator of replications, see run_one_calc_vs_sim.ENGINES.
+        crn (bool): common random numbers, see run_one_calc_vs_sim.simulate_replication.
+        cache: SimCache or None.
+    Returns:
+        dict: statistics as returned by run_simulation and
+            'ci' - {target: [low, high]}, 'rel_half_width' - {target: achieved value},
+            'replications', 'total_jobs', 'converged'.
+    """
+    wall_start = time.perf_counter()
+
+    params = {
+        'arrival_rate': arrival_rate, 'b': b, 'b_w': b_w, 'b_c': b_c, 'b_d': b_d,
+        'num_channels': num_channels, 'num_of_jobs': num_of_jobs, 'p_size': p_size,
+        'engine': engine, 'crn': crn}
+    max_replications = max(min_replications, max_jobs // num_of_jobs)
+
+    replications = []
+    # whether each replication was simulated in this call, not taken from the cache
+    new_flags = []
+    process_time = 0.0
+    next_num = min(min_replications, max_replications)
+
+    while True:
+        new_replications, missing = get_replications(
+            params, range(len(replications), next_num), seed=seed, workers=workers, cache=cache)
+        process_time += sum(new_replications[pos]["process_time"] for pos in missing)
+        new_flags.extend(pos in missing for pos in range(len(new_replications)))
+        replications.extend(new_replications)
+
+        intervals = {name: calc_confidence_interval(
+            [get_replication_value(rep, name) for rep in replications], confidence)
+            for name in targets}
+        achieved = {name: calc_relative_half_width(*interval)
+                    for name, interval in intervals.items()}
+
+        converged = all(value <= rel_half_width for value in achieved.values())
+        if converged or len(replications) >= max_replications:
+            break
+        next_num = min(len(replications) + max(workers, 1), max_replications)
+
+    log(f"Stopped after {len(replications)} replications, "
+        f"relative half width: {achieved}")
+
+    stat = aggregate_replications(replications)
+    stat["process_time"] = process_time
+    stat["timings"] = dict(merge_timings(rep.get("timings") for rep, is_new in
+                                         zip(replications, new_flags) if is_new),
+                           aggregation=stat["timings"]["aggregation"])
+    stat["wall_time"] = time.perf_counter() - wall_start
+    stat["ci"] = {name: [mean - half, mean + half] for name, (mean, half) in intervals.items()}
+    stat["rel_half_width"] = achieved
+    stat["replications"] = len(replications)
+    stat["total_jobs"] = len(replications) * num_of_jobs
+    stat["converged"] = converged
+
+    return stat
+
+
+def calc_reference_wait(arrival_rate: float, b: list[float],
+                        num_channels: int) -> tuple[float, str]:
+    """
+    Mean waiting time in the M/G/n queue without vacations with gamma service,
+    if it is known exactly: for one channel (Pollaczek-Khinchine formula) and for
+    exponential service (Erlang C formula).
+    :return: (mean waiting time, 'exact') or (None, 'unknown')
+    """
+    load = arrival_rate * b[0]
+    if num_channels == 1:
+        return arrival_rate * b[1] / (2 * (1 - load)), 'exact'
+
+    shape, _scale = get_gamma_params(b)
+    if abs(shape - 1.0) < 1e-9:
+        # Erlang B by recursion over channels, then Erlang C
+        erlang_b = 1.0
+        for k in range(1, num_channels + 1):
+            erlang_b = load * erlang_b / (k + load * erlang_b)
+        utilization = load / num_channels
+        erlang_c = erlang_b / (1 - utilization * (1 - erlang_b))
+        return erlang_c * b[0] / (num_channels - load), 'exact'
+
+    return None, 'unknown'
+
+
+def calc_control_means(arrival_rate: float, b: list[float],
+                       num_channels: int) -> tuple[dict, str]:
+    """
+    Expectations of control variates of a replication, see vacation_sim.calc_controls.
+    The reference wait is a control only if its expectation is exact: a numerical
+    approximation would bias the corrected estimates towards it.
+    :return: ({control name: expectation}, source of the reference wait, see calc_reference_wait)
+    """
+    control_means = {'interarrival': 1.0 / arrival_rate, 'service': b[0]}
+    reference_wait, source = calc_reference_wait(arrival_rate, b, num_channels)
+    if source == 'exact':
+        control_means['reference_wait'] = reference_wait
+    return control_means, source
+
+
+def calc_control_variate_estimates(values, controls, control_means,
+                                   confidence: float = 0.95):
+    """
+    Control variate estimates of means of several outputs: the mean of each output
+    is corrected by the deviations of means of controls from their expectations,
+    coefficients are fitted by least squares over observations.
+    :param values: (observations, outputs) array
+    :param controls: (observations, controls) array
+    :param control_means: expectations of controls
+    :param confidence: confidence level
+    :return: (estimates, half widths of confidence intervals, variance reduction factors)
+        - arrays over outputs, the factor is the variance of observations of an output
+        over the variance of its regression residuals
+    """
+    values = np.asarray(values, dtype=float)
+    controls = np.asarray(controls, dtype=float)
+    num, num_controls = controls.shape
+    dof = num - num_controls - 1
+    if dof < 1:
+        raise ValueError(f"{num} observations are not enough for {num_controls} "
+                         f"control variates, at least {num_controls + 2} are needed")
+
+    centered = controls - np.mean(controls, axis=0)
+    deviations = values - np.mean(values, axis=0)
+    coefs = np.linalg.lstsq(centered, deviations, rcond=None)[0]
+
+    estimates = np.mean(values, axis=0) - (np.mean(controls, axis=0) - control_means) @ coefs
+    residual_var = np.sum((deviations - centered @ coefs) ** 2, axis=0) / dof
+    half_widths = stats.t.ppf(0.5 + confidence / 2, dof) * np.sqrt(residual_var / num)
+    reduction = np.divide(np.var(values, axis=0, ddof=1), residual_var,
+                          out=np.ones_like(residual_var), where=residual_var > 0)
+    return estimates, half_widths, reduction
+
+
+def run_simulation_control_variates(arrival_rate: float, b: list[float],
+                                    b_w: list[float], b_c: list[float], b_d: list[float],
+                                    num_channels: int, num_of_jobs: int = 300_000,
+                                    ave_num: int = 10, confidence: float = 0.95,
+                                    p_size: int = 10, seed=None, workers: int = 1,
+                                    crn: bool = False, cache=None):
+    """
+    Simulation by replications of the NumPy simulator with control variates.
+    Every replication records means of interarrival and service times of its jobs and
+    the mean waiting time of the same jobs in the queue without vacations
+    (vacation_sim.calc_controls). The reference wait is used only when its expectation
+    is exact (one channel or exponential service), see calc_control_means.
+    Estimates are corrected by the deviations of the controls from the expectations.
+    The queue without vacations gives most of the reduction under heavy load,
+    when vacations are rare and waiting times of both queues nearly coincide.
+    Args:
+        arrival_rate, b, b_w, b_c, b_d, num_channels, num_of_jobs, ave_num, p_size, seed,
+            workers, crn: see run_simulation, ave_num must be at least 5.
+        confidence (float): Confidence level.
+        cache: SimCache or None.
+    Returns:
+        dict: statistics as returned by run_simulation, corrected by the controls, and
+            'ci' - {target: [low, high]}, 'rel_half_width' - {target: achieved value},
+            'variance_reduction' - {target: variance reduction factor},
+            'raw' - {target: mean of replications} for CONTROL_TARGETS,
+            'reference_wait_source', 'replications', 'cached_replications'.
+    """
+    wall_start = time.perf_counter()
+
+    params = {
+        'arrival_rate': arrival_rate, 'b': b, 'b_w': b_w, 'b_c': b_c, 'b_d': b_d,
+        'num_channels': num_channels, 'num_of_jobs': num_of_jobs, 'p_size': p_size,
+        'engine': 'numpy', 'crn': crn, 'controls': True}
+    replications, missing = get_replications(params, range(ave_num), seed=seed,
+                                             workers=workers, cache=cache)
+
+    stat = aggregate_replications(replications)
+    timings = dict(merge_timings(replications[rep].get("timings") for rep in missing),
+                   aggregation=stat["timings"]["aggregation"])
+
+    with span(timings, 'control_variates'):
+        control_means, source = calc_control_means(arrival_rate, b, num_channels)
+        names = list(control_means)
+        values = [[get_replication_value(rep, name) for name in CONTROL_TARGETS] + rep["p"]
+                  for rep in replications]
+        controls = [[rep["controls"][name] for name in names] for rep in replications]
+        estimates, half_widths, reduction = calc_control_variate_estimates(
+            values, controls, [control_means[name] for name in names], confidence)
+
+    num_targets = len(CONTROL_TARGETS)
+    corrected = dict(zip(CONTROL_TARGETS, estimates[:num_targets].tolist()))
+    stat["raw"] = {name: get_replication_value(stat, name) for name in CONTROL_TARGETS}
+    stat["w"] = [corrected[f'w{k}'] for k in range(1, 4)]
+    stat["v"] = [corrected[f'v{k}'] for k in range(1, 4)]
+    # corrections of small probabilities can overshoot the bounds
+    stat["p"] = np.clip(estimates[num_targets:], 0.0, 1.0).tolist()
+    for name in ('warmup_prob', 'cold_prob', 'cold_delay_prob'):
+        stat[name] = float(np.clip(corrected[name], 0.0, 1.0))
+
+    stat["process_time"] = np.sum([replications[rep]["process_time"] for rep in missing])
+    stat["timings"] = timings
+    stat["wall_time"] = time.perf_counter() - wall_start
+    stat["ci"] = {name: [corrected[name] - half, corrected[name] + half]
+                  for name, half in zip(CONTROL_TARGETS, half_widths.tolist())}
+    stat["rel_half_width"] = {name: calc_relative_half_width(corrected[name], half)
+                              for name, half in zip(CONTROL_TARGETS, half_widths.tolist())}
+    stat["variance_reduction"] = dict(zip(CONTROL_TARGETS, reduction[:num_targets].tolist()))
+    stat["reference_wait_source"] = source
+    stat["replications"] = ave_num
+    stat["cached_replications"] = ave_num - len(missing)
+
+    log(f"Control variates: variance reduction of w1 {stat['variance_reduction']['w1']:.3g}, "
+        f"{source} reference wait")
+    return stat
+
+
+def calc_mser_truncation(values, batch_size: int = 5, max_fraction: float = 0.5) -> int:
+    """
+    Length of the initial transient by MSER-m rule: observations are averaged by batches
+    of batch_size, the truncation point minimizes the squared standard error of the mean
+    of the remaining batches. Only the first max_fraction of the run is considered.
+    :param values: observations in the order of the run
+    :return: number of leading observations to delete
+    """
+    num_batches = len(values) // batch_size
+    if num_batches < 2:
+        return 0
+    means = np.mean(np.reshape(values[:num_batches*batch_size], (num_batches, batch_size)),
+                    axis=1)
+
+    # sums over batches from k to the end for every truncation point k
+    remaining = np.arange(num_batches, 0, -1)
+    sums = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum(means[::-1] ** 2)[::-1]
+    mser = (squares - sums ** 2 / remaining) / remaining ** 2
+
+    last = max(1, int(num_batches*max_fraction))
+    return int(np.argmin(mser[:last])) * batch_size
+
+
+def calc_lag1_correlation(values) -> float:
+    """
+    Correlation of successive values of a series of at least 3 values.
+    A series without variance (e.g. a probability, that is zero in all batches)
+    has no correlation, 0.0 is returned.
+    """
+    values = np.asarray(values, dtype=float)
+    head, tail = values[:-1], values[1:]
+    if np.ptp(head) == 0 or np.ptp(tail) == 0:
+        return 0.0
+    return float(np.corrcoef(head, tail)[0, 1])
+
+
+def _job_batches(values: np.ndarray, num_batches: int) -> np.ndarray:
+    """
+    Split observations into num_batches batches of equal size, the remainder is dropped.
+    """
+    size = len(values) // num_batches
+    return np.reshape(values[:size*num_batches], (num_batches, size))
+
+
+def _time_batch_state_probs(times: np.ndarray, levels: np.ndarray, bounds: np.ndarray,
+                            p_size: int) -> np.ndarray:
+    """
+    Fraction of time with j jobs in the system in every time batch.
+    :param times, levels: step function of the number of jobs, see vacation_sim.get_state_path
+    :param bounds: boundaries of time batches
+    :return: array (number of batches, p_size)
+    """
+    num_batches = len(bounds) - 1
+    # boundaries of batches are added as steps, that do not change the level
+    bound_levels = np.concatenate(([0], levels))[np.searchsorted(times, bounds, 'right')]
+    all_times = np.concatenate((times, bounds))
+    order = np.argsort(all_times, kind='stable')
+    all_times = all_times[order]
+    all_levels = np.concatenate((levels, bound_levels))[order]
+
+    durations = np.diff(all_times)
+    starts = all_times[:-1]
+    inside = (starts >= bounds[0]) & (starts < bounds[-1])
+    batch = np.minimum(np.searchsorted(bounds, starts[inside], 'right') - 1, num_batches - 1)
+    # states over p_size are collected in one extra column
+    level = np.minimum(all_levels[:-1][inside], p_size)
+
+    time_in_state = np.bincount(batch*(p_size + 1) + level, weights=durations[inside],
+                                minlength=num_batches*(p_size + 1))
+    time_in_state = np.reshape(time_in_state, (num_batches, p_size + 1))
+    return time_in_state[:, :p_size] / np.diff(bounds)[:, None]
+
+
+def _time_batch_phase_probs(played: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """
+    Fraction of time in a vacation phase in every time batch.
+    :param played: array of (start, end) of played phases
+    :param bounds: boundaries of time batches
+    """
+    if len(played) == 0:
+        return np.zeros(len(bounds) - 1)
+    overlap = (np.minimum(played[:, 1:2], bounds[None, 1:])
+               - np.maximum(played[:, 0:1], bounds[None, :-1]))
+    return np.sum(np.clip(overlap, 0.0, None), axis=0) / np.diff(bounds)
+
+
+def run_simulation_batch_means(arrival_rate: float, b: list[float],
+                               b_w: list[float], b_c: list[float], b_d: list[float],
+                               num_channels: int, num_of_jobs: int = 1_000_000,
+                               num_batches: int = 20, mser_batch_size: int = 5,
+                               confidence: float = 0.95, p_size: int = 10, seed=None,
+                               crn: bool = False):
+    """
+    Simulation by one long run of the NumPy simulator. The initial transient is removed
+    by MSER truncation of waiting times, the rest of the run is split into batches:
+    moments of waiting and sojourn times are batched by jobs, state and vacation phase
+    probabilities - by equal time intervals. Point estimates are means of batch means,
+    confidence intervals are Student-t intervals over batches.
+    Args:
+        arrival_rate, b, b_w, b_c, b_d, num_channels, p_size, seed, crn: see run_simulation
+        num_of_jobs (int): The number of served jobs of the run, including the transient.
+        num_batches (int): The number of batches, at least 3 for the lag-1 correlation.
+        mser_batch_size (int): Waiting times are averaged by batches of this size for MSER.
+        confidence (float): Confidence level.
+    Returns:
+        dict: statistics as returned by run_simulation and
+            'ci' - {target: [low, high]}, 'rel_half_width' - {target: achieved value}
+            for w1..w3, v1..v3 and vacation phase probabilities,
+            'truncated_jobs', 'truncation_time', 'batches', 'total_jobs',
+            'lag1_correlation' - {target: correlation of successive batch means},
+            small values confirm that batches are nearly independent.
+    """
+    if num_batches < 3:
+        raise ValueError(f"Batch means need at least 3 batches, got {num_batches}")
+
+    wall_start = time.perf_counter()
+    num_start = time.process_time()
+    timings = {}
+
+    with span(timings, 'event_loop') as record:
+        trace = simulate_trace(arrival_rate, b, b_w, b_c, b_d, num_channels,
+                               num_of_jobs=num_of_jobs, seed=seed, crn=crn)
+        record['jobs'] = num_of_jobs
+
+    with span(timings, 'aggregation'):
+        arrivals, starts, ends = trace['arrivals'], trace['starts'], trace['ends']
+        end_time = trace['end_time']
+
+        # jobs enter channels in arrival order, so taken jobs are a prefix of all jobs
+        waits = (starts - arrivals)[starts <= end_time]
+        truncated = calc_mser_truncation(waits, mser_batch_size)
+        truncation_time = float(arrivals[truncated])
+
+        kept = np.arange(len(arrivals)) >= truncated
+        served = kept & (ends <= end_time)
+        wait_batches = _job_batches(waits[truncated:], num_batches)
+        sojourn_batches = _job_batches((ends - arrivals)[served], num_batches)
+
+        batch_means = {}
+        for k in range(1, 4):
+            batch_means[f'w{k}'] = np.mean(wait_batches ** k, axis=1)
+            batch_means[f'v{k}'] = np.mean(sojourn_batches ** k, axis=1)
+
+        bounds = np.linspace(truncation_time, end_time, num_batches + 1)
+        times, levels = get_state_path(arrivals, ends, end_time)
+        state_probs = _time_batch_state_probs(times, levels, bounds, p_size)
+        for name, phase in (('warmup_prob', 'warmup'), ('cold_prob', 'cooling'),
+                            ('cold_delay_prob', 'delay')):
+            batch_means[name] = _time_batch_phase_probs(trace['phases'][phase], bounds)
+
+        intervals = {name: calc_confidence_interval(values, confidence)
+                     for name, values in batch_means.items()}
+
+    stat = {
+        "w": [intervals[f'w{k}'][0] for k in range(1, 4)],
+        "v": [intervals[f'v{k}'][0] for k in range(1, 4)],
+        "p": np.mean(state_probs, axis=0).tolist(),
+        "warmup_prob": intervals['warmup_prob'][0],
+        "cold_prob": intervals['cold_prob'][0],
+        "cold_delay_prob": intervals['cold_delay_prob'][0],
+        "process_time": time.process_time() - num_start,
+        "wall_time": time.perf_counter() - wall_start,
+        "ci": {name: [mean - half, mean + half] for name, (mean, half) in intervals.items()},
+        "rel_half_width": {name: calc_relative_half_width(*interval)
+                           for name, interval in intervals.items()},
+        "lag1_correlation": {name: calc_lag1_correlation(values)
+                             for name, values in batch_means.items()},
+        "truncated_jobs": truncated,
+        "truncation_time": truncation_time,
+        "batches": num_batches,
+        "total_jobs": num_of_jobs,
+        "timings": timings,
+    }
+    log(f"Batch means: {truncated} jobs truncated, relative half width of w1: "
+        f"{stat['rel_half_width']['w1']:.3g}")
+    return stat
@@ -1,26 +1,16 @@
 """
 Find best cooling delay for a given set of parameters and utilization factor.
 """
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 
-from run_one_calc_vs_sim import calc_moments_by_mean_and_coev, run_calculation
-from utils import read_parameters_from_yaml
+from cache import cached_run_calculation, get_calc_cache
+from delay_costs import (calc_server_costs, find_best_delays, get_cost_configs, get_cost_params,
+                         print_best_delays, solve_delay_grid)
+from optimization import CountingFunction, bisect_boundary, minimize_bracketed
+from run_one_calc_vs_sim import calc_moments_by_mean_and_coev
+from utils import progress, read_parameters_from_yaml
 from most_queue.rand_distribution import GammaDistribution, Weibull
 
-SMALL_SIZE = 12
-MEDIUM_SIZE = 14
-BIGGER_SIZE = 16
-
-plt.rc('font', size=SMALL_SIZE)          # controls default text sizes
-plt.rc('axes', titlesize=MEDIUM_SIZE)     # fontsize of the axes title
-plt.rc('axes', labelsize=MEDIUM_SIZE)    # fontsize of the x and y labels
-plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('legend', fontsize=MEDIUM_SIZE)    # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
-
 
 def calc_cv(b: list[float]) -> float:
     """
@@ -55,94 +45,262 @@ def calc_wait_cost(qp: dict, w: list[float], approximation: str = 'weibull') ->
     return 0.0
 
 
-def run(qp, wait_cost_calc_func=calc_wait_cost):
+def calc_wait_costs(cost_params: dict, w: np.ndarray, approximation: str = 'weibull'
+                    ) -> np.ndarray:
     """
-    Find best cooling delay for a given set of parameters and utilization factor.
-    :param qp: dictionary of parameters
-    :param wait_cost: cost of waiting for
-    :param server_cost: cost of running the server
-    :param wait_cost_calc_func: function to calculate waiting cost
-    :return: best cooling delay
+    Waiting (SLA) costs of arrays of solutions, see calc_wait_cost.
+    Distribution parameters are fitted once per solution, tails are evaluated
+    for all cost configurations at once.
+    :param cost_params: see delay_costs.get_cost_params
+    :param w: moments of waiting time, array of shape grid shape + (3,)
+    :return: array of shape (number of configurations,) + grid shape
     """
-    server_cost = qp['server_cost']
-    idle_bonus = qp['idle_bonus']
+    mean = w[..., 0]
+    cv = calc_cv(np.moveaxis(w, -1, 0))
+    waiting_time = cost_params['sla.waiting_time']
+    if approximation == 'weibull':
+        k = np.empty(mean.shape)
+        big_w = np.empty(mean.shape)
+        for index in np.ndindex(mean.shape):
+            weibull_params = Weibull.get_params_by_mean_and_coev(mean[index], cv[index])
+            k[index], big_w[index] = weibull_params.k, weibull_params.W
+        tail = np.exp(-np.power(waiting_time, k) / big_w)
+    elif approximation == 'gamma':
+        # parameters and cdf of the gamma distribution are computed on arrays
+        gamma_params = GammaDistribution.get_params_by_mean_and_coev(mean, cv)
+        tail = 1.0 - GammaDistribution.get_cdf(gamma_params, waiting_time)
+    else:
+        raise ValueError("Invalid approximation for waiting time distribution")
+    return np.where(tail > 1.0 - cost_params['sla.probability'],
+                    cost_params['sla.fail_cost'], 0.0)
 
-    rhoes = np.linspace(qp['utilization']['min'], qp['utilization']['max'],
-                        qp['utilization']['num_points'])
 
-    delays = np.linspace(qp['delay']['mean']['min'], qp['delay']['mean']['max'],
-                         qp['delay']['mean']['num_points'])
+def calc_costs(qp, num_results, wait_cost_calc_func=calc_wait_cost) -> tuple[float, float, float]:
+    """
+    Calculate costs of a solved configuration.
+    :param qp: dictionary of parameters
+    :param num_results: results of run_calculation
+    :param wait_cost_calc_func: function to calculate waiting (SLA) cost
+    :return: total cost, wait cost, server cost
+    """
+    server_busy_probs = num_results["servers_busy_probs"]
+    servers_cost = np.sum(
+        [i*prob*qp['server_cost'] for i, prob in enumerate(server_busy_probs)])
+    servers_cost -= server_busy_probs[0] * \
+        qp['channels']['base']*qp['idle_bonus']
 
-    total_costs = np.zeros((len(rhoes), len(delays)))
-    wait_costs = np.zeros((len(rhoes), len(delays)))
-    server_costs = np.zeros((len(rhoes), len(delays)))
+    wait_cost = wait_cost_calc_func(w=num_results["w"], qp=qp)
+    return wait_cost + servers_cost, wait_cost, servers_cost
 
+
+def calc_cost_grid(qp, grid, cost_configs=None, wait_cost_calc_func=calc_wait_cost,
+                   approximation='weibull'):
+    """
+    Costs of all cells of the solve grid for each cost configuration, without solving.
+    :param qp: dictionary of parameters
+    :param grid: see delay_costs.solve_delay_grid
+    :param cost_configs: list of cost parameter overrides, see delay_costs.get_cost_params
+    :param wait_cost_calc_func: calc_wait_cost - SLA cost by calc_wait_costs,
+        other functions are applied to every cell and configuration
+    :param approximation: approximation of the waiting time distribution
+    :return: total costs, wait costs, server costs, arrays of shape
+        (number of configurations,) + grid shape
+    """
+    results = grid['results']
+    cost_params = get_cost_params(qp, cost_configs, results.ndim)
+    server_costs = calc_server_costs(results, cost_params, qp['channels']['base'])
+    if wait_cost_calc_func is calc_wait_cost:
+        wait_costs = calc_wait_costs(cost_params, results['w'], approximation)
+    else:
+        wait_costs = np.zeros(server_costs.shape)
+        configs = cost_configs or [{}]
+        for config_num, config in enumerate(configs):
+            config_qp = dict(qp, **{name: value for name, value in config.items()
+                                    if name != 'sla'})
+            config_qp['sla'] = dict(qp['sla'], **(config.get('sla') or {}))
+            for index in np.ndindex(results.shape):
+                wait_costs[(config_num,) + index] = wait_cost_calc_func(
+                    w=results['w'][index], qp=config_qp)
+    return wait_costs + server_costs, wait_costs, server_costs
+
+
+def find_best_delay(qp, rho, wait_cost_calc_func=calc_wait_cost, tol=1e-2, num_bracket=5,
+                    calc_cache=None):
+    """
+    Find best cooling delay for one utilization factor.
+    SLA cost is a step function of the delay, so Brent method with bracketing
+    is applied to the smooth server cost only. If its minimum violates SLA,
+    boundaries of the SLA-feasible region (found by bisection between points
+    of the bracketing scan) are candidates too, the cheapest candidate is returned.
+    :param qp: dictionary of parameters
+    :param rho: utilization factor
+    :param wait_cost_calc_func: function to calculate waiting (SLA) cost
+    :param tol: tolerance of the best delay
+    :param num_bracket: number of points of the bracketing scan
+    :param calc_cache: CalcCache or None
+    :return: best delay, total cost, server cost, wait cost at the best delay, number of solves
+    """
     b_w = calc_moments_by_mean_and_coev(
         qp['warmup']['mean']['base'], qp['warmup']['cv']['base'])
     b_c = calc_moments_by_mean_and_coev(
         qp['cooling']['mean']['base'], qp['cooling']['cv']['base'])
 
-    with tqdm(total=len(rhoes) * len(delays), desc="Calculating costs") as pbar:
-        for rho_num, rho in enumerate(rhoes):
+    service_mean = qp['channels']['base']*rho/qp['arrival_rate']
+    b = calc_moments_by_mean_and_coev(service_mean, qp['service']['cv']['base'])
 
-            service_mean = qp['channels']['base']*rho/qp['arrival_rate']
+    def solve(delay):
+        b_d = calc_moments_by_mean_and_coev(delay, qp['delay']['cv']['base'])
+        num_results = cached_run_calculation(
+            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'],
+            b=b, b_w=b_w, b_c=b_c, b_d=b_d, cache=calc_cache)
+        return calc_costs(qp, num_results, wait_cost_calc_func)
 
-            b = calc_moments_by_mean_and_coev(
-                service_mean, qp['service']['cv']['base'])
+    costs = CountingFunction(solve)
 
-            for delay_num, delay in enumerate(delays):
+    def is_feasible(delay):
+        return costs(delay)[1] == 0
 
-                b_d = calc_moments_by_mean_and_coev(
-                    delay, qp['delay']['cv']['base'])
+    low, high = qp['delay']['mean']['min'], qp['delay']['mean']['max']
+    best_server_delay, _cost = minimize_bracketed(
+        lambda delay: costs(delay)[2], low, high, num_bracket=num_bracket, tol=tol)
 
-                num_results = run_calculation(
-                    arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'],
-                    b=b, b_w=b_w, b_c=b_c, b_d=b_d)
+    candidates = [best_server_delay]
+    if not is_feasible(best_server_delay):
+        # points of the bracketing scan are already solved
+        scan = sorted(set(np.linspace(low, high, max(3, num_bracket))) | {best_server_delay})
+        for left, right in zip(scan[:-1], scan[1:]):
+            if is_feasible(left) != is_feasible(right):
+                inside, outside = (left, right) if is_feasible(left) else (right, left)
+                candidates.append(bisect_boundary(is_feasible, inside, outside, tol=tol))
 
-                server_busy_probs = num_results["servers_busy_probs"]
-                cur_servers_cost = np.sum(
-                    [i*prob*server_cost for i, prob in enumerate(server_busy_probs)])
-                cur_servers_cost -= server_busy_probs[0] * \
-                    qp['channels']['base']*idle_bonus
+    best_delay = min(candidates, key=lambda delay: costs(delay)[0])
+    total_cost, wait_cost, server_cost = costs(best_delay)
+    return best_delay, total_cost, server_cost, wait_cost, costs.calls
 
-                cur_wait_cost = wait_cost_calc_func(
-                    w=num_results["w"], qp=qp)
-                cur_total_cost = cur_wait_cost + cur_servers_cost
 
-                total_costs[rho_num, delay_num] = cur_total_cost
-                wait_costs[rho_num, delay_num] = cur_wait_cost
-                server_costs[rho_num, delay_num] = cur_servers_cost
+def run_brent(qp, wait_cost_calc_func=calc_wait_cost, tol=1e-2, num_bracket=5):
+    """
+    Find best cooling delay for each utilization factor with find_best_delay.
+    Costs are returned at the best delay.
+    :return: rhoes, best delays, total costs, server costs, wait costs
+    """
+    rhoes = np.linspace(qp['utilization']['min'], qp['utilization']['max'],
+                        qp['utilization']['num_points'])
 
-                pbar.update(1)
+    calc_cache = get_calc_cache(qp)
+    results = []
+    total_calls = 0
+    for rho in progress(rhoes, desc="Optimizing delays"):
+        *best, calls = find_best_delay(qp, rho, wait_cost_calc_func, tol=tol,
+                                       num_bracket=num_bracket, calc_cache=calc_cache)
+        results.append(best)
+        total_calls += calls
 
-    min_cost_index = np.argmin(total_costs, axis=1)
-    # find best cost for each rho
-    best_total_costs = np.min(total_costs, axis=1)
-    best_server_costs = np.min(server_costs, axis=1)
-    best_wait_costs = np.min(wait_costs, axis=1)
+    print(f"Solver calls: {total_calls} ({total_calls / len(rhoes):.1f} per utilization)")
 
-    # find best delay for each rho
-    best_delays = delays[min_cost_index]
+    best_delays, best_total_costs, best_server_costs, best_wait_costs = np.array(results).T
     return rhoes, best_delays, best_total_costs, best_server_costs, best_wait_costs
 
 
+def run(qp, wait_cost_calc_func=calc_wait_cost, mode='grid', tol=1e-2, num_bracket=5,
+        grid_path=None):
+    """
+    Find best cooling delay for a given set of parameters and utilization factor.
+    :param qp: dictionary of parameters
+    :param wait_cost: cost of waiting for
+    :param server_cost: cost of running the server
+    :param wait_cost_calc_func: function to calculate waiting cost
+    :param mode: 'grid' - evaluate all delays of the delay grid,
+        'brent' - step-aware bracketing and Brent method to tolerance tol, see find_best_delay
+    :param grid_path: .npz file of the stored solve grid (grid mode), see solve_delay_grid
+    :return: best cooling delay
+    """
+    if mode == 'brent':
+        return run_brent(qp, wait_cost_calc_func, tol=tol, num_bracket=num_bracket)
+    if mode != 'grid':
+        raise ValueError(f"Unknown mode {mode}")
+
+    grid = solve_delay_grid(qp, grid_path)
+    curves = find_best_delays(grid, *calc_cost_grid(qp, grid, None, wait_cost_calc_func))
+    return (curves['utilization'], curves['best_delay'][0], curves['total_cost'][0],
+            curves['server_cost'][0], curves['wait_cost'][0])
+
+
+def recost(qp, grid, cost_configs=None) -> dict[str, dict]:
+    """
+    Best delay curves of every cost configuration for Weibull and gamma approximations
+    of the waiting time distribution.
+    :param qp: dictionary of parameters
+    :param grid: see delay_costs.solve_delay_grid
+    :param cost_configs: see delay_costs.get_cost_params
+    :return: {approximation: see delay_costs.find_best_delays}
+    """
+    return {approximation: find_best_delays(grid, *calc_cost_grid(
+                qp, grid, cost_configs, calc_wait_cost, approximation=approximation))
+            for approximation in ('weibull', 'gamma')}
+
+
 if __name__ == "__main__":
 
+    import argparse
     import os
+    import time
+
+    from find_best_delay_w1 import print_validation
+    from plots import configure_by_params, plt, save_figure, show
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mode', choices=['grid', 'brent', 'validate', 'recost'], default='grid',
+                        help="validate - run both modes and compare them, "
+                        "recost - best delays of all best_delay.cost_configs on the solve grid")
+    parser.add_argument('--tol', type=float, default=1e-2, help="tolerance of the best delay")
+    parser.add_argument('--grid', default="results/best_delay_sla/grid.npz",
+                        help="stored solve grid of grid and recost modes")
+    args = parser.parse_args()
 
     # if results/best_delay does not exist
     if not os.path.exists("results/best_delay_sla"):
         os.makedirs("results/best_delay_sla")
 
     base_qp = read_parameters_from_yaml("base_parameters.yaml")
+    configure_by_params(base_qp)
 
     # only cooling for simplification
     base_qp['warmup']['mean']['base'] = 0.1
     base_qp['cooling']['mean']['base'] = 5.0
     base_qp['delay']['mean']['num_points'] = 20
 
-    rhos, best_delay, best_cost, best_server, best_wait = run(
-        base_qp, wait_cost_calc_func=calc_wait_cost)
+    if args.mode == 'recost':
+        configs = get_cost_configs(base_qp)
+        solve_grid = solve_delay_grid(base_qp, args.grid)
+        start = time.perf_counter()
+        all_curves = recost(base_qp, solve_grid, configs)
+        print(f"Costs of {len(configs)} configurations x {len(all_curves)} approximations: "
+              f"{(time.perf_counter() - start) * 1e3:.1f} ms")
+        print_best_delays(all_curves, configs)
+
+        _fig, ax = plt.subplots()
+        for name, curves in all_curves.items():
+            for config, delays in zip(configs, curves['best_delay']):
+                ax.plot(curves['utilization'], delays, label=f"{name} {config}")
+        ax.set_xlabel(r"$\rho$")
+        ax.set_ylabel("Cooling Delay")
+        ax.legend(fontsize='small')
+        save_figure(os.path.join('results/best_delay_sla', 'best_delay_recost.png'))
+        show()
+        plt.close(_fig)
+        raise SystemExit
+
+    if args.mode == 'validate':
+        grid_res = run(base_qp, wait_cost_calc_func=calc_wait_cost, mode='grid',
+                       grid_path=args.grid)
+        brent_res = run(base_qp, wait_cost_calc_func=calc_wait_cost, mode='brent', tol=args.tol)
+        print_validation(grid_res, brent_res)
+        rhos, best_delay, best_cost, best_server, best_wait = brent_res
+    else:
+        rhos, best_delay, best_cost, best_server, best_wait = run(
+            base_qp, wait_cost_calc_func=calc_wait_cost, mode=args.mode, tol=args.tol,
+            grid_path=args.grid)
 
     y_labels = ["Cooling Delay", "Total Cost", "Server Cost", 'Wait Cost']
 
@@ -156,7 +314,7 @@ if __name__ == "__main__":
 
         SAVE_PATH = f"{y_label.replace(' ', '_').lower()}.png"
 
-        plt.savefig(os.path.join('results/best_delay_sla', SAVE_PATH))
-        plt.show()
+        save_figure(os.path.join('results/best_delay_sla', SAVE_PATH))
+        show()
 
         plt.close(_fig)
@@ -1,24 +1,15 @@
 """
 Find best cooling delay for a given set of parameters and utilization factor.
 """
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 
-from run_one_calc_vs_sim import calc_moments_by_mean_and_coev, run_calculation
-from utils import read_parameters_from_yaml
+from cache import cached_run_calculation, get_calc_cache
+from delay_costs import (calc_server_costs, find_best_delays, get_cost_configs, get_cost_params,
+                         print_best_delays, solve_delay_grid)
+from optimization import CountingFunction, minimize_bracketed
+from run_one_calc_vs_sim import calc_moments_by_mean_and_coev
+from utils import progress, read_parameters_from_yaml
 
-SMALL_SIZE = 12
-MEDIUM_SIZE = 14
-BIGGER_SIZE = 16
-
-plt.rc('font', size=SMALL_SIZE)          # controls default text sizes
-plt.rc('axes', titlesize=MEDIUM_SIZE)     # fontsize of the axes title
-plt.rc('axes', labelsize=MEDIUM_SIZE)    # fontsize of the x and y labels
-plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('legend', fontsize=MEDIUM_SIZE)    # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
 
 def calc_wait_cost(w1: float, wait_cost: float,) -> float:
     """
@@ -41,94 +32,212 @@ def calc_no_linear_wait_cost(w1: float, wait_cost: float, alpha=0.7) -> float:
     return (w1 ** alpha)*wait_cost
 
 
-def run(qp, wait_cost_calc_func=calc_wait_cost):
+def calc_costs(qp, num_results, wait_cost_calc_func=calc_wait_cost) -> tuple[float, float, float]:
     """
-    Find best cooling delay for a given set of parameters and utilization factor.
+    Calculate costs of a solved configuration.
     :param qp: dictionary of parameters
-    :param wait_cost: cost of waiting for
-    :param server_cost: cost of running the server
+    :param num_results: results of run_calculation
     :param wait_cost_calc_func: function to calculate waiting cost
-    :return: best cooling delay
+    :return: total cost, wait cost, server cost
     """
-    wait_cost = qp['wait_cost']
-    server_cost = qp['server_cost']
-    idle_bonus = qp['idle_bonus']
+    server_busy_probs = num_results["servers_busy_probs"]
+    servers_cost = np.sum(
+        [i*prob*qp['server_cost'] for i, prob in enumerate(server_busy_probs)])
+    servers_cost -= server_busy_probs[0] * \
+        qp['channels']['base']*qp['idle_bonus']
 
-    rhoes = np.linspace(qp['utilization']['min'], qp['utilization']['max'],
-                        qp['utilization']['num_points'])
+    wait_cost = wait_cost_calc_func(
+        w1=num_results["w"][0], wait_cost=qp['wait_cost'])
+    return wait_cost + servers_cost, wait_cost, servers_cost
+
+
+def calc_cost_grid(qp, grid, cost_configs=None, wait_cost_calc_func=calc_wait_cost):
+    """
+    Costs of all cells of the solve grid for each cost configuration, without solving.
+    :param qp: dictionary of parameters
+    :param grid: see delay_costs.solve_delay_grid
+    :param cost_configs: list of cost parameter overrides, see delay_costs.get_cost_params
+    :param wait_cost_calc_func: function to calculate waiting cost, applied to arrays
+    :return: total costs, wait costs, server costs, arrays of shape
+        (number of configurations,) + grid shape
+    """
+    results = grid['results']
+    cost_params = get_cost_params(qp, cost_configs, results.ndim)
+    server_costs = calc_server_costs(results, cost_params, qp['channels']['base'])
+    wait_costs = np.broadcast_to(wait_cost_calc_func(
+        w1=results['w'][..., 0], wait_cost=cost_params['wait_cost']), server_costs.shape)
+    return wait_costs + server_costs, wait_costs, server_costs
 
-    delays = np.linspace(qp['delay']['mean']['min'], qp['delay']['mean']['max'],
-                         qp['delay']['mean']['num_points'])
 
-    total_costs = np.zeros((len(rhoes), len(delays)))
-    wait_costs = np.zeros((len(rhoes), len(delays)))
-    server_costs = np.zeros((len(rhoes), len(delays)))
+def find_best_delay(qp, rho, wait_cost_calc_func=calc_wait_cost, tol=1e-2, num_bracket=5,
+                    calc_cache=None):
+    """
+    Find best cooling delay for one utilization factor with a coarse bracketing scan
+    and bounded Brent method.
+    :param qp: dictionary of parameters
+    :param rho: utilization factor
+    :param wait_cost_calc_func: function to calculate waiting cost
+    :param tol: tolerance of the best delay
+    :param num_bracket: number of points of the bracketing scan
+    :param calc_cache: CalcCache or None
+    :return: best delay, total cost, server cost, wait cost at the best delay, number of solves
+    """
     b_w = calc_moments_by_mean_and_coev(
         qp['warmup']['mean']['base'], qp['warmup']['cv']['base'])
     b_c = calc_moments_by_mean_and_coev(
         qp['cooling']['mean']['base'], qp['cooling']['cv']['base'])
 
-    with tqdm(total=len(rhoes) * len(delays), desc="Calculating costs") as pbar:
-        for rho_num, rho in enumerate(rhoes):
+    service_mean = qp['channels']['base']*rho/qp['arrival_rate']
+    b = calc_moments_by_mean_and_coev(service_mean, qp['service']['cv']['base'])
 
-            service_mean = qp['channels']['base']*rho/qp['arrival_rate']
+    def solve(delay):
+        b_d = calc_moments_by_mean_and_coev(delay, qp['delay']['cv']['base'])
+        num_results = cached_run_calculation(
+            arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'],
+            b=b, b_w=b_w, b_c=b_c, b_d=b_d, cache=calc_cache)
+        return calc_costs(qp, num_results, wait_cost_calc_func)
 
-            b = calc_moments_by_mean_and_coev(
-                service_mean, qp['service']['cv']['base'])
+    costs = CountingFunction(solve)
+    best_delay, _best_cost = minimize_bracketed(
+        lambda delay: costs(delay)[0], qp['delay']['mean']['min'], qp['delay']['mean']['max'],
+        num_bracket=num_bracket, tol=tol)
 
-            for delay_num, delay in enumerate(delays):
+    total_cost, wait_cost, server_cost = costs(best_delay)
+    return best_delay, total_cost, server_cost, wait_cost, costs.calls
 
-                b_d = calc_moments_by_mean_and_coev(
-                    delay, qp['delay']['cv']['base'])
 
-                num_results = run_calculation(
-                    arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'],
-                    b=b, b_w=b_w, b_c=b_c, b_d=b_d)
+def run_brent(qp, wait_cost_calc_func=calc_wait_cost, tol=1e-2, num_bracket=5):
+    """
+    Find best cooling delay for each utilization factor with find_best_delay.
+    Costs are returned at the best delay.
+    :return: rhoes, best delays, total costs, server costs, wait costs
+    """
+    rhoes = np.linspace(qp['utilization']['min'], qp['utilization']['max'],
+                        qp['utilization']['num_points'])
 
-                server_busy_probs = num_results["servers_busy_probs"]
-                cur_servers_cost = np.sum(
-                    [i*prob*server_cost for i, prob in enumerate(server_busy_probs)])
-                cur_servers_cost -= server_busy_probs[0] * \
-                    qp['channels']['base']*idle_bonus
+    calc_cache = get_calc_cache(qp)
+    results = []
+    total_calls = 0
+    for rho in progress(rhoes, desc="Optimizing delays"):
+        *best, calls = find_best_delay(qp, rho, wait_cost_calc_func, tol=tol,
+                                       num_bracket=num_bracket, calc_cache=calc_cache)
+        results.append(best)
+        total_calls += calls
 
-                cur_wait_cost = wait_cost_calc_func(
-                    w1=num_results["w"][0], wait_cost=wait_cost)
-                cur_total_cost = cur_wait_cost + cur_servers_cost
+    print(f"Solver calls: {total_calls} ({total_calls / len(rhoes):.1f} per utilization)")
 
-                total_costs[rho_num, delay_num] = cur_total_cost
-                wait_costs[rho_num, delay_num] = cur_wait_cost
-                server_costs[rho_num, delay_num] = cur_servers_cost
+    best_delays, best_total_costs, best_server_costs, best_wait_costs = np.array(results).T
+    return rhoes, best_delays, best_total_costs, best_server_costs, best_wait_costs
 
-                pbar.update(1)
 
-    min_cost_index = np.argmin(total_costs, axis=1)
-    # find best cost for each rho
-    best_total_costs = np.min(total_costs, axis=1)
-    best_server_costs = np.min(server_costs, axis=1)
-    best_wait_costs = np.min(wait_costs, axis=1)
+def run(qp, wait_cost_calc_func=calc_wait_cost, mode='grid', tol=1e-2, num_bracket=5,
+        grid_path=None):
+    """
+    Find best cooling delay for a given set of parameters and utilization factor.
+    :param qp: dictionary of parameters
+    :param wait_cost: cost of waiting for
+    :param server_cost: cost of running the server
+    :param wait_cost_calc_func: function to calculate waiting cost
+    :param mode: 'grid' - evaluate all delays of the delay grid,
+        'brent' - bracketing and Brent method to tolerance tol, see run_brent
+    :param grid_path: .npz file of the stored solve grid (grid mode), see solve_delay_grid
+    :return: best cooling delay
+    """
+    if mode == 'brent':
+        return run_brent(qp, wait_cost_calc_func, tol=tol, num_bracket=num_bracket)
+    if mode != 'grid':
+        raise ValueError(f"Unknown mode {mode}")
 
-    # find best delay for each rho
-    best_delays = delays[min_cost_index]
-    return rhoes, best_delays, best_total_costs, best_server_costs, best_wait_costs
+    grid = solve_delay_grid(qp, grid_path)
+    curves = find_best_delays(grid, *calc_cost_grid(qp, grid, None, wait_cost_calc_func))
+    return (curves['utilization'], curves['best_delay'][0], curves['total_cost'][0],
+            curves['server_cost'][0], curves['wait_cost'][0])
+
+
+def recost(qp, grid, cost_configs=None) -> dict[str, dict]:
+    """
+    Best delay curves of every cost configuration for linear and non-linear waiting costs.
+    :param qp: dictionary of parameters
+    :param grid: see delay_costs.solve_delay_grid
+    :param cost_configs: see delay_costs.get_cost_params
+    :return: {cost function name: see delay_costs.find_best_delays}
+    """
+    return {func.__name__: find_best_delays(grid, *calc_cost_grid(qp, grid, cost_configs, func))
+            for func in (calc_wait_cost, calc_no_linear_wait_cost)}
+
+
+def print_validation(grid_results, brent_results):
+    """
+    Compare best delays and total costs found on the grid and by the optimizer.
+    """
+    print(f"{'rho':>6} {'grid delay':>11} {'opt delay':>10} {'grid cost':>10} {'opt cost':>10}")
+    for rho, grid_delay, opt_delay, grid_cost, opt_cost in zip(
+            grid_results[0], grid_results[1], brent_results[1],
+            grid_results[2], brent_results[2]):
+        print(f"{rho:6.3f} {grid_delay:11.3f} {opt_delay:10.3f} {grid_cost:10.4f} {opt_cost:10.4f}")
 
 
 if __name__ == "__main__":
 
+    import argparse
     import os
+    import time
+
+    from plots import configure_by_params, plt, save_figure, show
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mode', choices=['grid', 'brent', 'validate', 'recost'], default='grid',
+                        help="validate - run both modes and compare them, "
+                        "recost - best delays of all best_delay.cost_configs on the solve grid")
+    parser.add_argument('--tol', type=float, default=1e-2, help="tolerance of the best delay")
+    parser.add_argument('--grid', default="results/best_delay/grid.npz",
+                        help="stored solve grid of grid and recost modes")
+    args = parser.parse_args()
 
     # if results/best_delay does not exist
     if not os.path.exists("results/best_delay"):
         os.makedirs("results/best_delay")
 
     base_qp = read_parameters_from_yaml("base_parameters.yaml")
+    configure_by_params(base_qp)
 
     # only cooling for simplification
     base_qp['warmup']['mean']['base'] = 0.1
     base_qp['cooling']['mean']['base'] = 5.0
     base_qp['delay']['mean']['num_points'] = 10
 
-    rhos, best_delay, best_cost, best_server, best_wait = run(
-        base_qp, wait_cost_calc_func=calc_no_linear_wait_cost)
+    if args.mode == 'recost':
+        configs = get_cost_configs(base_qp)
+        solve_grid = solve_delay_grid(base_qp, args.grid)
+        start = time.perf_counter()
+        all_curves = recost(base_qp, solve_grid, configs)
+        print(f"Costs of {len(configs)} configurations x {len(all_curves)} cost functions: "
+              f"{(time.perf_counter() - start) * 1e3:.1f} ms")
+        print_best_delays(all_curves, configs)
+
+        _fig, ax = plt.subplots()
+        for name, curves in all_curves.items():
+            for config, delays in zip(configs, curves['best_delay']):
+                ax.plot(curves['utilization'], delays, label=f"{name} {config}")
+        ax.set_xlabel(r"$\rho$")
+        ax.set_ylabel("Cooling Delay")
+        ax.legend(fontsize='small')
+        save_figure(os.path.join('results/best_delay', 'best_delay_recost.png'))
+        show()
+        plt.close(_fig)
+        raise SystemExit
+
+    if args.mode == 'validate':
+        grid_res = run(base_qp, wait_cost_calc_func=calc_no_linear_wait_cost, mode='grid',
+                       grid_path=args.grid)
+        brent_res = run(base_qp, wait_cost_calc_func=calc_no_linear_wait_cost,
+                        mode='brent', tol=args.tol)
+        print_validation(grid_res, brent_res)
+        rhos, best_delay, best_cost, best_server, best_wait = brent_res
+    else:
+        rhos, best_delay, best_cost, best_server, best_wait = run(
+            base_qp, wait_cost_calc_func=calc_no_linear_wait_cost, mode=args.mode, tol=args.tol,
+            grid_path=args.grid)
 
     y_labels = ["Cooling Delay", "Total Cost", "Server Cost", 'Wait Cost']
 
@@ -142,7 +251,7 @@ if __name__ == "__main__":
 
         SAVE_PATH = f"{y_label.replace(' ', '_').lower()}.png"
 
-        plt.savefig(os.path.join('results/best_delay', SAVE_PATH))
-        plt.show()
+        save_figure(os.path.join('results/best_delay', SAVE_PATH))
+        show()
 
         plt.close(_fig)
@@ -0,0 +1,330 @@
+"""
+Declarative N-dimensional parameter grids.
+An axis is a path in the parameter tree ('utilization', 'channels', 'service.cv',
+'warmup.mean', 'cooling.cv', ...), all parameters that are not swept take their 'base' values.
+The Cartesian product of axes is expanded lazily, points are run over the parallel
+backend of sweep.py and results are gathered into labelled N-D arrays.
+
+User-defined grids are declared in the 'sweeps' section of base_parameters.yaml:
+
+    sweeps:
+        warmup_x_cooling:
+            enabled: true
+            axes:
+                warmup.mean: {num_points: 5}  # min, max from the parameter tree
+                cooling.mean: {values: [0.5, 1.0, 2.0]}
+"""
+import itertools
+import os
+
+import numpy as np
+
+from instrumentation import get_timings_log, log, print_timings_summary
+from journal import point_key
+from run_one_calc_vs_sim import calc_moments_by_mean_and_coev
+from sweep import make_point, run_points
+from utils import calc_rel_error_percent
+
+AXES = ('utilization', 'channels', 'service.cv', 'warmup.mean', 'warmup.cv',
+        'cooling.mean', 'cooling.cv', 'delay.mean', 'delay.cv')
+
+# quantities, that are stored for both calculation (_num) and simulation (_sim)
+QUANTITIES = ('w1', 'warmup_prob', 'cold_prob', 'cold_delay_prob', 'process_time')
+
+
+def get_node(qp: dict, path: str) -> dict:
+    """
+    Node of the parameter tree by dotted path, like 'cooling.mean'.
+    """
+    node = qp
+    for name in path.split('.'):
+        node = node[name]
+    return node
+
+
+def get_axis_values(qp: dict, path: str, spec: dict = None) -> np.ndarray:
+    """
+    Values of a grid axis.
+    :param qp: dictionary of parameters
+    :param path: one of AXES
+    :param spec: None or dict with 'values' - explicit list of values,
+        or 'min', 'max', 'num_points' - overrides of the parameter tree node.
+        Without num_points 'channels' axis takes all integers from min to max.
+    :return: array of axis values
+    """
+    if path not in AXES:
+        raise ValueError(f"Unknown grid axis {path}, expected one of {AXES}")
+    spec = spec or {}
+    if 'values' in spec:
+        return np.asarray(spec['values'])
+
+    node = get_node(qp, path)
+    low = spec.get('min', node['min'])
+    high = spec.get('max', node['max'])
+    num_points = spec.get('num_points', node.get('num_points'))
+    if path == 'channels' and num_points is None:
+        return np.arange(low, high + 1)
+    return np.linspace(low, high, num_points)
+
+
+def get_grid_axes(qp: dict, axes_spec: dict) -> dict[str, np.ndarray]:
+    """
+    Axes of a grid from its declaration.
+    :param qp: dictionary of parameters
+    :param axes_spec: {path: spec or None}, see get_axis_values. Order of axes
+        is the order of array dimensions, the last axis changes fastest.
+    :return: {path: array of values}
+    """
+    return {path: get_axis_values(qp, path, spec) for path, spec in axes_spec.items()}
+
+
+def iter_grid(axes: dict[str, np.ndarray]):
+    """
+    Lazily iterate over the Cartesian product of axes in C order.
+    :param axes: {path: array of values}
+    :return: iterator over (index tuple, {path: value})
+    """
+    names = list(axes)
+    for index in itertools.product(*[range(len(axes[name])) for name in names]):
+        yield index, {name: axes[name][i] for name, i in zip(names, index)}
+
+
+def make_grid_point(qp: dict, values: dict) -> dict:
+    """
+    Point dict for given values of swept parameters, others are taken at 'base'.
+    Service time mean follows from the utilization: n*rho/arrival_rate.
+    :param qp: dictionary of parameters
+    :param values: {path: value}
+    :return: point dict, see make_point
+    """
+    params = {path: get_node(qp, path)['base'] for path in AXES}
+    params.update(values)
+
+    num_channels = int(params['channels'])
+    service_mean = num_channels*params['utilization']/qp['arrival_rate']
+
+    return make_point(
+        qp, b=calc_moments_by_mean_and_coev(service_mean, params['service.cv']),
+        b_w=calc_moments_by_mean_and_coev(params['warmup.mean'], params['warmup.cv']),
+        b_c=calc_moments_by_mean_and_coev(params['cooling.mean'], params['cooling.cv']),
+        b_d=calc_moments_by_mean_and_coev(params['delay.mean'], params['delay.cv']),
+        num_channels=num_channels)
+
+
+def _get_quantity(results: dict, name: str) -> float:
+    if name == 'w1':
+        return results['w'][0]
+    return results[name]
+
+
+def _new_results(axes: dict[str, np.ndarray]) -> dict:
+    """
+    Empty results of a grid, see run_grid.
+    """
+    dims = list(axes)
+    shape = tuple(len(axes[name]) for name in dims)
+
+    results = {'dims': dims, 'coords': dict(axes)}
+    for name in QUANTITIES:
+        results[f'{name}_num'] = np.zeros(shape)
+        results[f'{name}_sim'] = np.zeros(shape)
+    results['w1_rel_error'] = np.zeros(shape)
+    return results
+
+
+def _set_point_results(results: dict, index: tuple, num_results: dict, sim_results: dict):
+    for name in QUANTITIES:
+        results[f'{name}_num'][index] = _get_quantity(num_results, name)
+        results[f'{name}_sim'][index] = _get_quantity(sim_results, name)
+    results['w1_rel_error'][index] = calc_rel_error_percent(
+        sim_results["w"][0], num_results["w"][0])
+
+
+def _print_process_times(num_time: float, sim_time: float):
+    # Print process time comparison
+    print(f"Total process time for num: {num_time:.4g}")
+    print(f"Total process time for sim: {sim_time:.4g}")
+
+
+def run_grid(qp: dict, axes: dict[str, np.ndarray]) -> dict:
+    """
+    Run calculation and simulation for all points of the grid.
+    :param qp: dictionary of parameters
+    :param axes: {path: array of values}, see get_grid_axes
+    :return: dict with 'dims' - list of axis paths, 'coords' - {path: values}
+        and N-D arrays of shape (len(values) for each axis):
+        '<quantity>_num', '<quantity>_sim' for each of QUANTITIES and 'w1_rel_error'
+    """
+    results = _new_results(axes)
+    point_results = []
+    dims = results['dims']
+    size = int(np.prod([len(axes[name]) for name in dims]))
+
+    indices = (index for index, _values in iter_grid(axes))
+    points = (make_grid_point(qp, values) for _index, values in iter_grid(axes))
+
+    # run_points drives the loop, so its final summaries are printed when it is exhausted
+    for num, ((num_results, sim_results), index) in enumerate(
+            zip(run_points(qp, points, num_points=size), indices)):
+        values = ", ".join(f"{name}={axes[name][i]:.4g}" for name, i in zip(dims, index))
+        log(f"Done {num + 1}/{size} with {values}... ")
+
+        _set_point_results(results, index, num_results, sim_results)
+        point_results.append((num_results, sim_results))
+
+    _print_process_times(np.sum(results['process_time_num']),
+                         np.sum(results['process_time_sim']))
+    print_timings_summary(", ".join(dims), point_results)
+
+    return results
+
+
+def run_plan(qp: dict, grids: dict[str, dict], store=None,
+             on_grid_done=None) -> dict[str, dict]:
+    """
+    Run several grids as one plan: points of all grids are collected first,
+    identical points (equal parameters, seeds are not compared) are computed once
+    and their results are fanned out to every grid, that contains them.
+    With a master seed, seeds are spawned for unique points in plan order.
+    :param qp: dictionary of parameters
+    :param grids: {grid name: axes}, see get_grid_axes
+    :param store: ResultStore or None, the layout of grids and every finished point
+        are written to it, see load_plan_results
+    :param on_grid_done: None or function(grid name, results), called as soon as
+        all points of a grid are finished, while other points are still computed.
+    Timings of every point are appended to the timings log, if qp['timings_log'] is set,
+    and a summary of timings is printed for every finished grid.
+    :return: {grid name: results}, see run_grid
+    """
+    tasks = {}
+    grid_keys = {}
+    total = 0
+    for name, axes in grids.items():
+        keys = grid_keys[name] = []
+        for index, values in iter_grid(axes):
+            point = make_grid_point(qp, values)
+            key = point_key(point, with_seed=False)
+            tasks.setdefault(key, point)
+            keys.append((index, key))
+            total += 1
+
+    print(f"Plan: {total} points in {len(grids)} grids, {len(tasks)} unique points "
+          f"after deduplication ({total - len(tasks)} duplicates removed)")
+
+    if store is not None:
+        store.write_layout({name: {'dims': list(axes), 'coords': axes,
+                                   'keys': [key for _index, key in grid_keys[name]]}
+                            for name, axes in grids.items()})
+
+    # grids, that wait for each point, and numbers of their unfinished points
+    waiting = {}
+    for name, keys in grid_keys.items():
+        for key in {key for _index, key in keys}:
+            waiting.setdefault(key, []).append(name)
+    remaining = {name: len({key for _index, key in keys}) for name, keys in grid_keys.items()}
+
+    timings_log = get_timings_log(qp)
+    done = {}
+    all_results = {}
+    for name in [name for name, count in remaining.items() if count == 0]:
+        all_results[name] = _new_results(grids[name])
+        if on_grid_done is not None:
+            on_grid_done(name, all_results[name])
+
+    # run_points drives the loop, so its final summaries are printed when it is exhausted
+    for num, (point_results, key) in enumerate(zip(run_points(qp, tasks.values()), tasks)):
+        log(f"Done {num + 1}/{len(tasks)}... ")
+        done[key] = point_results
+        if store is not None:
+            store.append(key, tasks[key], *point_results)
+        if timings_log is not None:
+            timings_log.append(key, tasks[key], *point_results, grids=waiting[key])
+
+        for name in waiting[key]:
+            remaining[name] -= 1
+            if remaining[name] == 0:
+                results = all_results[name] = _new_results(grids[name])
+                for index, grid_key in grid_keys[name]:
+                    _set_point_results(results, index, *done[grid_key])
+                print_timings_summary(name, [done[grid_key] for _index, grid_key
+                                             in grid_keys[name]])
+                if on_grid_done is not None:
+                    on_grid_done(name, results)
+
+    if store is not None:
+        store.flush()
+
+    _print_process_times(sum(num["process_time"] for num, _sim in done.values()),
+                         sum(sim["process_time"] for _num, sim in done.values()))
+
+    return {name: all_results[name] for name in grids}
+
+
+def load_plan_results(store) -> dict[str, dict]:
+    """
+    Results of all grids of a plan from the result store, no point is computed.
+    Values of points missing in the store are NaN.
+    :param store: ResultStore, written by run_plan
+    :return: {grid name: results}, see run_grid
+    """
+    points = store.get_points()
+    all_results = {}
+    for name, layout in store.read_layout().items():
+        axes = {dim: np.asarray(layout['coords'][dim]) for dim in layout['dims']}
+        results = all_results[name] = _new_results(axes)
+        for array in results.values():
+            if isinstance(array, np.ndarray):
+                array.fill(np.nan)
+        for (index, _values), key in zip(iter_grid(axes), layout['keys']):
+            if key in points:
+                _set_point_results(results, index, *points[key])
+    return all_results
+
+
+def save_grid_results(results: dict, save_path: str):
+    """
+    Save results of run_grid as .npz, axis values are stored as 'coord:<path>'.
+    """
+    arrays = {name: value for name, value in results.items() if name not in ('dims', 'coords')}
+    arrays.update({f'coord:{name}': values for name, values in results['coords'].items()})
+    np.savez(save_path, dims=np.array(results['dims']), **arrays)
+
+
+def load_grid_results(save_path: str) -> dict:
+    """
+    Load results saved by save_grid_results.
+    """
+    with np.load(save_path) as data:
+        dims = [str(name) for name in data['dims']]
+        results = {'dims': dims, 'coords': {name: data[f'coord:{name}'] for name in dims}}
+        results.update({name: data[name] for name in data.files
+                        if name != 'dims' and not name.startswith('coord:')})
+    return results
+
+
+def get_sweeps_axes(qp: dict) -> dict[str, dict]:
+    """
+    Axes of all enabled grids of the 'sweeps' section.
+    :return: {sweep name: axes}
+    """
+    return {name: get_grid_axes(qp, sweep['axes'])
+            for name, sweep in (qp.get('sweeps') or {}).items()
+            if sweep.get('enabled', True)}
+
+
+def run_sweeps(qp: dict, save_path: str = None, all_results: dict = None) -> dict:
+    """
+    Run all enabled grids of the 'sweeps' section.
+    :param qp: dictionary of parameters
+    :param save_path: directory for <sweep name>.npz files
+    :param all_results: {sweep name: results} precomputed by run_plan, missing sweeps are run
+    :return: {sweep name: results of run_grid}
+    """
+    all_results = dict(all_results or {})
+    for name, axes in get_sweeps_axes(qp).items():
+        if name not in all_results:
+            print(f"Running sweep {name}...")
+            all_results[name] = run_grid(qp, axes)
+        if save_path:
+            save_grid_results(all_results[name], os.path.join(save_path, f'{name}.npz'))
+    return all_results
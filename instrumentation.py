@@ -0,0 +1,213 @@
+"""
+Per-phase timing and memory instrumentation of calculations and simulations.
+
+A span measures one phase of a computation (solver construction, iterations,
+simulator event loop, ...): wall time, CPU time, peak RSS of the process and,
+if memory tracing is on, the peak of memory allocated by Python during the span.
+Spans of one computation are collected in a dict {span name: record},
+that is returned with the results as 'timings'.
+
+Options are passed to worker processes through environment variables,
+the same way as BLAS threads in parallel.py:
+- quiet: no per-replication and per-point progress messages,
+- trace_memory: tracemalloc peaks of spans (slows allocations down noticeably).
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is not reported there
+    resource = None
+
+QUIET_ENV_VAR = "QUEUE_VACATIONS_QUIET"
+TRACE_MEMORY_ENV_VAR = "QUEUE_VACATIONS_TRACE_MEMORY"
+
+TIMINGS_FILE = "timings.jsonl"
+
+# fields of span records, that are summed or maximized when records are merged
+SUMMED_FIELDS = ('wall', 'cpu', 'count', 'iterations', 'jobs')
+MAX_FIELDS = ('peak_rss_mb', 'peak_traced_mb')
+
+
+def is_quiet() -> bool:
+    """
+    Whether progress messages are switched off.
+    """
+    return os.environ.get(QUIET_ENV_VAR) == "1"
+
+
+def log(message: str):
+    """
+    Print a progress message unless quiet mode is on.
+    """
+    if not is_quiet():
+        print(message)
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size of the current process in MB, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+@contextlib.contextmanager
+def span(timings: dict, name: str):
+    """
+    Measure a phase of a computation and store its record as timings[name].
+    The record is yielded, so counters like 'iterations' or 'jobs' can be added to it.
+    :param timings: dict of span records of the computation
+    :param name: span name
+    """
+    trace_memory = os.environ.get(TRACE_MEMORY_ENV_VAR) == "1"
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    record = {'count': 1}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall'] = time.perf_counter() - wall_start
+        record['cpu'] = time.process_time() - cpu_start
+        record['peak_rss_mb'] = get_peak_rss_mb()
+        if trace_memory:
+            record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        timings[name] = record
+
+
+def merge_timings(all_timings) -> dict:
+    """
+    Merge span records of several computations (replications, points of a sweep):
+    times and counters are summed, memory peaks are maximized.
+    :param all_timings: iterable of timings dicts, None items are skipped
+    :return: merged timings
+    """
+    merged = {}
+    for timings in all_timings:
+        for name, record in (timings or {}).items():
+            total = merged.setdefault(name, {})
+            for field, value in record.items():
+                if value is None:
+                    continue
+                if field in MAX_FIELDS:
+                    total[field] = max(total.get(field, value), value)
+                elif field in SUMMED_FIELDS:
+                    total[field] = total.get(field, 0) + value
+    return merged
+
+
+@contextlib.contextmanager
+def instrumentation_options(qp: dict):
+    """
+    Set options of the 'instrumentation' section for this process and processes
+    started inside the context.
+    :param qp: dictionary of parameters
+    """
+    params = qp.get('instrumentation') or {}
+    values = {QUIET_ENV_VAR: "1" if params.get('quiet', False) else "0",
+              TRACE_MEMORY_ENV_VAR: "1" if params.get('trace_memory', False) else "0"}
+
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class TimingsLog:
+    """
+    JSON lines file with timings of every finished point:
+    {"key", "num_channels", "grids", "num": {span: record}, "sim": {span: record}}.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the file, created on the first append
+        """
+        self.path = path
+
+    def append(self, key: str, point: dict, num_results: dict, sim_results: dict,
+               grids: list = None):
+        """
+        Record timings of a finished point.
+        :param key: point key, see journal.point_key
+        :param point: point dict, see sweep.make_point
+        :param grids: names of grids, that contain the point
+        """
+        line = json.dumps({
+            "key": key,
+            "num_channels": int(point['num_channels']),
+            "grids": list(grids or []),
+            "num": num_results.get('timings') or {},
+            "sim": sim_results.get('timings') or {},
+        })
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def load(self) -> list[dict]:
+        """
+        Read all records.
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def get_timings_log(qp: dict):
+    """
+    Timings log of the experiment, if qp['timings_log'] holds its path (set by main.run_all).
+    :param qp: dictionary of parameters
+    :return: TimingsLog or None
+    """
+    path = qp.get('timings_log')
+    if not path:
+        return None
+    return TimingsLog(path)
+
+
+def _format_value(value, fmt: str) -> str:
+    # a missing value is aligned by the width of the format
+    return format("-", fmt.split('.')[0]) if value is None else format(value, fmt)
+
+
+def print_timings_summary(name: str, results: list[tuple[dict, dict]]):
+    """
+    Print a table of spans summed over points of a sweep.
+    :param name: sweep name
+    :param results: list of (num_results, sim_results) of its points
+    """
+    sections = {'num': merge_timings(num.get('timings') for num, _sim in results),
+                'sim': merge_timings(sim.get('timings') for _num, sim in results)}
+    if not any(sections.values()):
+        return
+
+    print(f"Timings of {name} ({len(results)} points):")
+    print(f"  {'span':<22} {'calls':>7} {'wall, s':>10} {'cpu, s':>10} "
+          f"{'iter/jobs':>11} {'rss, MB':>9} {'traced, MB':>11}")
+    for section, timings in sections.items():
+        for span_name, record in timings.items():
+            counter = record.get('iterations', record.get('jobs'))
+            print(f"  {section + '.' + span_name:<22} {int(record.get('count', 0)):>7} "
+                  f"{record.get('wall', 0.0):>10.3f} {record.get('cpu', 0.0):>10.3f} "
+                  f"{_format_value(counter, '>11.0f')} "
+                  f"{_format_value(record.get('peak_rss_mb'), '>9.1f')} "
+                  f"{_format_value(record.get('peak_traced_mb'), '>11.2f')}")
@@ -0,0 +1,227 @@
+"""
+Joint optimization of the number of channels, cooling delay mean and CV
+(optionally cooling mean and CV) at the workload of the base configuration.
+
+The service time mean is fixed by the base configuration (channels.base*utilization.base
+/arrival_rate), so channels change the utilization. The cost of a configuration is
+the cost of find_best_delay_w1.py (waiting cost + server cost) plus channel_cost
+per provisioned channel. The search is a coordinate search (optimization.coordinate_search):
+a neighbour walk over stable numbers of channels and zooming scans over continuous
+parameters. Points of every scan are solved together by batch_calc over one process pool
+and the calculation cache, every point is solved once.
+
+    python joint_optimization.py [--cooling] [--channel-cost 1.0]
+"""
+import math
+
+import numpy as np
+
+from batch_calc import run_calculations
+from cache import get_calc_cache
+from delay_costs import calc_server_costs, get_cost_params
+from find_best_delay_w1 import calc_wait_cost
+from optimization import CountingBatchFunction, coordinate_search
+from parallel import process_pool
+from run_one_calc_vs_sim import calc_moments_by_mean_and_coev
+from sweep import get_parallel_params
+
+DELAY_PARAMS = ('delay.mean', 'delay.cv')
+COOLING_PARAMS = ('cooling.mean', 'cooling.cv')
+
+
+def get_joint_params(qp: dict) -> dict:
+    """
+    Read the 'joint_optimization' section of parameters, filling defaults.
+    :return: dict with keys channel_cost, cooling, num_points, tol, max_cycles
+    """
+    params = qp.get('joint_optimization') or {}
+    return {
+        'channel_cost': float(params.get('channel_cost', 1.0)),
+        'cooling': bool(params.get('cooling', False)),
+        'num_points': int(params.get('num_points', 5)),
+        'tol': float(params.get('tol', 0.02)),
+        'max_cycles': int(params.get('max_cycles', 5)),
+    }
+
+
+def _get_service_mean(qp: dict) -> float:
+    return qp['channels']['base']*qp['utilization']['base']/qp['arrival_rate']
+
+
+def get_joint_space(qp: dict, cooling: bool = False) -> dict:
+    """
+    Coordinates of the search.
+    :param qp: dictionary of parameters, min, max and base of the parameter tree are used
+    :param cooling: also optimize cooling mean and CV
+    :return: {'names': ['channels', ...], 'x0': start point, 'bounds': [(low, high)],
+        'integer': indices of integer coordinates}. Numbers of channels start
+        from the smallest one with utilization below 1.
+    """
+    names = ['channels', *DELAY_PARAMS, *(COOLING_PARAMS if cooling else ())]
+    min_channels = max(qp['channels']['min'],
+                       math.floor(qp['arrival_rate']*_get_service_mean(qp)) + 1)
+    if min_channels > qp['channels']['max']:
+        raise ValueError(f"No stable number of channels up to {qp['channels']['max']}")
+
+    bounds = [(min_channels, qp['channels']['max'])]
+    x0 = [min(max(qp['channels']['base'], min_channels), qp['channels']['max'])]
+    for path in names[1:]:
+        section, name = path.split('.')
+        node = qp[section][name]
+        bounds.append((node['min'], node['max']))
+        x0.append(node['base'])
+    return {'names': names, 'x0': tuple(x0), 'bounds': bounds, 'integer': (0,)}
+
+
+class JointCost:
+    """
+    Costs of a batch of points of the search space, points are solved by run_calculations.
+    Cost components of every point are kept in details.
+    """
+
+    def __init__(self, qp: dict, names: list[str], channel_cost: float,
+                 wait_cost_calc_func=calc_wait_cost, executor=None, workers: int = 1,
+                 calc_cache=None):
+        """
+        :param qp: dictionary of parameters
+        :param names: coordinates of points, see get_joint_space
+        :param channel_cost: cost of a provisioned channel
+        :param wait_cost_calc_func: function to calculate waiting cost, applied to arrays
+        :param executor: running process pool or None
+        :param workers: worker processes of the pool
+        :param calc_cache: CalcCache or None
+        """
+        self.qp = qp
+        self.names = names
+        self.channel_cost = channel_cost
+        self.wait_cost_calc_func = wait_cost_calc_func
+        self.executor = executor
+        self.workers = workers
+        self.calc_cache = calc_cache
+        self.details = {}
+        self.cache_hits = 0
+
+        self.b = calc_moments_by_mean_and_coev(_get_service_mean(qp),
+                                               qp['service']['cv']['base'])
+        self.b_w = calc_moments_by_mean_and_coev(qp['warmup']['mean']['base'],
+                                                 qp['warmup']['cv']['base'])
+
+    def _get_moments(self, params: dict, section: str) -> list[float]:
+        mean = params.get(f'{section}.mean', self.qp[section]['mean']['base'])
+        cv = params.get(f'{section}.cv', self.qp[section]['cv']['base'])
+        # the H2 fit of the solver is degenerate at CV exactly 1
+        if cv == 1.0:
+            cv += 1e-6
+        return calc_moments_by_mean_and_coev(mean, cv)
+
+    def __call__(self, points: list[tuple]) -> list[float]:
+        params = [dict(zip(self.names, point)) for point in points]
+        num_channels = np.array([int(round(p['channels'])) for p in params])
+        results = run_calculations(
+            self.qp['arrival_rate'], b=self.b, b_w=self.b_w,
+            b_c=[self._get_moments(p, 'cooling') for p in params],
+            b_d=[self._get_moments(p, 'delay') for p in params],
+            num_channels=num_channels, workers=self.workers, chunksize=1,
+            calc_cache=self.calc_cache, executor=self.executor)
+        self.cache_hits += int(np.sum(results['cache_hit']))
+
+        cost_params = get_cost_params(self.qp, ndim=1)
+        server_costs = calc_server_costs(results, cost_params, num_channels)[0]
+        wait_costs = np.broadcast_to(self.wait_cost_calc_func(
+            w1=results['w'][:, 0], wait_cost=cost_params['wait_cost'][0]), server_costs.shape)
+        channel_costs = self.channel_cost*num_channels
+        total_costs = wait_costs + server_costs + channel_costs
+
+        for point, total, wait, server, channel, w1 in zip(
+                points, total_costs, wait_costs, server_costs, channel_costs,
+                results['w'][:, 0]):
+            self.details[tuple(point)] = {'total_cost': float(total), 'wait_cost': float(wait),
+                                          'server_cost': float(server),
+                                          'channel_cost': float(channel), 'w1': float(w1)}
+        return total_costs.tolist()
+
+
+def run_joint_optimization(qp: dict, wait_cost_calc_func=calc_wait_cost) -> dict:
+    """
+    Find the best number of channels, delay (and cooling) parameters.
+    The 'joint_optimization', 'parallel' and 'cache' sections of parameters are used.
+    :param qp: dictionary of parameters
+    :param wait_cost_calc_func: function to calculate waiting cost, applied to arrays
+    :return: {'best': {coordinate: value}, 'costs': cost components at the best point,
+        'start': {coordinate: value}, 'start_costs', 'solver_calls' - points solved
+        (cache hits included), 'cache_hits', 'cycles'}
+    """
+    params = get_joint_params(qp)
+    space = get_joint_space(qp, params['cooling'])
+    parallel = get_parallel_params(qp)
+    calc_cache = get_calc_cache(qp)
+
+    def search(executor):
+        cost = JointCost(qp, space['names'], params['channel_cost'], wait_cost_calc_func,
+                         executor=executor, workers=parallel['workers'], calc_cache=calc_cache)
+        counting = CountingBatchFunction(cost)
+        best, _value, cycles = coordinate_search(
+            counting, space['x0'], space['bounds'], space['integer'],
+            num_points=params['num_points'], tol=params['tol'],
+            max_cycles=params['max_cycles'])
+        return cost, counting, best, cycles
+
+    if parallel['workers'] > 1:
+        with process_pool(parallel['workers'], parallel['blas_threads']) as executor:
+            cost, counting, best, cycles = search(executor)
+    else:
+        cost, counting, best, cycles = search(None)
+
+    start = counting.key(space['x0'])
+    best = counting.key(best)
+    return {
+        'best': dict(zip(space['names'], best), channels=int(best[0])),
+        'costs': cost.details[best],
+        'start': dict(zip(space['names'], start), channels=int(start[0])),
+        'start_costs': cost.details[start],
+        'solver_calls': counting.calls,
+        'cache_hits': cost.cache_hits,
+        'cycles': cycles,
+    }
+
+
+def print_joint_optimization(result: dict):
+    """
+    Print the start and the best configurations with their costs.
+    """
+    for title, point, costs in (('start', result['start'], result['start_costs']),
+                                ('best', result['best'], result['costs'])):
+        values = ", ".join(f"{name}={value:.4g}" for name, value in point.items())
+        print(f"{title:>5}: {values}")
+        print(f"       total {costs['total_cost']:.4f} = wait {costs['wait_cost']:.4f} "
+              f"+ server {costs['server_cost']:.4f} + channels {costs['channel_cost']:.4f}, "
+              f"w1 {costs['w1']:.4f}")
+    print(f"Solver calls: {result['solver_calls']} ({result['cache_hits']} from the cache), "
+          f"cycles: {result['cycles']}")
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    from utils import read_parameters_from_yaml
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cooling', action='store_true',
+                        help="also optimize cooling mean and CV")
+    parser.add_argument('--channel-cost', type=float, default=None,
+                        help="cost of a provisioned channel, joint_optimization.channel_cost")
+    parser.add_argument('--workers', type=int, default=None, help="parallel.workers")
+    args = parser.parse_args()
+
+    base_qp = read_parameters_from_yaml("base_parameters.yaml")
+    joint = base_qp.setdefault('joint_optimization', {})
+    if args.cooling:
+        joint['cooling'] = True
+    if args.channel_cost is not None:
+        joint['channel_cost'] = args.channel_cost
+    if args.workers is not None:
+        base_qp.setdefault('parallel', {})['workers'] = args.workers
+
+    print_joint_optimization(run_joint_optimization(base_qp))
@@ -0,0 +1,125 @@
+"""
+Write-ahead journal of finished grid points of an experiment.
+Every finished point is appended as one JSON line under an exclusive file lock,
+so worker processes can write to the same journal. A resumed experiment replays
+finished points from the journal and computes only the missing ones.
+"""
+import hashlib
+import json
+import os
+
+from cache import to_json
+from run_one_calc_vs_sim import DEFAULT_ENGINE, describe_seed
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, appends of one line are atomic enough there
+    fcntl = None
+
+JOURNAL_FILE = "journal.jsonl"
+
+KEY_PARAMS = ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels', 'accuracy',
+              'num_of_jobs', 'ave_num', 'precision')
+
+
+def _canonical(value):
+    """
+    Round floats to 12 significant digits, so that equal parameters computed
+    in different ways (linspace grid and base value) have equal keys.
+    """
+    if isinstance(value, dict):
+        return {name: _canonical(v) for name, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    if isinstance(value, float):
+        return float(f"{value:.12g}")
+    return value
+
+
+def point_key(point: dict, with_seed: bool = True) -> str:
+    """
+    Hash of all parameters of a point, that define its results.
+    :param point: point dict, see sweep.make_point
+    :param with_seed: whether the seed of the point is a part of the key
+    """
+    canonical = {name: _canonical(to_json(point.get(name))) for name in KEY_PARAMS}
+    # keys of points simulated by the default engine are the same as before engines were added
+    engine = point.get('sim_engine', DEFAULT_ENGINE)
+    if engine != DEFAULT_ENGINE:
+        canonical['sim_engine'] = engine
+    if point.get('crn', False):
+        canonical['crn'] = True
+    if point.get('batch_means'):
+        canonical['batch_means'] = _canonical(to_json(point['batch_means']))
+    if point.get('control_variates'):
+        canonical['control_variates'] = _canonical(to_json(point['control_variates']))
+    if with_seed:
+        canonical['seed'] = describe_seed(point.get('seed'))
+    text = json.dumps(canonical, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Journal:
+    """
+    Append-only JSON lines file of finished points: {"key", "num", "sim"}.
+    Only the path is pickled, so the journal can be passed to worker processes.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the journal file, created on the first append
+        """
+        self.path = path
+
+    def append(self, key: str, num_results: dict, sim_results: dict):
+        """
+        Record a finished point. The line is written with one write call under
+        an exclusive lock and synced to disk before the lock is released.
+        """
+        line = json.dumps({"key": key, "num": to_json(num_results),
+                           "sim": to_json(sim_results)}) + "\n"
+        with open(self.path, "ab+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # a crashed run may have left a torn line, do not glue the record to it
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+                f.write(line.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self) -> dict:
+        """
+        Read finished points. A torn last line of a crashed run is skipped.
+        :return: {key: (num_results, sim_results)}
+        """
+        finished = {}
+        if not os.path.exists(self.path):
+            return finished
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                finished[record["key"]] = (record["num"], record["sim"])
+        return finished
+
+
+def get_journal(qp: dict):
+    """
+    Journal of the experiment, if qp['journal'] holds its path (set by main.run_all).
+    :param qp: dictionary of parameters
+    :return: Journal or None
+    """
+    path = qp.get('journal')
+    if not path:
+        return None
+    return Journal(path)
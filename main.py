@@ -1,60 +1,181 @@
 import os
 
-from channels import run_channels
-from cooling import run_cool_ave, run_cool_cv
-from cooling_delay import run_cool_delay_average, run_cool_delay_cv
-from service import run_service_cv
-from utilization import run_utilization
-from utils import (
-    create_new_experiment_dir,
-    read_parameters_from_yaml,
-    save_parameters_as_yaml,
+import numpy as np
+
+from cache import get_calc_cache, get_sim_cache
+from channels import get_channels_axes, run_channels
+from cooling import get_cool_ave_axes, get_cool_cv_axes, run_cool_ave, run_cool_cv
+from cooling_delay import (
+    get_cool_delay_average_axes,
+    get_cool_delay_cv_axes,
+    run_cool_delay_average,
+    run_cool_delay_cv,
 )
-from warmup import run_warmup_ave, run_warmup_cv
-
-
-def run_all(qp: dict):
+from grid import get_sweeps_axes, load_plan_results, run_plan, save_grid_results
+from instrumentation import TIMINGS_FILE, instrumentation_options
+from journal import JOURNAL_FILE
+from registry import get_registry
+from rendering import plot_renderer
+from service import get_service_cv_axes, run_service_cv
+from store import ResultStore, get_store
+from utilization import get_utilization_axes, run_utilization
+from utils import read_parameters_from_yaml, save_parameters_as_yaml
+from warmup import get_warmup_ave_axes, get_warmup_cv_axes, run_warmup_ave, run_warmup_cv
+
+
+# plotting function and subdirectory of the experiment directory of each sweep of run_all
+SWEEP_PLOTS = {
+    'channels': (run_channels, None),
+    'service_cv': (run_service_cv, None),
+    'utilization': (run_utilization, None),
+    'cool_delay_average': (run_cool_delay_average, 'cooling_delay'),
+    'cool_delay_cv': (run_cool_delay_cv, 'cooling_delay'),
+    'cool_ave': (run_cool_ave, 'cooling'),
+    'cool_cv': (run_cool_cv, 'cooling'),
+    'warmup_ave': (run_warmup_ave, 'warmup'),
+    'warmup_cv': (run_warmup_cv, 'warmup'),
+}
+
+
+def run_all(qp: dict, resume: str = None, results_folder: str = None):
     """
     Run all experiments  based on the given queue parameters.
+    The experiment directory is allocated by the registry of results/.
+    Finished grid points are recorded to the journal of the experiment directory,
+    at the end they are indexed in the registry.
+    :param qp: dictionary of parameters
+    :param resume: name of an existing experiment directory, like 'exp_3'.
+        Its saved parameters are used instead of qp, finished points are replayed
+        from its journal and only the missing ones are computed.
+    :param results_folder: directory of experiments, None - results/ of the repository
     """
 
-    cur_dir = os.path.dirname(os.path.abspath(__file__))
-    results_folder = os.path.join(cur_dir, "results")
+    if results_folder is None:
+        cur_dir = os.path.dirname(os.path.abspath(__file__))
+        results_folder = os.path.join(cur_dir, "results")
     if not os.path.exists(results_folder):
         os.makedirs(results_folder)
-    results_path = create_new_experiment_dir(results_folder)
-    save_parameters_as_yaml(qp, results_path)
 
-    run_channels(qp, save_path=results_path)
-    run_service_cv(qp, save_path=results_path)
-    run_utilization(qp, save_path=results_path)
+    registry = get_registry(results_folder)
+    if resume:
+        results_path = os.path.join(results_folder, resume)
+        qp = read_parameters_from_yaml(os.path.join(results_path, "parameters.yaml"))
+        exp_id = registry.get_experiment_id(resume)
+        print(f"Resuming experiment {results_path}")
+    else:
+        sim_params = qp.get('simulation') or {}
+        if sim_params.get('common_random_numbers', False) and sim_params.get('seed') is None:
+            # common random numbers need a fixed seed: it is drawn once and saved with
+            # the parameters of the experiment, so --resume reuses it
+            qp = dict(qp, simulation=dict(sim_params,
+                                          seed=int(np.random.SeedSequence().entropy)))
+            print(f"Common random numbers: simulation.seed = {qp['simulation']['seed']}")
+        exp_id, results_path = registry.create_experiment(results_folder, qp)
+        save_parameters_as_yaml(qp, results_path)
+
+    qp = dict(qp, journal=os.path.join(results_path, JOURNAL_FILE))
+    if (qp.get('instrumentation') or {}).get('enabled', True):
+        qp['timings_log'] = os.path.join(results_path, TIMINGS_FILE)
+
+    # all sweeps share the base configuration and some other points,
+    # so points of all sweeps are planned together and each unique one is run once
+    grids = {
+        'channels': get_channels_axes(qp),
+        'service_cv': get_service_cv_axes(qp),
+        'utilization': get_utilization_axes(qp),
+        'cool_delay_average': get_cool_delay_average_axes(qp),
+        'cool_delay_cv': get_cool_delay_cv_axes(qp),
+        'cool_ave': get_cool_ave_axes(qp),
+        'cool_cv': get_cool_cv_axes(qp),
+        'warmup_ave': get_warmup_ave_axes(qp),
+        'warmup_cv': get_warmup_cv_axes(qp),
+    }
+    sweeps_axes = get_sweeps_axes(qp)
+    grids.update({f'sweeps:{name}': axes for name, axes in sweeps_axes.items()})
+
+    store = get_store(qp, results_path)
+    with instrumentation_options(qp), plot_renderer(qp) as renderer:
+        # figures of a finished sweep are drawn while points of the next ones are computed
+        run_plan(qp, grids, store=store,
+                 on_grid_done=lambda name, results: renderer.submit(
+                     plot_grid, qp, name, results, results_path))
+
+    if store is not None and exp_id is not None:
+        registry.add_points(exp_id, store.load())
+
+    if exp_id is not None:
+        registry.set_status(exp_id, 'finished')
+
+    calc_cache = get_calc_cache(qp)
+    if calc_cache is not None:
+        print(f"Calculation cache: {calc_cache.get_stats()}")
+    sim_cache = get_sim_cache(qp)
+    if sim_cache is not None:
+        print(f"Simulation cache: {sim_cache.get_stats()}")
+
+
+def plot_grid(qp: dict, name: str, results: dict, results_path: str):
+    """
+    Plot results of one grid of run_all, results of 'sweeps' grids are saved as .npz.
+    :param qp: dictionary of parameters
+    :param name: grid name, see SWEEP_PLOTS
+    :param results: results of the grid, see grid.run_grid
+    :param results_path: experiment directory
+    """
+    if name.startswith('sweeps:'):
+        save_path = os.path.join(results_path, 'sweeps')
+        os.makedirs(save_path, exist_ok=True)
+        save_grid_results(results, os.path.join(save_path, f"{name[len('sweeps:'):]}.npz"))
+        return
 
-    cool_delay_path = os.path.join(results_path, 'cooling_delay')
-    if not os.path.exists(cool_delay_path):
-        os.makedirs(cool_delay_path)
+    func, subdir = SWEEP_PLOTS[name]
+    save_path = results_path if subdir is None else os.path.join(results_path, subdir)
+    os.makedirs(save_path, exist_ok=True)
+    func(qp, save_path=save_path, results=results)
 
-    run_cool_delay_average(qp, save_path=cool_delay_path)
-    run_cool_delay_cv(qp, save_path=cool_delay_path)
 
-    cooling_path = os.path.join(results_path, 'cooling')
-    if not os.path.exists(cooling_path):
-        os.makedirs(cooling_path)
+def plot_all(qp: dict, results: dict, results_path: str, renderer):
+    """
+    Plot results of all grids.
+    :param qp: dictionary of parameters
+    :param results: {grid name: results}, see grid.run_plan
+    :param results_path: experiment directory
+    :param renderer: PlotRenderer, see rendering.plot_renderer
+    """
+    for name, grid_results in results.items():
+        renderer.submit(plot_grid, qp, name, grid_results, results_path)
 
-    run_cool_ave(qp, save_path=cooling_path)
-    run_cool_cv(qp, save_path=cooling_path)
 
-    warmup_path = os.path.join(results_path, 'warmup')
-    if not os.path.exists(warmup_path):
-        os.makedirs(warmup_path)
+def replot(experiment: str):
+    """
+    Plot results of a finished experiment from its result store, nothing is computed.
+    :param experiment: name of the experiment directory, like 'exp_3'
+    """
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    results_path = os.path.join(cur_dir, "results", experiment)
+    qp = read_parameters_from_yaml(os.path.join(results_path, "parameters.yaml"))
 
-    run_warmup_ave(qp, save_path=warmup_path)
-    run_warmup_cv(qp, save_path=warmup_path)
+    with plot_renderer(qp) as renderer:
+        plot_all(qp, load_plan_results(ResultStore(results_path)), results_path, renderer)
 
 
 if __name__ == "__main__":
 
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run all experiments")
+    parser.add_argument('--resume', metavar='exp_N',
+                        help="continue an interrupted experiment in results/exp_N")
+    parser.add_argument('--replot', metavar='exp_N',
+                        help="only plot results/exp_N from its result store")
+    args = parser.parse_args()
+
+    if args.replot:
+        replot(args.replot)
+        raise SystemExit
+
     # read parameters from yaml file with path base_parameters.yaml
 
     base_qp = read_parameters_from_yaml("base_parameters.yaml")
 
-    run_all(base_qp)
+    run_all(base_qp, resume=args.resume)
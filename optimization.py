@@ -0,0 +1,202 @@
+"""
+Optimization helpers for cost functions that are expensive to evaluate
+(every evaluation is a numerical solve of the queueing system).
+"""
+import numpy as np
+from scipy.optimize import minimize_scalar
+
+
+class CountingFunction:
+    """
+    Memoizing wrapper of an expensive function of one variable, that counts real calls.
+    """
+
+    def __init__(self, func):
+        """
+        :param func: function of one float argument
+        """
+        self.func = func
+        self.values = {}
+
+    def __call__(self, x: float):
+        x = float(x)
+        if x not in self.values:
+            self.values[x] = self.func(x)
+        return self.values[x]
+
+    @property
+    def calls(self) -> int:
+        """
+        Number of real calls of the wrapped function.
+        """
+        return len(self.values)
+
+
+class CountingBatchFunction:
+    """
+    Memoizing wrapper of an expensive function of a batch of points, that counts real calls.
+    Only points, that were not evaluated before, are passed to the wrapped function,
+    so it can evaluate them in parallel.
+    """
+
+    def __init__(self, func, digits: int = 12):
+        """
+        :param func: function of a list of points (tuples of floats), returns list of floats
+        :param digits: significant digits of coordinates, that identify a point
+        """
+        self.func = func
+        self.digits = digits
+        self.values = {}
+
+    def key(self, point) -> tuple:
+        """
+        Memoization key of a point.
+        """
+        return tuple(float(f"{float(x):.{self.digits}g}") for x in point)
+
+    def __call__(self, points) -> list[float]:
+        keys = [self.key(point) for point in points]
+        new_keys = list(dict.fromkeys(key for key in keys if key not in self.values))
+        if new_keys:
+            self.values.update(zip(new_keys, self.func(new_keys)))
+        return [self.values[key] for key in keys]
+
+    @property
+    def calls(self) -> int:
+        """
+        Number of points evaluated by the wrapped function.
+        """
+        return len(self.values)
+
+
+def minimize_bracketed(func, low: float, high: float, num_bracket: int = 5,
+                       tol: float = 1e-2) -> tuple[float, float]:
+    """
+    Minimize func on [low, high]: a coarse scan of num_bracket points brackets
+    the best point, then bounded Brent method refines it inside the bracket to tolerance tol.
+    :param func: function of one float argument, returns float
+    :param low: left bound
+    :param high: right bound
+    :param num_bracket: number of points of the coarse scan (at least 3)
+    :param tol: absolute tolerance of the argument
+    :return: (x_best, f(x_best))
+    """
+    xs = np.linspace(low, high, max(3, num_bracket))
+    values = [func(x) for x in xs]
+    best = int(np.argmin(values))
+
+    left = xs[max(best - 1, 0)]
+    right = xs[min(best + 1, len(xs) - 1)]
+
+    res = minimize_scalar(func, bounds=(left, right), method='bounded',
+                          options={'xatol': tol})
+
+    if res.fun < values[best]:
+        return float(res.x), float(res.fun)
+    return float(xs[best]), float(values[best])
+
+
+def bisect_boundary(predicate, inside: float, outside: float, tol: float = 1e-2) -> float:
+    """
+    Find the boundary of the region where predicate is True by bisection.
+    :param predicate: function of one float argument, returns bool
+    :param inside: point where predicate is True
+    :param outside: point where predicate is False
+    :param tol: absolute tolerance of the boundary
+    :return: point with predicate True within tol from the boundary
+    """
+    while abs(outside - inside) > tol:
+        middle = (inside + outside) / 2.0
+        if predicate(middle):
+            inside = middle
+        else:
+            outside = middle
+    return inside
+
+
+def minimize_scan(func, low: float, high: float, num_points: int = 5,
+                  tol: float = 1e-2) -> tuple[float, float]:
+    """
+    Minimize func on [low, high] by zooming scans: the interval shrinks to the neighbours
+    of the best point of a scan of num_points, until it is not longer than tol.
+    All points of a scan are passed to func at once, so they can be evaluated in parallel.
+    :param func: function of an array of points, returns sequence of floats
+    :param low: left bound
+    :param high: right bound
+    :param num_points: number of points of a scan (at least 4), odd numbers reuse
+        the best point and its neighbours in the next scan
+    :param tol: absolute tolerance of the argument
+    :return: (x_best, f(x_best))
+    """
+    num_points = max(4, num_points)
+    while True:
+        xs = np.linspace(low, high, num_points)
+        values = np.asarray(func(xs), dtype=float)
+        best = int(np.argmin(values))
+        if high - low <= tol:
+            return float(xs[best]), float(values[best])
+        low, high = xs[max(best - 1, 0)], xs[min(best + 1, num_points - 1)]
+
+
+def _walk_integer(func, x: list, axis: int, low: int, high: int,
+                  best: float) -> float:
+    """
+    Neighbour walk along an integer coordinate: both neighbours are evaluated together,
+    then the walk moves in the improving direction while the value decreases.
+    :return: value at the final point, x is updated in place
+    """
+    step = None
+    while True:
+        steps = (-1, 1) if step is None else (step,)
+        candidates = [x[axis] + s for s in steps if low <= x[axis] + s <= high]
+        if not candidates:
+            return best
+        values = func([tuple(x[:axis] + [value] + x[axis + 1:]) for value in candidates])
+        index = int(np.argmin(values))
+        if values[index] >= best:
+            return best
+        step = candidates[index] - x[axis]
+        x[axis], best = candidates[index], values[index]
+
+
+def coordinate_search(func, x0, bounds, integer=(), num_points: int = 5, tol: float = 1e-2,
+                      max_cycles: int = 10) -> tuple[tuple, float, int]:
+    """
+    Minimize func of several variables by cycles of one-dimensional searches along
+    coordinates: minimize_scan for continuous coordinates (over the whole range in the first
+    cycle, around the current point in later ones), neighbour walk for integer ones.
+    Cycles stop when a cycle decreases the value by not more than tol relative to it.
+    :param func: function of a list of points (tuples), returns list of floats,
+        see CountingBatchFunction
+    :param x0: start point
+    :param bounds: (low, high) of every coordinate
+    :param integer: indices of integer coordinates
+    :param num_points: number of points of scans of continuous coordinates
+    :param tol: tolerance of continuous coordinates relative to their ranges
+        and of the value relative to its magnitude
+    :param max_cycles: maximum number of cycles
+    :return: (best point, value at it, number of cycles)
+    """
+    x = list(x0)
+    best = func([tuple(x)])[0]
+    for cycle in range(1, max_cycles + 1):
+        cycle_start = best
+        for axis, (low, high) in enumerate(bounds):
+            if axis in integer:
+                best = _walk_integer(func, x, axis, low, high, best)
+                continue
+
+            def along(values, axis=axis):
+                return func([tuple(x[:axis] + [float(value)] + x[axis + 1:])
+                             for value in values])
+
+            # later cycles refine around the current point within one step of the first scan
+            radius = (high - low) / (max(4, num_points) - 1) if cycle > 1 else high - low
+            value, value_best = minimize_scan(along, max(low, x[axis] - radius),
+                                              min(high, x[axis] + radius), num_points,
+                                              tol*(high - low))
+            if value_best < best:
+                x[axis], best = value, value_best
+        if cycle_start - best <= tol*abs(cycle_start):
+            break
+    return tuple(x), best, cycle
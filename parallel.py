@@ -0,0 +1,57 @@
+"""
+Process pool helpers shared by sweeps and simulation replications.
+"""
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# environment variables that control thread pools of BLAS/OpenMP backends used by numpy
+BLAS_THREADS_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+@contextlib.contextmanager
+def pinned_blas_threads(num_threads):
+    """
+    Limit the number of BLAS/OpenMP threads for processes started inside the context.
+    Workers are spawned with a fresh interpreter, so they read these variables
+    before numpy is imported and do not oversubscribe the cores.
+    :param num_threads: number of threads per process, None to leave the environment as is
+    """
+    if num_threads is None:
+        yield
+        return
+
+    saved = {name: os.environ.get(name) for name in BLAS_THREADS_ENV_VARS}
+    for name in BLAS_THREADS_ENV_VARS:
+        os.environ[name] = str(num_threads)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@contextlib.contextmanager
+def process_pool(workers: int, blas_threads=1, initializer=None, initargs=()):
+    """
+    Process pool with spawned workers and pinned BLAS threads.
+    :param workers: number of worker processes
+    :param blas_threads: BLAS/OpenMP threads per worker, None - do not limit
+    :param initializer: picklable function called at the start of each worker
+    :param initargs: arguments of initializer
+    """
+    with pinned_blas_threads(blas_threads):
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=initializer, initargs=initargs) as executor:
+            yield executor
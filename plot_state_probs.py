@@ -1,19 +1,19 @@
 """
 Plot the state probabilities for a queueing system with H2-warming, H2-cooling, and H2-delay.
 """
-import matplotlib.pyplot as plt
 from most_queue.general.tables import probs_print, times_print
 
-from run_one_calc_vs_sim import run_calculation, run_simulation
+from run_one_calc_vs_sim import DEFAULT_ENGINE, run_calculation, run_simulation
 from utils import calc_moments_by_mean_and_coev
 
 
-
 if __name__ == "__main__":
 
+    from plots import configure_by_params, plt, save_figure, show
     from utils import read_parameters_from_yaml
     
     qp = read_parameters_from_yaml("base_parameters.yaml")
+    configure_by_params(qp)
 
     SERVICE_TIME_MEAN = qp['channels']['base']*qp['utilization']['base']/qp['arrival_rate']
 
@@ -48,7 +48,8 @@ if __name__ == "__main__":
         sim_results = run_simulation(
             arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b_service,
             b_w=b_warmup, b_c=b_cooling, b_d=b_delay, num_of_jobs=qp['jobs_per_sim'],
-            ave_num=qp['sim_to_average'], p_size=p_size
+            ave_num=qp['sim_to_average'], p_size=p_size,
+            engine=(qp.get('simulation') or {}).get('engine', DEFAULT_ENGINE)
         )
 
         probs_print(p_sim=sim_results["p"], p_num=num_results["p"], size=10)
@@ -61,7 +62,7 @@ if __name__ == "__main__":
     ax.set_ylabel('Probability')
     plt.legend()
 
-    plt.savefig(SAVE_PATH_PROBS)
-    plt.show()
+    save_figure(SAVE_PATH_PROBS)
+    show()
 
     plt.close(_fig)
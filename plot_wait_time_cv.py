@@ -1,24 +1,11 @@
 """
 Find best cooling delay for a given set of parameters and utilization factor.
 """
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 
-from run_one_calc_vs_sim import calc_moments_by_mean_and_coev, run_calculation
-from utils import read_parameters_from_yaml
-
-SMALL_SIZE = 12
-MEDIUM_SIZE = 14
-BIGGER_SIZE = 16
-
-plt.rc('font', size=SMALL_SIZE)          # controls default text sizes
-plt.rc('axes', titlesize=MEDIUM_SIZE)     # fontsize of the axes title
-plt.rc('axes', labelsize=MEDIUM_SIZE)    # fontsize of the x and y labels
-plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('legend', fontsize=MEDIUM_SIZE)    # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
+from cache import cached_run_calculation, get_calc_cache
+from run_one_calc_vs_sim import calc_moments_by_mean_and_coev
+from utils import progress, read_parameters_from_yaml
 
 
 def calc_cv(b: list[float]) -> float:
@@ -53,21 +40,31 @@ def run(qp, rho=0.7):
     b = calc_moments_by_mean_and_coev(
         service_mean, qp['service']['cv']['base'])
 
-    with tqdm(total=len(delays), desc="Calculating costs") as pbar:
+    calc_cache = get_calc_cache(qp)
+    warm_start = (qp.get('calculation') or {}).get('warm_start', False)
+    state = None
+
+    with progress(total=len(delays), desc="Calculating costs") as pbar:
 
         for delay_num, delay in enumerate(delays):
 
             b_d = calc_moments_by_mean_and_coev(
                 delay, qp['delay']['cv']['base'])
 
-            num_results = run_calculation(
+            num_results = cached_run_calculation(
                 arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'],
-                b=b, b_w=b_w, b_c=b_c, b_d=b_d)
+                b=b, b_w=b_w, b_c=b_c, b_d=b_d, cache=calc_cache,
+                warm_start=state, return_state=warm_start)
+            # continuation along delays: next solve starts from this solution
+            state = num_results.pop('solver_state', None)
 
             wait_time_cv[delay_num] = calc_cv(num_results['w'])
 
             pbar.update(1)
 
+    if calc_cache is not None:
+        print(f"Calculation cache: {calc_cache.get_stats()}")
+
     return wait_time_cv.tolist(), delays.tolist()
 
 
@@ -75,11 +72,14 @@ if __name__ == "__main__":
 
     import os
 
+    from plots import configure_by_params, plt, save_figure, show
+
     # if results/best_delay does not exist
     if not os.path.exists("results/best_delay_sla"):
         os.makedirs("results/best_delay_sla")
 
     base_qp = read_parameters_from_yaml("base_parameters.yaml")
+    configure_by_params(base_qp)
 
     # only cooling for simplification
     base_qp['warmup']['mean']['base'] = 0.1
@@ -100,7 +100,7 @@ if __name__ == "__main__":
     ax.set_ylabel('Wait Time CV')
     plt.legend()
 
-    plt.savefig(save_path)
-    plt.show()
+    save_figure(save_path)
+    show()
 
     plt.close(_fig)
@@ -0,0 +1,149 @@
+"""
+Plots of experiment results.
+This module is imported lazily, only when something is plotted, so computations
+and pool workers do not import matplotlib. The non-interactive Agg backend is used
+unless another one is set with the MPLBACKEND environment variable.
+"""
+import os
+
+import matplotlib
+
+if 'MPLBACKEND' not in os.environ:
+    matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+
+SMALL_SIZE = 12
+MEDIUM_SIZE = 14
+BIGGER_SIZE = 16
+
+plt.rc('font', size=SMALL_SIZE)          # controls default text sizes
+plt.rc('axes', titlesize=MEDIUM_SIZE)     # fontsize of the axes title
+plt.rc('axes', labelsize=MEDIUM_SIZE)    # fontsize of the x and y labels
+plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
+plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
+plt.rc('legend', fontsize=MEDIUM_SIZE)    # legend fontsize
+plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
+
+# output of saved figures, see configure
+DPI = 300
+FORMAT = 'png'
+
+
+def configure(dpi: int = 300, fmt: str = 'png'):
+    """
+    Set resolution and format of saved figures, e.g. fast low-dpi png previews
+    or vector pdf for publication.
+    :param dpi: dots per inch of raster formats
+    :param fmt: file format, extension of save paths is replaced with it
+    """
+    global DPI, FORMAT
+    DPI = dpi
+    FORMAT = fmt
+
+
+def configure_by_params(qp: dict):
+    """
+    Configure saved figures by the 'plots' section of parameters, see configure.
+    """
+    params = qp.get('plots') or {}
+    configure(dpi=params.get('dpi', 300), fmt=params.get('format', 'png'))
+
+
+def save_figure(save_path: str):
+    """
+    Save current figure with configured dpi and format.
+    """
+    root, _ext = os.path.splitext(save_path)
+    plt.savefig(f"{root}.{FORMAT}", dpi=DPI)
+
+
+def show():
+    """
+    Show figures only with an interactive backend, batch runs never open windows.
+    """
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.show()
+
+
+def plot_w1(xs, w1_num, w1_sim, x_label: str, save_path=None, is_xs_int=False, color=None):
+    """
+    Plot the wait time averages for both calculation and simulation.
+    :param xs: list of x-axis values.
+    :param x_label: The label for the x-axis
+    :param w1_num: The calculated wait time average.
+    :param w1_sim: The simulated wait time average.
+    :param save_path: The path to save the plot.
+    :param is_xs_int: Whether the x-axis values are integers.
+    """
+    _fig, ax = plt.subplots()
+    # plot first with dash -- line, black, second - with line, black
+    
+    ax.plot(xs, w1_num, label="num", color=color, linestyle="--")
+    ax.plot(xs, w1_sim, label="sim", color=color)
+    ax.legend()
+    ax.set_xlabel(x_label)
+    # set xticks to be integers
+    if is_xs_int:
+        ax.set_xticks(np.arange(min(xs), max(xs)+1, 1.0))
+    ax.set_ylabel(r"$\omega_{1}$")
+
+    if save_path:
+        save_figure(save_path)
+    else:
+        show()
+
+    plt.close(_fig)
+
+
+def plot_w1_errors(xs, w1_rel_errors, x_label, save_path=None, is_xs_int=False, color = None):
+    """
+    Plot the wait time relative errors
+    :param xs: The x-axis values.
+    :param w1_rel_errors: The relative errors of omega_1.
+    :param x_label: The label for the x-axis.
+    :param save_path: The path to save the plot.
+    :param is_xs_int: Whether the x-axis values are integers.
+    """
+    _fig, ax = plt.subplots()
+    
+    ax.plot(xs, w1_rel_errors, color=color)
+    ax.set_xlabel(x_label)
+    # set xticks to be integers
+    if is_xs_int:
+        ax.set_xticks(np.arange(min(xs), max(xs)+1, 1.0))
+    ax.set_ylabel(r"$\varepsilon$, %")
+
+    if save_path:
+        save_figure(save_path)
+    else:
+        show()
+
+    plt.close(_fig)
+
+
+def plot_probs(xs, probs_num, probs_sim, x_label, save_path=None, color=None):
+    """
+    Plot the probabilities of different states
+    :param xs: The x-axis values.
+    :param probs_num: The probabilities from numerical calculation.
+    :param probs_sim: The probabilities from simulation.
+    :param x_label: The label for the x-axis.
+    :param save_path: The path to save the plot.
+    """
+    _fig, ax = plt.subplots()
+    
+    ax.plot(xs, probs_num, label="num", color=color, linestyle="--")
+    ax.plot(xs, probs_sim, label="sim", color=color)
+    ax.legend()
+    ax.set_xlabel(x_label)
+    ax.set_ylabel("Probability")
+
+    if save_path:
+        save_figure(save_path)
+    else:
+        show()
+
+    plt.close(_fig)
+
@@ -0,0 +1,140 @@
+"""
+Load generator of the query service (query_service.py).
+
+Concurrent clients send queries drawn at random from a pool of distinct configurations
+(utilization and channels are random, other parameters take their 'base' values),
+so the load mixes solves, coalesced queries and memory hits. Latency of every request
+is measured by the client, percentiles and throughput are printed with the counters
+of the service:
+
+    python query_service.py --workers 4 &
+    python query_load.py --clients 16 --requests 200 --distinct 50 [--batch 1]
+"""
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from grid import make_grid_point
+from query_service import get_service_params, open_connection
+
+
+def make_queries(qp: dict, num: int, seed: int = 1) -> list[dict]:
+    """
+    Distinct queries with random utilization and number of channels.
+    :param qp: dictionary of parameters, utilization and channels ranges are used
+    :param num: number of queries
+    :return: list of run_calculation kwargs
+    """
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(num):
+        point = make_grid_point(qp, {
+            'utilization': float(rng.uniform(qp['utilization']['min'],
+                                             qp['utilization']['max'])),
+            'channels': int(rng.integers(qp['channels']['min'], qp['channels']['max'] + 1))})
+        queries.append({name: point[name] for name in
+                        ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels')})
+    return queries
+
+
+async def _run_client(queries: list[dict], num_requests: int, batch: int, seed: int,
+                      address: dict) -> list[float]:
+    """
+    Send num_requests requests one after another.
+    :return: latencies of requests, s
+    """
+    rng = np.random.default_rng(seed)
+    reader, writer = await open_connection(**address)
+    latencies = []
+    try:
+        for request_id in range(num_requests):
+            chosen = [queries[i] for i in rng.integers(len(queries), size=batch)]
+            request = ({'id': request_id, 'params': chosen[0]} if batch == 1
+                       else {'id': request_id, 'batch': chosen})
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode("utf-8") + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+    finally:
+        writer.close()
+    return latencies
+
+
+async def _request_stats(address: dict) -> dict:
+    reader, writer = await open_connection(**address)
+    writer.write(json.dumps({'id': 0, 'stats': True}).encode("utf-8") + b"\n")
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response['stats']
+
+
+async def run_load(queries: list[dict], clients: int, requests: int, batch: int = 1,
+                   seed: int = 1, address: dict = None) -> dict:
+    """
+    Run concurrent clients against the service.
+    :param queries: pool of queries, see make_queries
+    :param clients: number of concurrent clients
+    :param requests: requests per client
+    :param batch: queries per request
+    :param address: kwargs of query_service.open_connection
+    :return: {'requests', 'wall_time', 'throughput' - requests per second,
+        'latency_ms' - {'p50', 'p90', 'p99', 'max'}, 'service' - counters of the service}
+    """
+    address = address or {}
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*[
+        _run_client(queries, requests, batch, seed + client, address)
+        for client in range(clients)])
+    wall_time = time.perf_counter() - wall_start
+
+    latencies = np.concatenate(results) * 1e3
+    percentiles = np.percentile(latencies, [50, 90, 99]).tolist()
+    return {
+        'requests': len(latencies),
+        'wall_time': wall_time,
+        'throughput': len(latencies) / wall_time,
+        'latency_ms': dict(zip(('p50', 'p90', 'p99'), percentiles), max=float(latencies.max())),
+        'service': await _request_stats(address),
+    }
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    from utils import read_parameters_from_yaml
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=None,
+                        help="Unix socket path, query_service.socket by default")
+    parser.add_argument('--port', type=int, default=None, help="TCP port on localhost")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=100, help="requests per client")
+    parser.add_argument('--distinct', type=int, default=50, help="distinct queries in the pool")
+    parser.add_argument('--batch', type=int, default=1, help="queries per request")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    qp = read_parameters_from_yaml("base_parameters.yaml")
+    if args.port is not None:
+        connect_to = {'port': args.port}
+    else:
+        socket_path = args.socket or get_service_params(qp)['socket']
+        connect_to = ({'socket_path': socket_path} if socket_path is not None
+                      else {'port': get_service_params(qp)['port']})
+
+    report = asyncio.run(run_load(make_queries(qp, args.distinct, args.seed), args.clients,
+                                  args.requests, args.batch, args.seed, connect_to))
+    latency = report['latency_ms']
+    print(f"{report['requests']} requests of {args.batch} queries by {args.clients} clients "
+          f"in {report['wall_time']:.2f} s, {report['throughput']:.1f} requests/s")
+    print(f"Latency, ms: p50 {latency['p50']:.2f}, p90 {latency['p90']:.2f}, "
+          f"p99 {latency['p99']:.2f}, max {latency['max']:.2f}")
+    print(f"Service: {json.dumps(report['service'])}")
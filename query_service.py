@@ -0,0 +1,399 @@
+"""
+Local query service of the numerical solution.
+
+A long-running asyncio server keeps worker processes with imported solver, the on-disk
+calculation cache and an in-memory LRU of results, so tools pay neither interpreter
+startup nor imports nor repeated solves:
+
+    python query_service.py [--socket results/query_service.sock | --port 8765] [--workers 4]
+
+The protocol is newline-delimited JSON over a Unix socket (TCP on localhost with --port).
+A connection may send any number of request lines, responses carry the id of the request
+and may come out of order:
+
+    {"id": 1, "params": {kwargs of run_calculation}}     -> {"id": 1, "result": {...}}
+    {"id": 2, "batch": [{kwargs}, {kwargs}, ...]}         -> {"id": 2, "results": [...]}
+    {"id": 3, "stats": true}                              -> {"id": 3, "stats": {...}}
+
+Failed requests get {"id": ..., "error": message}. Identical queries in flight are
+coalesced into one solve, misses are solved in the process pool. Counters and latency
+percentiles are returned by the stats request, see QueryService.stats.
+query_load.py measures latency under concurrent clients.
+"""
+import asyncio
+import collections
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+from cache import cached_run_calculation, calc_key, get_calc_cache, to_json
+from instrumentation import log
+from parallel import process_pool
+from sweep import get_parallel_params
+from utils import calc_moments_by_mean_and_coev
+
+# kwargs of run_calculation accepted in queries
+QUERY_PARAMS = ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels', 'p_size', 'accuracy')
+REQUIRED_PARAMS = ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels')
+
+MOMENT_PARAMS = ('b', 'b_w', 'b_c', 'b_d')
+
+# the solver fits H2 distributions by three moments
+NUM_MOMENTS = 3
+
+SOCKET_FILE = os.path.join('results', 'query_service.sock')
+
+# number of last request latencies, that percentiles are computed from
+LATENCY_WINDOW = 10_000
+
+# request lines are limited by this size, batches of thousands of queries fit
+LINE_LIMIT = 2 ** 24
+
+
+def get_service_params(qp: dict) -> dict:
+    """
+    Read the 'query_service' section of the experiment parameters, filling defaults.
+    :param qp: dictionary of parameters
+    :return: dict with keys socket, port, max_entries
+    """
+    params = qp.get('query_service') or {}
+    return {
+        'socket': params.get('socket', SOCKET_FILE),
+        'port': params.get('port', 8765),
+        'max_entries': int(params.get('max_entries', 10_000)),
+    }
+
+
+def check_query(params: dict) -> dict:
+    """
+    Validate a query: only kwargs of run_calculation, all required are present,
+    moments are lists of at least NUM_MOMENTS numbers.
+    :return: params with num_channels as int
+    """
+    if not isinstance(params, dict):
+        raise ValueError(f"Query must be an object of run_calculation kwargs, got {params!r}")
+    unknown = set(params) - set(QUERY_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown query parameters {sorted(unknown)}, "
+                         f"expected some of {QUERY_PARAMS}")
+    missing = [name for name in REQUIRED_PARAMS if name not in params]
+    if missing:
+        raise ValueError(f"Query parameters {missing} are not given")
+    for name in MOMENT_PARAMS:
+        moments = params[name]
+        if (not isinstance(moments, list) or len(moments) < NUM_MOMENTS
+                or not all(isinstance(m, (int, float)) and not isinstance(m, bool)
+                           for m in moments)):
+            raise ValueError(f"Query parameter {name} must be a list of at least "
+                             f"{NUM_MOMENTS} numbers (initial moments), got {moments!r}")
+    return dict(params, num_channels=int(params['num_channels']))
+
+
+def _warm_up():
+    """
+    Solve a small model at the start of a worker, so that the first query
+    does not pay for imports and first calls.
+    """
+    b = calc_moments_by_mean_and_coev(0.5, 1.2)
+    b_vacation = calc_moments_by_mean_and_coev(1.0, 1.2)
+    cached_run_calculation(arrival_rate=1.0, b=b, b_w=b_vacation, b_c=b_vacation,
+                           b_d=b_vacation, num_channels=1)
+
+
+def _solve(params: dict, calc_cache) -> dict:
+    """
+    Solve a query in a worker process.
+    """
+    stat = cached_run_calculation(**params, cache=calc_cache)
+    return to_json(stat)
+
+
+def _noop():
+    return None
+
+
+class QueryService:
+    """
+    Answers queries from the in-memory LRU of results, coalesces identical queries
+    in flight and solves misses in the executor.
+    """
+
+    def __init__(self, executor, calc_cache=None, max_entries: int = 10_000):
+        """
+        :param executor: concurrent.futures executor for solves
+        :param calc_cache: CalcCache or None, used by workers
+        :param max_entries: results kept in memory, least recently used are dropped
+        """
+        self.executor = executor
+        self.calc_cache = calc_cache
+        self.max_entries = max_entries
+        self.results = collections.OrderedDict()
+        self.in_flight = {}
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.solve_time = 0.0
+        self.start_time = time.perf_counter()
+
+    async def query(self, params: dict) -> dict:
+        """
+        Result of run_calculation for the query.
+        """
+        params = check_query(params)
+        self.counters['queries'] += 1
+        # calculation keys are invariant to the time scale, results are not
+        key = (calc_key(**params), float(params['arrival_rate']))
+
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return self.results[key]
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.in_flight[key] = future
+        solve_start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self.executor, _solve, params, self.calc_cache)
+        except Exception as error:
+            self.counters['failed_solves'] += 1
+            future.set_exception(error)
+            # waiters get the error, the future itself is not reported as unretrieved
+            future.exception()
+            raise
+        except asyncio.CancelledError:
+            # coalesced waiters would wait for the cancelled solve forever
+            future.set_exception(RuntimeError("Solve of the query was cancelled"))
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+            self.solve_time += time.perf_counter() - solve_start
+
+        self.counters['solves'] += 1
+        future.set_result(result)
+        self.results[key] = result
+        if len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+        return result
+
+    async def handle_request(self, request: dict) -> dict:
+        """
+        Response to one request line, see the module docstring.
+        """
+        request_start = time.perf_counter()
+        self.counters['requests'] += 1
+        response = {'id': request.get('id')} if isinstance(request, dict) else {'id': None}
+        try:
+            if not isinstance(request, dict):
+                raise ValueError(f"Request must be an object, got {request!r}")
+            if 'params' in request:
+                response['result'] = await self.query(request['params'])
+            elif 'batch' in request:
+                response['results'] = await asyncio.gather(
+                    *[self.query(params) for params in request['batch']])
+            elif request.get('stats'):
+                response['stats'] = self.stats()
+            else:
+                raise ValueError("Request must have 'params', 'batch' or 'stats'")
+        except Exception as error:  # the error is sent to the client, the server goes on
+            self.counters['errors'] += 1
+            response['error'] = f"{type(error).__name__}: {error}"
+        self.latencies.append(time.perf_counter() - request_start)
+        return response
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        """
+        Serve request lines of a connection concurrently until the client closes it.
+        """
+        self.counters['connections'] += 1
+        pending = set()
+        write_lock = asyncio.Lock()
+
+        async def respond(line: bytes):
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as error:
+                self.counters['errors'] += 1
+                response = {'id': None, 'error': f"JSONDecodeError: {error}"}
+            else:
+                response = await self.handle_request(request)
+            async with write_lock:
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.create_task(respond(line))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as error:
+            log(f"Connection closed: {error}")
+        finally:
+            writer.close()
+
+    def stats(self) -> dict:
+        """
+        Counters of the service: requests, queries, memory_hits, coalesced, solves,
+        failed_solves, errors, connections; in_flight and cached queries, uptime, s,
+        throughput - requests per second of uptime, mean_solve_time, s and
+        latency_ms - percentiles of last LATENCY_WINDOW request latencies.
+        """
+        uptime = time.perf_counter() - self.start_time
+        stats = {name: self.counters[name] for name in
+                 ('requests', 'queries', 'memory_hits', 'coalesced', 'solves',
+                  'failed_solves', 'errors', 'connections')}
+        stats['in_flight'] = len(self.in_flight)
+        stats['cached'] = len(self.results)
+        stats['uptime'] = uptime
+        stats['throughput'] = self.counters['requests'] / uptime if uptime > 0 else 0.0
+        solves = self.counters['solves'] + self.counters['failed_solves']
+        stats['mean_solve_time'] = self.solve_time / solves if solves else None
+        if self.latencies:
+            percentiles = np.percentile(np.array(self.latencies) * 1e3, [50, 90, 99])
+            stats['latency_ms'] = dict(zip(('p50', 'p90', 'p99'), percentiles.tolist()))
+        return stats
+
+
+async def serve(qp: dict, socket_path: str = None, port: int = None, ready=None):
+    """
+    Run the service until it is cancelled.
+    :param qp: dictionary of parameters, 'parallel', 'cache' and 'query_service' sections are used
+    :param socket_path: path of the Unix socket, if port is None
+    :param port: TCP port on localhost
+    :param ready: asyncio.Event, that is set when the service accepts connections
+    """
+    params = get_service_params(qp)
+    parallel = get_parallel_params(qp)
+    if port is None and socket_path is None:
+        socket_path = params['socket']
+        if socket_path is None:
+            port = params['port']
+
+    with process_pool(parallel['workers'], parallel['blas_threads'],
+                      initializer=_warm_up) as executor:
+        service = QueryService(executor, get_calc_cache(qp), params['max_entries'])
+        loop = asyncio.get_running_loop()
+        # start all workers before the first query
+        await asyncio.gather(*[loop.run_in_executor(executor, _noop)
+                               for _ in range(parallel['workers'])])
+
+        if port is not None:
+            server = await asyncio.start_server(service.handle_connection, '127.0.0.1', port,
+                                                limit=LINE_LIMIT)
+            address = f"127.0.0.1:{port}"
+        else:
+            os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(service.handle_connection, socket_path,
+                                                     limit=LINE_LIMIT)
+            address = socket_path
+
+        print(f"Query service on {address} with {parallel['workers']} workers")
+        try:
+            async with server:
+                if ready is not None:
+                    ready.set()
+                await server.serve_forever()
+        finally:
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+async def open_connection(socket_path: str = None, port: int = None):
+    """
+    Connect to the service.
+    :return: (asyncio.StreamReader, asyncio.StreamWriter)
+    """
+    if port is not None:
+        return await asyncio.open_connection('127.0.0.1', port, limit=LINE_LIMIT)
+    return await asyncio.open_unix_connection(socket_path or SOCKET_FILE, limit=LINE_LIMIT)
+
+
+class ServiceClient:
+    """
+    Blocking client for tools: one request at a time over a kept-open connection.
+    """
+
+    def __init__(self, socket_path: str = None, port: int = None):
+        """
+        :param socket_path: path of the Unix socket of the service, if port is None
+        :param port: TCP port on localhost
+        """
+        if port is not None:
+            self.sock = socket.create_connection(('127.0.0.1', port))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path or SOCKET_FILE)
+        self.file = self.sock.makefile('rwb')
+        self.next_id = 0
+
+    def request(self, message: dict) -> dict:
+        """
+        Send a request and wait for its response.
+        :raise RuntimeError: if the service returned an error
+        """
+        self.next_id += 1
+        self.file.write(json.dumps(dict(message, id=self.next_id)).encode("utf-8") + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def query(self, params: dict) -> dict:
+        """
+        Result of run_calculation(**params).
+        """
+        return self.request({'params': params})['result']
+
+    def batch(self, queries: list[dict]) -> list[dict]:
+        """
+        Results of several queries.
+        """
+        return self.request({'batch': queries})['results']
+
+    def stats(self) -> dict:
+        """
+        Counters of the service, see QueryService.stats.
+        """
+        return self.request({'stats': True})['stats']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    from utils import read_parameters_from_yaml
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=None,
+                        help="Unix socket path, query_service.socket by default")
+    parser.add_argument('--port', type=int, default=None, help="TCP port on localhost")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="solver processes, parallel.workers by default")
+    args = parser.parse_args()
+
+    qp = read_parameters_from_yaml("base_parameters.yaml")
+    if args.workers is not None:
+        qp['parallel'] = dict(qp.get('parallel') or {}, workers=args.workers)
+    try:
+        asyncio.run(serve(qp, socket_path=args.socket, port=args.port))
+    except KeyboardInterrupt:
+        print("Query service stopped")
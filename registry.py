@@ -0,0 +1,219 @@
+"""
+Registry of experiments in a SQLite database under results/.
+Experiment ids are allocated atomically (several runs can start at once),
+parameters of every experiment and results of its points are indexed,
+so runs can be queried across experiments without opening their directories:
+
+    python registry.py --where channels=3 --where utilization=0.6:0.8
+"""
+import math
+import os
+import time
+
+import numpy as np
+import yaml
+
+from sqlite_db import SqliteDatabase
+
+REGISTRY_FILE = "registry.sqlite"
+
+# indexed parameters of points, derived from the moments of distributions
+PARAMETERS = ('arrival_rate', 'channels', 'utilization', 'service_mean', 'service_cv',
+              'warmup_mean', 'warmup_cv', 'cooling_mean', 'cooling_cv', 'delay_mean', 'delay_cv')
+
+# results of points, for calculation (_num) and simulation (_sim)
+RESULTS = ('w1', 'warmup_prob', 'cold_prob', 'cold_delay_prob', 'process_time')
+
+# relative tolerance of equality conditions on float parameters
+REL_TOL = 1e-9
+
+
+def calc_mean_and_cv(b) -> tuple[float, float]:
+    """
+    Mean and coefficient of variation by E[X], E[X^2].
+    """
+    mean = float(b[0])
+    return mean, math.sqrt(max(float(b[1]) / mean**2 - 1.0, 0.0))
+
+
+class Registry(SqliteDatabase):
+    """
+    SQLite registry of experiments and their points.
+    """
+
+    def _create_tables(self, con):
+        con.execute("""CREATE TABLE IF NOT EXISTS experiments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, path TEXT,
+            created REAL, status TEXT, parameters TEXT)""")
+
+        columns = ", ".join(f"{name} REAL" for name in _point_columns())
+        con.execute(f"""CREATE TABLE IF NOT EXISTS points (
+            experiment_id INTEGER, key TEXT, {columns},
+            PRIMARY KEY (experiment_id, key))""")
+        con.execute("CREATE INDEX IF NOT EXISTS points_channels_utilization "
+                    "ON points (channels, utilization)")
+        for name in PARAMETERS:
+            con.execute(f"CREATE INDEX IF NOT EXISTS points_{name} ON points ({name})")
+
+    def create_experiment(self, results_folder: str, qp: dict) -> tuple[int, str]:
+        """
+        Allocate the next experiment id and create its directory results_folder/exp_<id>.
+        Ids continue after exp_N directories, that were created before the registry.
+        :param results_folder: directory of experiments
+        :param qp: dictionary of parameters, stored with the experiment
+        :return: (experiment id, experiment directory)
+        """
+        with self._connect() as con:
+            # BEGIN IMMEDIATE takes the write lock, so concurrent runs get different ids
+            con.execute("BEGIN IMMEDIATE")
+            if con.execute("SELECT COUNT(*) FROM experiments").fetchone()[0] == 0:
+                con.execute("DELETE FROM sqlite_sequence WHERE name = 'experiments'")
+                con.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('experiments', ?)",
+                            (_get_last_legacy_id(results_folder),))
+            cur = con.execute(
+                "INSERT INTO experiments (created, status, parameters) VALUES (?, ?, ?)",
+                (time.time(), 'running', yaml.dump(qp)))
+            exp_id = cur.lastrowid
+            path = os.path.join(results_folder, f"exp_{exp_id}")
+            con.execute("UPDATE experiments SET name = ?, path = ? WHERE id = ?",
+                        (f"exp_{exp_id}", path, exp_id))
+            # the directory is created before commit: if it fails, the row is rolled back
+            # instead of staying 'running' without a directory. A directory left by a run
+            # without the registry is reused only if it is empty
+            os.makedirs(path, exist_ok=True)
+            if os.listdir(path):
+                raise FileExistsError(f"Experiment directory {path} exists and is not empty")
+        return exp_id, path
+
+    def get_experiment_id(self, name: str):
+        """
+        Id of the experiment by its directory name, like 'exp_3', or None.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT id FROM experiments WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_status(self, exp_id: int, status: str):
+        """
+        Set status of the experiment: 'running' or 'finished'.
+        """
+        with self._connect() as con:
+            con.execute("UPDATE experiments SET status = ? WHERE id = ?", (status, exp_id))
+
+    def add_points(self, exp_id: int, table: dict):
+        """
+        Index points of the experiment.
+        :param exp_id: experiment id
+        :param table: columns of points, see store.ResultStore.load
+        """
+        rows = []
+        for i, key in enumerate(table.get('key', [])):
+            service_mean, service_cv = calc_mean_and_cv(table['b'][i])
+            values = {
+                'arrival_rate': float(table['arrival_rate'][i]),
+                'channels': float(table['num_channels'][i]),
+                'service_mean': service_mean, 'service_cv': service_cv,
+            }
+            values['utilization'] = values['arrival_rate'] * service_mean / values['channels']
+            for name, column in (('warmup', 'b_w'), ('cooling', 'b_c'), ('delay', 'b_d')):
+                values[f'{name}_mean'], values[f'{name}_cv'] = calc_mean_and_cv(table[column][i])
+            for name in RESULTS:
+                for kind in ('num', 'sim'):
+                    column = table.get(f"{kind}.w" if name == 'w1' else f"{kind}.{name}")
+                    value = None if column is None else np.ravel(column[i])[0]
+                    values[f'{name}_{kind}'] = None if value is None else float(value)
+            rows.append((exp_id, str(key)) + tuple(values[name] for name in _point_columns()))
+
+        placeholders = ", ".join("?" * (len(_point_columns()) + 2))
+        with self._connect() as con:
+            con.executemany(f"INSERT OR REPLACE INTO points VALUES ({placeholders})", rows)
+
+    def query_points(self, **conditions) -> list[dict]:
+        """
+        Points of all experiments, that satisfy conditions.
+        :param conditions: parameter=value for equality (floats are compared with
+            relative tolerance REL_TOL) or parameter=(low, high) for a closed range,
+            parameter is one of PARAMETERS
+        :return: list of dicts with experiment name, parameters and results of points
+        """
+        where = []
+        args = []
+        for name, condition in conditions.items():
+            if name not in PARAMETERS:
+                raise ValueError(f"Unknown parameter {name}, expected one of {PARAMETERS}")
+            if isinstance(condition, (tuple, list)):
+                low, high = condition
+            else:
+                low = high = condition
+            tol = REL_TOL * max(abs(low), abs(high))
+            where.append(f"points.{name} BETWEEN ? AND ?")
+            args += [low - tol, high + tol]
+
+        sql = ("SELECT experiments.name, points.* FROM points "
+               "JOIN experiments ON experiments.id = points.experiment_id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._connect() as con:
+            cur = con.execute(sql, args)
+            names = ['experiment'] + [column[0] for column in cur.description[1:]]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def list_experiments(self) -> list[dict]:
+        """
+        All registered experiments: id, name, path, created, status.
+        """
+        with self._connect() as con:
+            cur = con.execute("SELECT id, name, path, created, status FROM experiments")
+            names = [column[0] for column in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def _point_columns() -> tuple:
+    return PARAMETERS + tuple(f"{name}_{kind}" for name in RESULTS for kind in ('num', 'sim'))
+
+
+def _get_last_legacy_id(results_folder: str) -> int:
+    """
+    Largest N of exp_N directories, that exist in results_folder.
+    """
+    if not os.path.isdir(results_folder):
+        return 0
+    ids = [int(name[4:]) for name in os.listdir(results_folder)
+           if name.startswith("exp_") and name[4:].isdigit()]
+    return max(ids, default=0)
+
+
+def get_registry(results_folder: str) -> Registry:
+    """
+    Registry of the results folder.
+    """
+    return Registry(os.path.join(results_folder, REGISTRY_FILE))
+
+
+def _parse_condition(text: str):
+    name, value = text.split('=', 1)
+    if ':' in value:
+        low, high = value.split(':', 1)
+        return name, (float(low), float(high))
+    return name, float(value)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query points of all experiments")
+    parser.add_argument('--where', action='append', default=[], metavar='PARAM=VALUE',
+                        help=f"condition like channels=3 or utilization=0.6:0.8, "
+                             f"PARAM is one of {', '.join(PARAMETERS)}")
+    args = parser.parse_args()
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    registry = get_registry(os.path.join(cur_dir, "results"))
+
+    points = registry.query_points(**dict(_parse_condition(text) for text in args.where))
+    print(f"{'experiment':>12} {'n':>3} {'rho':>6} {'w1 num':>9} {'w1 sim':>9}")
+    for point in points:
+        print(f"{point['experiment']:>12} {point['channels']:3.0f} {point['utilization']:6.3f} "
+              f"{point['w1_num']:9.4f} {point['w1_sim']:9.4f}")
+    print(f"{len(points)} points")
@@ -0,0 +1,80 @@
+"""
+Background rendering of plots.
+Plot jobs are put to the queue of a separate process pool, so figures of a finished
+sweep are drawn while the next sweep is computed. Rendering workers use the
+non-interactive backend, resolution and format of the 'plots' section.
+"""
+import contextlib
+
+from parallel import process_pool
+
+
+def _init_worker(dpi: int, fmt: str):
+    """
+    Configure plots in a rendering worker.
+    """
+    from plots import configure
+
+    configure(dpi=dpi, fmt=fmt)
+
+
+class PlotRenderer:
+    """
+    Runs plot jobs in a process pool, or in the current process if there is no pool.
+    Errors of jobs are raised by wait.
+    """
+
+    def __init__(self, executor=None, dpi: int = 300, fmt: str = 'png'):
+        """
+        :param executor: process pool or None to draw in the current process
+        :param dpi: resolution of saved figures
+        :param fmt: format of saved figures
+        """
+        self.executor = executor
+        self.dpi = dpi
+        self.fmt = fmt
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a plot job.
+        :param func: picklable function, that draws and saves figures
+        """
+        if self.executor is None:
+            _init_worker(self.dpi, self.fmt)
+            func(*args, **kwargs)
+            return
+        self.futures.append(self.executor.submit(func, *args, **kwargs))
+
+    def wait(self):
+        """
+        Wait for all queued jobs.
+        """
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+
+@contextlib.contextmanager
+def plot_renderer(qp: dict):
+    """
+    Plot renderer configured by the 'plots' section: dpi, format, workers.
+    All queued jobs are finished on exit.
+    :param qp: dictionary of parameters
+    """
+    params = qp.get('plots') or {}
+    dpi = params.get('dpi', 300)
+    fmt = params.get('format', 'png')
+    workers = params.get('workers', 1)
+
+    if not workers:
+        renderer = PlotRenderer(dpi=dpi, fmt=fmt)
+        yield renderer
+        renderer.wait()
+        return
+
+    with process_pool(workers, blas_threads=1, initializer=_init_worker,
+                      initargs=(dpi, fmt)) as executor:
+        renderer = PlotRenderer(executor, dpi=dpi, fmt=fmt)
+        yield renderer
+        renderer.wait()
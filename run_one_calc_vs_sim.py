@@ -7,17 +7,26 @@ import time
 import numpy as np
 from most_queue.general.tables import probs_print, times_print
 from most_queue.rand_distribution import GammaDistribution
-from most_queue.sim.vacations import VacationQueueingSystemSimulator
+from most_queue.theory.calc_params import TakahashiTakamiParams
 from most_queue.theory.vacations.mgn_with_h2_delay_cold_warm import (
     MGnH2ServingColdWarmDelay,
 )
 
+from instrumentation import is_quiet, log, merge_timings, span
+from parallel import process_pool
 from utils import calc_moments_by_mean_and_coev
+from vacation_sim import simulate_vacation_queue
+
+# simulators of a replication: most_queue VacationQueueingSystemSimulator
+# or the specialised NumPy simulator of vacation_sim.py
+ENGINES = ('most_queue', 'numpy')
+DEFAULT_ENGINE = 'most_queue'
 
 
 def run_calculation(arrival_rate: float, b: list[float],
                     b_w: list[float], b_c: list[float], b_d: list[float],
-                    num_channels: int, p_size: int=10):
+                    num_channels: int, p_size: int=10, accuracy: float = None,
+                    warm_start: dict = None, return_state: bool = False):
     """
     Calculation of an M/H2/n queue with H2-warming, H2-cooling and H2-delay 
     of the start of cooling using Takahasi-Takami method.
@@ -28,35 +37,263 @@ def run_calculation(arrival_rate: float, b: list[float],
         b_c (list): A list containing the E[X^k] k=0, 1, 2. for the cooling time distribution.
         b_d (list): A list containing the E[X^k] k=0, 1, 2. for the delay time distribution.
         num_of_channels (int): The number of channels in the queue.
+        accuracy (float): Stopping tolerance of iterations, None - solver default.
+        warm_start (dict): 'solver_state' of a neighbouring point to start iterations from,
+            if it does not fit or the solve fails, the solver starts from scratch.
+        return_state (bool): Whether to return converged solver state as 'solver_state'.
     Returns:
-        dict: A dictionary containing the statistics of the queue.
+        dict: A dictionary containing the statistics of the queue,
+            'timings' - spans solver_setup, iterations and moments, see instrumentation.span.
     """
     num_start = time.process_time()
+    timings = {}
+
+    with span(timings, 'solver_setup'):
+        calc_params = TakahashiTakamiParams()
+        if accuracy is not None:
+            calc_params.accuracy = accuracy
 
-    solver = MGnH2ServingColdWarmDelay(
-        arrival_rate, b, b_w, b_c, b_d, num_channels)
+        solver = MGnH2ServingColdWarmDelay(
+            arrival_rate, b, b_w, b_c, b_d, num_channels, calc_params=calc_params)
 
-    solver.run()
+    with span(timings, 'iterations') as record:
+        num_of_iter = None
+        if warm_start is not None and _load_solver_state(solver, warm_start):
+            num_of_iter = _run_warm_started(solver)
+            if num_of_iter is None:
+                log("Warm-started solve failed, starting from scratch")
+                solver = MGnH2ServingColdWarmDelay(
+                    arrival_rate, b, b_w, b_c, b_d, num_channels, calc_params=calc_params)
+
+        warm_started = num_of_iter is not None
+        if not warm_started:
+            solver.run()
+            num_of_iter = solver.num_of_iter_
+        record['iterations'] = num_of_iter
 
     stat = {}
-    stat["w"] = solver.get_w()
-    stat["v"] = solver.get_v()
+    with span(timings, 'moments'):
+        stat["w"] = solver.get_w()
+        stat["v"] = solver.get_v()
+        stat["p"] = solver.get_p()[:p_size]
+
+        stat["warmup_prob"] = solver.get_warmup_prob()
+        stat["cold_prob"] = solver.get_cold_prob()
+        stat["cold_delay_prob"] = solver.get_cold_delay_prob()
+        stat['servers_busy_probs'] = solver.get_probs_of_servers_busy()
+
     stat["process_time"] = time.process_time() - num_start
-    stat["p"] = solver.get_p()[:p_size]
-    stat["num_of_iter"] = solver.num_of_iter_
+    stat["num_of_iter"] = num_of_iter
+    stat["warm_started"] = warm_started
+    stat["timings"] = timings
 
-    stat["warmup_prob"] = solver.get_warmup_prob()
-    stat["cold_prob"] = solver.get_cold_prob()
-    stat["cold_delay_prob"] = solver.get_cold_delay_prob()
-    stat['servers_busy_probs'] = solver.get_probs_of_servers_busy()
+    if return_state:
+        stat["solver_state"] = {"t": [t.copy() for t in solver.t], "x": solver.x.copy()}
  
     return stat
 
 
+def _load_solver_state(solver, state: dict) -> bool:
+    """
+    Set microstate probabilities and level ratios of the solver
+    from the converged state of another point.
+    Returns False if the state has other dimensions (number of channels or levels).
+    """
+    if len(state["t"]) != len(solver.t) or any(
+            np.shape(t) != np.shape(t_new) for t, t_new in zip(state["t"], solver.t)):
+        return False
+    solver.t = [np.array(t, dtype=solver.dt) for t in state["t"]]
+    solver.x = np.array(state["x"], dtype=solver.dt)
+    return True
+
+
+def _run_warm_started(solver):
+    """
+    Run warm-started solver.
+    Stopping rule of the solver compares max level ratio of successive iterations,
+    so the first run from a converged state of another point stops after one iteration
+    with almost unchanged ratios. The second run converges to the new point.
+    Y is reset before each run, since run() appends to it.
+    Returns total number of iterations or None if the solve failed.
+    """
+    num_of_iter = 0
+    try:
+        for _ in range(2):
+            solver.Y = []
+            solver.run()
+            num_of_iter += solver.num_of_iter_
+    except (ArithmeticError, ValueError, np.linalg.LinAlgError):
+        return None
+
+    if not np.all(np.isfinite(solver.x)) or not np.all(np.isfinite(solver.p)):
+        return None
+    return num_of_iter
+
+
+def simulate_replication(arrival_rate: float, b: list[float],
+                         b_w: list[float], b_c: list[float], b_d: list[float],
+                         num_channels: int, num_of_jobs: int = 300_000,
+                         p_size: int = 10, seed=None, engine: str = DEFAULT_ENGINE,
+                         crn: bool = False, controls: bool = False):
+    """
+    Run one replication of the simulation for an M/H2/n queue with H2-warming,
+    H2-cooling and H2-delay before cooling starts.
+    Args:
+        arrival_rate, b, b_w, b_c, b_d, num_channels, num_of_jobs, p_size: see run_simulation
+        seed: seed of the replication random stream
+            (int, np.random.SeedSequence or None for OS entropy).
+        engine (str): one of ENGINES. Engines use the seed differently,
+            so their replications with the same seed are not equal.
+        crn (bool): common random numbers, see vacation_sim.py, only for the numpy engine.
+        controls (bool): whether to add control variates of the run as 'controls',
+            see vacation_sim.calc_controls, only for the numpy engine.
+    Returns:
+        dict: statistics of the replication,
+            'timings' - spans sim_setup and event_loop, see instrumentation.span.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown simulation engine {engine}, expected one of {ENGINES}")
+    if crn and engine != 'numpy':
+        raise ValueError("Common random numbers are supported only by the numpy engine")
+    if controls and engine != 'numpy':
+        raise ValueError("Control variates are supported only by the numpy engine")
+
+    timings = {}
+    if engine == 'numpy':
+        with span(timings, 'event_loop') as record:
+            stat = simulate_vacation_queue(arrival_rate, b, b_w, b_c, b_d, num_channels,
+                                           num_of_jobs=num_of_jobs, p_size=p_size, seed=seed,
+                                           crn=crn, controls=controls)
+            record['jobs'] = num_of_jobs
+        stat["seed"] = describe_seed(seed)
+        stat["timings"] = timings
+        return stat
+
+    im_start = time.process_time()
+
+    with span(timings, 'sim_setup'):
+        # the simulator imports tqdm, calculation-only processes do not need it
+        from most_queue.sim.vacations import VacationQueueingSystemSimulator
+
+        quiet = is_quiet()
+        sim = VacationQueueingSystemSimulator(num_channels, verbose=not quiet)
+        # all distributions of the simulator take random numbers from its generator
+        sim.generator = np.random.default_rng(seed)
+        sim.set_sources(arrival_rate, 'M')
+
+        sim.set_servers(GammaDistribution.get_params(b), 'Gamma')
+        sim.set_warm(GammaDistribution.get_params(b_w), 'Gamma')
+        sim.set_cold(GammaDistribution.get_params(b_c), 'Gamma')
+        sim.set_cold_delay(GammaDistribution.get_params(b_d), 'Gamma')
+
+    with span(timings, 'event_loop') as record:
+        if quiet:
+            # the same loop as sim.run, without its messages and progress bar
+            while sim.served < num_of_jobs:
+                sim.run_one_step()
+        else:
+            sim.run(num_of_jobs)
+        record['jobs'] = num_of_jobs
+
+    return {
+        "w": list(sim.w),
+        "v": list(sim.v),
+        "p": sim.get_p()[:p_size],
+        "cold_prob": sim.get_cold_prob(),
+        "cold_delay_prob": sim.get_cold_delay_prob(),
+        "warmup_prob": sim.get_warmup_prob(),
+        "process_time": time.process_time() - im_start,
+        "num_of_jobs": sim.served,
+        "num_of_waits": sim.taked,
+        "sim_time": sim.ttek,
+        "seed": describe_seed(seed),
+        "timings": timings,
+    }
+
+
+def replication_seeds(seed, indices) -> list:
+    """
+    Seeds of replications with given indices.
+    Replication i gets i-th child of the master seed, as SeedSequence.spawn does,
+    so any subset of replications can be (re)computed independently.
+    :param seed: master seed (int, np.random.SeedSequence or None for OS entropy)
+    :param indices: indices of replications
+    :return: list of np.random.SeedSequence
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,),
+                                   pool_size=seed.pool_size) for i in indices]
+
+
+def describe_seed(seed):
+    """
+    JSON-serializable description of a replication seed.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return {"entropy": seed.entropy, "spawn_key": list(seed.spawn_key)}
+    return seed
+
+
+def _simulate_replication_job(params: dict):
+    """
+    Unpack kwargs of simulate_replication, used by the process pool.
+    """
+    return simulate_replication(**params)
+
+
+def aggregate_replications(replications: list[dict]) -> dict:
+    """
+    Average statistics of independent replications.
+    :param replications: list of dicts returned by simulate_replication
+    :return: dict with averaged w, v, p and phase probabilities,
+        process_time is summed CPU time of all replications,
+        timings - spans of replications merged and the aggregation span.
+    """
+    stat = {}
+    timings = merge_timings(rep.get("timings") for rep in replications)
+
+    with span(timings, 'aggregation'):
+        stat["w"] = np.mean([rep["w"] for rep in replications], axis=0).tolist()
+        stat["v"] = np.mean([rep["v"] for rep in replications], axis=0).tolist()
+        stat["process_time"] = np.sum([rep["process_time"] for rep in replications])
+        stat["cold_prob"] = np.mean([rep["cold_prob"] for rep in replications])
+        stat["cold_delay_prob"] = np.mean([rep["cold_delay_prob"] for rep in replications])
+        stat["warmup_prob"] = np.mean([rep["warmup_prob"] for rep in replications])
+        stat["p"] = np.mean([rep["p"] for rep in replications], axis=0).tolist()
+    stat["timings"] = timings
+
+    return stat
+
+
+def run_replications(params: dict, seeds: list, workers: int = 1) -> list[dict]:
+    """
+    Run replications of the simulation, one per seed.
+    :param params: kwargs of simulate_replication except seed
+    :param seeds: list of replication seeds
+    :param workers: number of worker processes
+    :return: list of replication statistics in the order of seeds
+    """
+    jobs = [dict(params, seed=rep_seed) for rep_seed in seeds]
+
+    workers = min(workers, len(jobs))
+    if workers > 1:
+        log(f"Running {len(jobs)} simulations in {workers} processes")
+        with process_pool(workers) as executor:
+            return list(executor.map(_simulate_replication_job, jobs))
+
+    replications = []
+    for sim_run_num, job in enumerate(jobs):
+        log(f"Running simulation {sim_run_num + 1} of {len(jobs)}")
+        replications.append(simulate_replication(**job))
+    return replications
+
+
 def run_simulation(arrival_rate: float, b: list[float],
                    b_w: list[float], b_c: list[float], b_d: list[float],
                    num_channels: int, num_of_jobs: int = 300_000, 
-                   ave_num: int = 10, p_size: int=10):
+                   ave_num: int = 10, p_size: int=10, seed=None, workers: int = 1,
+                   engine: str = DEFAULT_ENGINE, crn: bool = False):
     """
     Run simulation for an M/H2/n queue with H2-warming, 
     H2-cooling and H2-delay before cooling starts.
@@ -68,55 +305,28 @@ def run_simulation(arrival_rate: float, b: list[float],
         b_d (list): A list containing the E[X^k] k=0, 1, 2. for the delay time distribution.
         num_of_channels (int): The number of channels in the queue.
         num_of_jobs (int): The number of jobs to simulate.
+        ave_num (int): The number of independent replications to average.
+        seed: master seed (int, np.random.SeedSequence or None).
+            Replication streams are spawned from it, so results are reproducible
+            and do not depend on the number of workers.
+        workers (int): The number of worker processes for replications.
+        engine (str): simulator of replications, one of ENGINES.
+        crn (bool): common random numbers, see simulate_replication.
     Returns:
         dict: A dictionary containing the statistics of the queue.
+            process_time is summed CPU time of replications, wall_time - elapsed time.
     """
+    wall_start = time.perf_counter()
 
-    gamma_params = GammaDistribution.get_params(b)
-    gamma_params_warm = GammaDistribution.get_params(b_w)
-    gamma_params_cold = GammaDistribution.get_params(b_c)
-    gamma_params_cold_delay = GammaDistribution.get_params(b_d)
-
-    ws = []
-    vs = []
-    ps = []
-    process_times = []
-    warmup_probs = []
-    cold_probs = []
-    cold_delay_probs = []
-
-    for sim_run_num in range(ave_num):
-        print(f"Running simulation {sim_run_num + 1} of {ave_num}")
-
-        im_start = time.process_time()
-        sim = VacationQueueingSystemSimulator(num_channels)
-        sim.set_sources(arrival_rate, 'M')
-
-        sim.set_servers(gamma_params, 'Gamma')
-        sim.set_warm(gamma_params_warm, 'Gamma')
-        sim.set_cold(gamma_params_cold, 'Gamma')
-        sim.set_cold_delay(gamma_params_cold_delay, 'Gamma')
-        sim.run(num_of_jobs)
-
-        ws.append(sim.w)
-        vs.append(sim.v)  
-        process_times.append(time.process_time() - im_start)
-        cold_probs.append(sim.get_cold_prob())
-        cold_delay_probs.append(sim.get_cold_delay_prob())
-        warmup_probs.append(sim.get_warmup_prob())
-        ps.append(sim.get_p()[:p_size])
+    params = {
+        'arrival_rate': arrival_rate, 'b': b, 'b_w': b_w, 'b_c': b_c, 'b_d': b_d,
+        'num_channels': num_channels, 'num_of_jobs': num_of_jobs, 'p_size': p_size,
+        'engine': engine, 'crn': crn}
+    replications = run_replications(params, replication_seeds(seed, range(ave_num)), workers)
 
     # average over all simulations
-
-    stat = {}
-
-    stat["w"] = np.mean(ws, axis=0).tolist()
-    stat["v"] = np.mean(vs, axis=0).tolist()
-    stat["process_time"] = np.sum(process_times)
-    stat["cold_prob"] = np.mean(cold_probs)
-    stat["cold_delay_prob"] = np.mean(cold_delay_probs)
-    stat["warmup_prob"] = np.mean(warmup_probs)
-    stat["p"] = np.mean(ps, axis=0).tolist()
+    stat = aggregate_replications(replications)
+    stat["wall_time"] = time.perf_counter() - wall_start
 
     return stat
 
@@ -145,10 +355,13 @@ if __name__ == "__main__":
     sim_results = run_simulation(
         arrival_rate=qp['arrival_rate'], num_channels=qp['channels']['base'], b=b_service,
         b_w=b_warmup, b_c=b_cooling, b_d=b_delay, num_of_jobs=qp['jobs_per_sim'],
-        ave_num=qp['sim_to_average']
+        ave_num=qp['sim_to_average'], seed=qp['simulation']['seed'],
+        workers=qp['simulation']['workers'],
+        engine=qp['simulation'].get('engine', DEFAULT_ENGINE)
     )
     
     print(f"Sim process time {sim_results['process_time']}")
+    print(f"Sim wall time {sim_results['wall_time']}")
     print(f"Calculation process time {num_results['process_time']}")
 
     probs_print(p_sim=sim_results["p"], p_num=num_results["p"], size=10)
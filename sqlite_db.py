@@ -0,0 +1,46 @@
+"""
+SQLite database base class shared by the caches (cache.py) and the registry
+of experiments (registry.py).
+"""
+import abc
+import contextlib
+import os
+import sqlite3
+
+
+class SqliteDatabase(abc.ABC):
+    """
+    Base class of stores in a SQLite database (caches, the registry of experiments).
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path to the database file, directories are created if needed
+        """
+        self.path = path
+
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(con)
+
+    @abc.abstractmethod
+    def _create_tables(self, con):
+        """
+        Create tables of the store if they do not exist.
+        :param con: open connection
+        """
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # every call opens its own connection, so the object can be pickled
+        # to worker processes and used from them concurrently
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
@@ -0,0 +1,90 @@
+"""
+Startup benchmark of the compute path.
+Every compute entry point is imported in a fresh interpreter several times,
+the median import time must stay below the budget and plotting/progress bar
+modules must not be imported at all. Exit code is 1 if any check fails.
+
+    python startup_benchmark.py --budget 1.2
+"""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# entry points of computations and the module imported by pool workers (sweep)
+COMPUTE_MODULES = ('sweep', 'main', 'find_best_delay_w1', 'find_best_delay_tail')
+
+FORBIDDEN_MODULES = ('matplotlib', 'tqdm')
+
+MEASURE_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed,
+                   "forbidden": [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, repeat: int = 5) -> dict:
+    """
+    Import module in fresh interpreters.
+    :param module: module name
+    :param repeat: number of interpreters
+    :return: dict with median and max import time in seconds and forbidden modules imported
+    """
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.pop('MPLBACKEND', None)
+
+    times = []
+    forbidden = set()
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", MEASURE_CODE.format(module=module,
+                                                       forbidden=FORBIDDEN_MODULES)],
+            cwd=cur_dir, env=env, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result["time"])
+        forbidden.update(result["forbidden"])
+
+    return {'median': float(np.median(times)), 'max': float(np.max(times)),
+            'forbidden': sorted(forbidden)}
+
+
+def run(budget: float, repeat: int = 5) -> bool:
+    """
+    Measure all compute modules and print a report.
+    :param budget: maximum median import time in seconds
+    :param repeat: number of fresh interpreters per module
+    :return: whether all checks passed
+    """
+    passed = True
+    print(f"{'module':>22} {'median, s':>10} {'max, s':>8}  status")
+    for module in COMPUTE_MODULES:
+        result = measure_import(module, repeat)
+        problems = []
+        if result['median'] > budget:
+            problems.append(f"over budget {budget:g} s")
+        if result['forbidden']:
+            problems.append(f"imports {', '.join(result['forbidden'])}")
+        passed = passed and not problems
+        print(f"{module:>22} {result['median']:10.3f} {result['max']:8.3f}  "
+              f"{'; '.join(problems) or 'ok'}")
+    return passed
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=1.2,
+                        help="maximum median import time of a module, seconds")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per module")
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.budget, args.repeat) else 1)
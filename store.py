@@ -0,0 +1,197 @@
+"""
+Append-only columnar store of all results of experiment points.
+Points are buffered and written as chunks of .npz files (one array per column),
+so results can be re-plotted or post-processed without running the solver again.
+Nested results are flattened to columns like 'num.w', 'sim.ci.w1',
+vectors of different lengths are padded with NaN.
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+from cache import to_json
+
+STORE_DIR = "points"
+LAYOUT_FILE = "layout.json"
+
+
+def _flatten(prefix: str, value, row: dict):
+    if isinstance(value, dict):
+        for name, item in value.items():
+            _flatten(f"{prefix}.{name}", item, row)
+    elif isinstance(value, str):
+        row[prefix] = value
+    elif value is not None:
+        row[prefix] = np.asarray(to_json(value), dtype=float)
+
+
+def _unflatten(row: dict, prefix: str) -> dict:
+    results = {}
+    for column, value in row.items():
+        if not column.startswith(prefix):
+            continue
+        *parents, name = column[len(prefix):].split('.')
+        node = results
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = value
+    return results
+
+
+def _stack(values: list) -> np.ndarray:
+    """
+    Stack column values of rows, missing values and short vectors are padded with NaN.
+    """
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, str) for value in present):
+        return np.array(["" if value is None else value for value in values])
+
+    width = max((np.size(value) for value in present if np.ndim(value) > 0), default=0)
+    if width == 0:
+        return np.array([np.nan if value is None else float(value) for value in values])
+
+    column = np.full((len(values), width), np.nan)
+    for i, value in enumerate(values):
+        if value is not None:
+            value = np.ravel(value)
+            column[i, :len(value)] = value
+    return column
+
+
+def _concat(columns: list) -> np.ndarray:
+    """
+    Concatenate chunks of one column, padding vectors to the widest chunk.
+    """
+    if columns[0].dtype.kind == 'U':
+        return np.concatenate(columns)
+    width = max(column.shape[1] if column.ndim > 1 else 0 for column in columns)
+    if width == 0:
+        return np.concatenate(columns)
+    padded = []
+    for column in columns:
+        block = np.full((len(column), width), np.nan)
+        if column.ndim == 1:
+            block[:, 0] = column
+        else:
+            block[:, :column.shape[1]] = column
+        padded.append(block)
+    return np.concatenate(padded)
+
+
+class ResultStore:
+    """
+    Chunked .npz store of points in the experiment directory.
+    Each point is a row with its key, inputs (arrival_rate, b, b_w, b_c, b_d, num_channels)
+    and all outputs of calculation ('num.' columns) and simulation ('sim.' columns).
+    """
+
+    def __init__(self, path: str, chunk_size: int = 64):
+        """
+        :param path: experiment directory, chunks are stored in its 'points' subdirectory
+        :param chunk_size: number of points buffered before a chunk is written
+        """
+        self.path = os.path.join(path, STORE_DIR)
+        self.chunk_size = chunk_size
+        self.buffer = []
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def append(self, key: str, point: dict, num_results: dict, sim_results: dict):
+        """
+        Add a finished point, a chunk is written as soon as chunk_size points are collected.
+        :param key: point key, see journal.point_key
+        :param point: point dict, see sweep.make_point
+        """
+        row = {'key': key}
+        for name in ('arrival_rate', 'num_channels', 'b', 'b_w', 'b_c', 'b_d'):
+            _flatten(name, point[name], row)
+        _flatten('num', {name: value for name, value in num_results.items()
+                         if name != 'solver_state'}, row)
+        _flatten('sim', sim_results, row)
+        self.buffer.append(row)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered points as a new chunk. The chunk appears atomically.
+        """
+        if not self.buffer:
+            return
+        columns = sorted({name for row in self.buffer for name in row})
+        arrays = {name: _stack([row.get(name) for row in self.buffer]) for name in columns}
+
+        chunk_num = len(glob.glob(os.path.join(self.path, "chunk_*.npz")))
+        chunk_path = os.path.join(self.path, f"chunk_{chunk_num:05d}.npz")
+        tmp_path = os.path.join(self.path, f"tmp_{chunk_num:05d}.npz")
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, chunk_path)
+        self.buffer = []
+
+    def load(self) -> dict:
+        """
+        Read all chunks into columns. A point stored several times (resumed runs)
+        is kept once, with its last results.
+        :return: {column: array with one row per point}
+        """
+        chunks = []
+        for chunk_path in sorted(glob.glob(os.path.join(self.path, "chunk_*.npz"))):
+            with np.load(chunk_path) as data:
+                chunks.append({name: data[name] for name in data.files})
+        if not chunks:
+            return {}
+
+        columns = sorted({name for chunk in chunks for name in chunk})
+        table = {}
+        for name in columns:
+            is_text = next(chunk[name] for chunk in chunks if name in chunk).dtype.kind == 'U'
+            parts = [chunk[name] if name in chunk else
+                     np.full(len(chunk['key']), "" if is_text else np.nan)
+                     for chunk in chunks]
+            table[name] = _concat(parts)
+
+        _keys, last = np.unique(table['key'][::-1], return_index=True)
+        rows = np.sort(len(table['key']) - 1 - last)
+        return {name: column[rows] for name, column in table.items()}
+
+    def get_points(self) -> dict:
+        """
+        Results of all stored points.
+        :return: {key: (num_results, sim_results)}, vectors are NaN-padded arrays
+        """
+        table = self.load()
+        points = {}
+        for i, key in enumerate(table.get('key', [])):
+            row = {name: column[i] for name, column in table.items()}
+            points[str(key)] = (_unflatten(row, 'num.'), _unflatten(row, 'sim.'))
+        return points
+
+    def write_layout(self, layout: dict):
+        """
+        Save the layout of grids: {grid name: {'dims', 'coords', 'keys'}},
+        keys of points are listed in C order of grid indices.
+        """
+        with open(os.path.join(self.path, LAYOUT_FILE), "w", encoding="utf-8") as f:
+            json.dump(to_json(layout), f)
+
+    def read_layout(self) -> dict:
+        """
+        Read the layout of grids, see write_layout.
+        """
+        with open(os.path.join(self.path, LAYOUT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def get_store(qp: dict, path: str):
+    """
+    Result store of the experiment directory, configured by the 'store' section.
+    :param qp: dictionary of parameters
+    :param path: experiment directory
+    :return: ResultStore or None if the store is disabled
+    """
+    params = qp.get('store') or {}
+    if not params.get('enabled', True):
+        return None
+    return ResultStore(path, chunk_size=params.get('chunk_size', 64))
@@ -0,0 +1,430 @@
+"""
+Surrogate model of the numerical solution for fast queries.
+
+The solver is sampled over a box of parameters (paths of grid.AXES, other parameters
+take their 'base' values) on a Smolyak sparse grid of nested Chebyshev-Lobatto
+(Clenshaw-Curtis) nodes, one grid per number of channels. The surrogate is the sparse
+grid interpolant: a combination of tensor Lagrange interpolants on small full grids,
+evaluated in barycentric form. Errors are validated by solves at random points of the box.
+
+    python surrogate.py build [--output results/surrogate.npz] [--depth 3] [--workers 4]
+    python surrogate.py query results/surrogate.npz --channels 3 utilization=0.7 warmup.mean=2
+
+The box is declared in the 'surrogate' section of base_parameters.yaml:
+
+    surrogate:
+        channels: [1, 2, 3, 5]
+        depth: 3  # at most 2^depth + 1 nodes per axis, 137 points for 4 axes
+        box:
+            utilization: {min: 0.3, max: 0.8}
+            warmup.mean: null  # min, max from the parameter tree
+
+The surrogate is saved as .npz: values of outputs at grid points and the grid,
+loading takes milliseconds and queries are answered for arrays of points at once.
+"""
+import itertools
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from cache import cached_run_calculation
+from grid import AXES, get_node, make_grid_point
+from instrumentation import log
+from sweep import run_points
+
+# quantities of run_calculation results, that are interpolated
+OUTPUTS = ('w1', 'v1', 'warmup_prob', 'cold_prob', 'cold_delay_prob')
+
+SURROGATE_FILE = os.path.join('results', 'surrogate.npz')
+
+# queries are evaluated by chunks of this size to bound memory of term weights
+QUERY_CHUNK = 512
+
+
+def _level_size(level: int) -> int:
+    """
+    Number of Chebyshev-Lobatto nodes of a level, levels are nested.
+    """
+    return 1 if level == 1 else 2 ** (level - 1) + 1
+
+
+def _level_nodes(level: int) -> np.ndarray:
+    """
+    Nodes of a level on [-1, 1] in ascending order.
+    """
+    size = _level_size(level)
+    if size == 1:
+        return np.zeros(1)
+    return -np.cos(np.pi * np.arange(size) / (size - 1))
+
+
+def _barycentric_bases(x: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Lagrange basis polynomials of nodes of levels 1..depth + 1 at points x in barycentric
+    form, polynomials of all levels are concatenated in the order of levels.
+    :param x: points on [-1, 1], array of any shape
+    :return: array of shape x.shape + (total number of nodes of all levels,)
+    """
+    levels = range(1, depth + 2)
+    sizes = [_level_size(level) for level in levels]
+    nodes = np.concatenate([_level_nodes(level) for level in levels])
+    weights = np.concatenate([(-1.0) ** np.arange(size) * np.where(
+        (np.arange(size) == 0) | (np.arange(size) == size - 1), 0.5, 1.0) for size in sizes])
+    starts = np.cumsum([0] + sizes[:-1])
+
+    diff = x[..., None] - nodes
+    exact = diff == 0.0
+    diff[exact] = 1.0
+    terms = weights / diff
+    sums = np.repeat(np.add.reduceat(terms, starts, axis=-1), sizes, axis=-1)
+    # points at nodes of a level take the node value
+    hits = np.repeat(np.add.reduceat(exact, starts, axis=-1) > 0, sizes, axis=-1)
+    return np.where(hits, exact, terms / sums)
+
+
+def smolyak_indices(dim: int, depth: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Multi-indices of levels of tensor grids of the Smolyak combination and their
+    coefficients: A(q, d) = sum over q - d + 1 <= |i| <= q of
+    (-1)^(q - |i|) C(d - 1, q - |i|) U(i_1) x ... x U(i_d), q = d + depth.
+    :return: (indices (K, dim) array of levels from 1, coefficients (K,) array)
+    """
+    q = dim + depth
+    indices, coefs = [], []
+    for index in itertools.product(range(1, depth + 2), repeat=dim):
+        total = sum(index)
+        if q - dim + 1 <= total <= q:
+            indices.append(index)
+            coefs.append((-1) ** (q - total) * math.comb(dim - 1, q - total))
+    return np.array(indices, dtype=np.int64).reshape(-1, dim), np.array(coefs, dtype=float)
+
+
+def _finest_positions(level: int, depth: int) -> np.ndarray:
+    """
+    Positions of the level nodes among nodes of the finest level depth + 1.
+    """
+    finest = _level_size(depth + 1)
+    size = _level_size(level)
+    if size == 1:
+        return np.array([(finest - 1) // 2])
+    return np.arange(size) * ((finest - 1) // (size - 1))
+
+
+def _tensor_positions(index, depth: int) -> np.ndarray:
+    """
+    Positions of nodes of the tensor grid of a multi-index among the finest nodes,
+    (number of grid points, dim) array in C order.
+    """
+    axes = [_finest_positions(level, depth) for level in index]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+
+
+def sparse_grid(dim: int, depth: int) -> np.ndarray:
+    """
+    Points of the sparse grid as positions among the finest nodes,
+    (number of points, dim) array sorted lexicographically.
+    """
+    indices, _coefs = smolyak_indices(dim, depth)
+    positions = np.concatenate([_tensor_positions(index, depth) for index in indices])
+    return np.unique(positions, axis=0)
+
+
+def _encode(positions: np.ndarray, depth: int) -> np.ndarray:
+    """
+    One integer per point, increasing with lexicographic order of positions.
+    """
+    base = _level_size(depth + 1)
+    return positions @ (base ** np.arange(positions.shape[1] - 1, -1, -1))
+
+
+class Surrogate:
+    """
+    Sparse grid interpolant of OUTPUTS over a box of parameters for several numbers of channels.
+    """
+
+    def __init__(self, axes: list[str], lows, highs, channels, depth: int,
+                 grid: np.ndarray, values: np.ndarray, info: dict = None):
+        """
+        :param axes: paths of the box axes, see grid.AXES
+        :param lows: lower bounds of axes
+        :param highs: upper bounds of axes
+        :param channels: numbers of channels
+        :param depth: depth of the sparse grid
+        :param grid: points of the sparse grid, see sparse_grid
+        :param values: (channels, grid points, OUTPUTS) array of solver results
+        :param info: JSON-serializable description: base parameters, validation errors, ...
+        """
+        self.axes = list(axes)
+        self.lows = np.asarray(lows, dtype=float)
+        self.highs = np.asarray(highs, dtype=float)
+        self.channels = [int(n) for n in channels]
+        self.depth = int(depth)
+        self.grid = np.asarray(grid, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.info = info or {}
+
+        # the combination is flattened into terms: a term is a point of one tensor grid,
+        # its weight is coef * product of 1D basis polynomials, its value is the grid value.
+        # Basis polynomials of all levels of an axis are concatenated, cols index them.
+        indices, coefs = smolyak_indices(len(self.axes), self.depth)
+        offsets = np.cumsum([0] + [_level_size(level) for level in range(1, self.depth + 2)])
+        codes = _encode(self.grid, self.depth)
+        cols, rows, term_coefs = [], [], []
+        for index, coef in zip(indices, coefs):
+            local = np.stack(np.meshgrid(*[np.arange(_level_size(level)) for level in index],
+                                         indexing='ij'), axis=-1).reshape(-1, len(index))
+            cols.append(local + offsets[index - 1])
+            rows.append(np.searchsorted(codes, _encode(_tensor_positions(index, self.depth),
+                                                       self.depth)))
+            term_coefs.append(np.full(len(local), coef))
+        self._cols = np.concatenate(cols)
+        self._rows = np.concatenate(rows)
+        self._coefs = np.concatenate(term_coefs)
+
+    def save(self, path: str):
+        """
+        Save the surrogate as .npz.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, axes=np.array(self.axes), lows=self.lows, highs=self.highs,
+                            channels=np.array(self.channels), depth=self.depth,
+                            grid=self.grid.astype(np.int16), values=self.values,
+                            info=json.dumps(self.info))
+
+    @classmethod
+    def load(cls, path: str) -> "Surrogate":
+        """
+        Load a surrogate saved by save.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['axes'].tolist(), data['lows'], data['highs'],
+                       data['channels'].tolist(), int(data['depth']), data['grid'],
+                       data['values'], json.loads(str(data['info'])))
+
+    def _interpolate(self, x: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Sparse grid interpolant of values at points x of [-1, 1]^dim, (N, OUTPUTS) array.
+        """
+        result = np.empty((len(x), values.shape[1]))
+        term_values = values[self._rows]
+        axes = np.arange(len(self.axes))
+        for start in range(0, len(x), QUERY_CHUNK):
+            bases = _barycentric_bases(x[start:start + QUERY_CHUNK], self.depth)
+            weights = self._coefs * np.prod(bases[:, axes, self._cols], axis=-1)
+            result[start:start + QUERY_CHUNK] = weights @ term_values
+        return result
+
+    def predict(self, values: dict, channels) -> dict:
+        """
+        Outputs at given points, arguments are broadcast together.
+        :param values: {axis path: value or array} for all axes of the box
+        :param channels: number of channels or array, each must be one of self.channels
+        :return: {output name: array of the broadcast shape}
+        """
+        missing = set(self.axes) - set(values)
+        if missing:
+            raise ValueError(f"Values of axes {sorted(missing)} are not given, "
+                             f"expected {self.axes}")
+        arrays = np.broadcast_arrays(np.asarray(channels),
+                                     *[np.asarray(values[path], dtype=float)
+                                       for path in self.axes])
+        shape = arrays[0].shape
+        channels = arrays[0].ravel()
+        points = np.stack([array.ravel() for array in arrays[1:]], axis=-1).reshape(
+            -1, len(self.axes))
+
+        outside = np.any((points < self.lows) | (points > self.highs), axis=1)
+        if np.any(outside):
+            raise ValueError(f"{int(np.sum(outside))} points are outside of the box "
+                             f"{dict(zip(self.axes, zip(self.lows, self.highs)))}")
+        x = 2.0 * (points - self.lows) / (self.highs - self.lows) - 1.0
+
+        result = np.empty((len(points), len(OUTPUTS)))
+        for num_channels in np.unique(channels):
+            if num_channels not in self.channels:
+                raise ValueError(f"Surrogate is built for channels {self.channels}, "
+                                 f"got {num_channels}")
+            selected = channels == num_channels
+            result[selected] = self._interpolate(
+                x[selected], self.values[self.channels.index(num_channels)])
+        return {name: result[:, i].reshape(shape) for i, name in enumerate(OUTPUTS)}
+
+
+def get_surrogate_params(qp: dict) -> dict:
+    """
+    Read the 'surrogate' section of the experiment parameters, filling defaults.
+    :param qp: dictionary of parameters
+    :return: dict with keys box ({path: (min, max)}), channels, depth, num_validation, seed, path
+    """
+    params = qp.get('surrogate') or {}
+    box = {}
+    for path, spec in (params.get('box') or {'utilization': None}).items():
+        if path not in AXES or path == 'channels':
+            raise ValueError(f"Unknown surrogate axis {path}, expected one of "
+                             f"{[axis for axis in AXES if axis != 'channels']}")
+        spec = spec or {}
+        node = get_node(qp, path)
+        box[path] = (float(spec.get('min', node['min'])), float(spec.get('max', node['max'])))
+    return {
+        'box': box,
+        'channels': [int(n) for n in params.get('channels', [qp['channels']['base']])],
+        'depth': int(params.get('depth', 3)),
+        'num_validation': int(params.get('num_validation', 50)),
+        'seed': params.get('seed', 1),
+        'path': params.get('path', SURROGATE_FILE),
+    }
+
+
+def _solve_outputs(point: dict) -> list[float]:
+    """
+    OUTPUTS of the numerical solution of a point, used by the process pool.
+    """
+    num_results = point.get('num_results')
+    if num_results is None:
+        params = {name: point[name] for name in
+                  ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels')}
+        num_results = cached_run_calculation(**params, accuracy=point.get('accuracy'),
+                                             cache=point.get('calc_cache'))
+    return [float(np.real(num_results['w'][0])), float(np.real(num_results['v'][0])),
+            float(num_results['warmup_prob']), float(num_results['cold_prob']),
+            float(num_results['cold_delay_prob'])]
+
+
+def _solve(qp: dict, box: dict, channels: list[int], points: np.ndarray) -> np.ndarray:
+    """
+    Solve all points of the box for every number of channels.
+    :param points: (N, dim) array of axis values
+    :return: (channels, N, OUTPUTS) array
+    """
+    # solves are fanned out over workers, not continued along the grid in the main process
+    qp = dict(qp, calculation=dict(qp.get('calculation') or {}, warm_start=False))
+    grid_points = [make_grid_point(qp, dict(zip(box, values), channels=num_channels))
+                   for num_channels in channels for values in points.tolist()]
+    results = list(run_points(qp, grid_points, func=_solve_outputs))
+    return np.array(results).reshape(len(channels), len(points), len(OUTPUTS))
+
+
+def build_surrogate(qp: dict) -> Surrogate:
+    """
+    Sample the solver on the sparse grid of the 'surrogate' section of parameters
+    (in parallel over the 'parallel' section, with the calculation cache), fit the surrogate
+    and validate it by solves at num_validation random points per number of channels.
+    Validation errors are printed and stored in surrogate.info['errors'].
+    :param qp: dictionary of parameters
+    :return: Surrogate
+    """
+    params = get_surrogate_params(qp)
+    box = params['box']
+    lows = np.array([low for low, _high in box.values()])
+    highs = np.array([high for _low, high in box.values()])
+    depth = params['depth']
+
+    grid = sparse_grid(len(box), depth)
+    finest = _level_nodes(depth + 1)
+    points = lows + (finest[grid] + 1.0) / 2.0 * (highs - lows)
+    log(f"Surrogate: {len(grid)} grid points x {len(params['channels'])} channels")
+
+    build_start = time.perf_counter()
+    values = _solve(qp, box, params['channels'], points)
+    build_time = time.perf_counter() - build_start
+
+    info = {
+        'base': {path: get_node(qp, path)['base'] for path in AXES if path not in box},
+        'arrival_rate': qp['arrival_rate'],
+        'outputs': list(OUTPUTS),
+        'build_time': build_time,
+    }
+    surrogate = Surrogate(list(box), lows, highs, params['channels'], depth, grid, values, info)
+
+    rng = np.random.default_rng(params['seed'])
+    held_out = lows + rng.random((params['num_validation'], len(box))) * (highs - lows)
+    exact = _solve(qp, box, params['channels'], held_out)
+    predicted = np.stack([np.stack(list(surrogate.predict(
+        dict(zip(box, held_out.T)), num_channels).values()), axis=-1)
+        for num_channels in params['channels']])
+    surrogate.info['errors'] = calc_errors(predicted, exact)
+    print_errors(surrogate.info['errors'])
+    return surrogate
+
+
+def calc_errors(predicted: np.ndarray, exact: np.ndarray) -> dict:
+    """
+    Errors of the surrogate at held-out points.
+    :param predicted: (..., OUTPUTS) array of surrogate values
+    :param exact: array of solver values of the same shape
+    :return: {output: {'max_abs', 'mean_abs', 'max_rel', 'mean_rel'}},
+        relative errors are taken for nonzero solver values
+    """
+    errors = {}
+    for i, name in enumerate(OUTPUTS):
+        abs_err = np.abs(predicted[..., i] - exact[..., i]).ravel()
+        nonzero = exact[..., i].ravel() != 0
+        rel_err = abs_err[nonzero] / np.abs(exact[..., i].ravel()[nonzero])
+        errors[name] = {
+            'max_abs': float(np.max(abs_err)),
+            'mean_abs': float(np.mean(abs_err)),
+            'max_rel': float(np.max(rel_err)) if rel_err.size else 0.0,
+            'mean_rel': float(np.mean(rel_err)) if rel_err.size else 0.0,
+        }
+    return errors
+
+
+def print_errors(errors: dict):
+    """
+    Print validation errors, see calc_errors.
+    """
+    print(f"  {'output':<16} {'max abs':>10} {'mean abs':>10} {'max rel':>9} {'mean rel':>9}")
+    for name, error in errors.items():
+        print(f"  {name:<16} {error['max_abs']:>10.3g} {error['mean_abs']:>10.3g} "
+              f"{error['max_rel']:>9.2%} {error['mean_rel']:>9.2%}")
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    from instrumentation import instrumentation_options
+    from utils import read_parameters_from_yaml
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="sample the solver and save the surrogate")
+    build_parser.add_argument('--output', default=None,
+                              help="path of the surrogate, surrogate.path by default")
+    build_parser.add_argument('--depth', type=int, default=None, help="sparse grid depth")
+    build_parser.add_argument('--workers', type=int, default=None,
+                              help="worker processes, parallel.workers by default")
+
+    query_parser = commands.add_parser('query', help="evaluate a saved surrogate")
+    query_parser.add_argument('path')
+    query_parser.add_argument('--channels', type=int, required=True)
+    query_parser.add_argument('values', nargs='+', help="axis=value for all axes of the box")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        qp = read_parameters_from_yaml("base_parameters.yaml")
+        qp['surrogate'] = qp.get('surrogate') or {}
+        if args.depth is not None:
+            qp['surrogate']['depth'] = args.depth
+        if args.workers is not None:
+            qp['parallel'] = dict(qp.get('parallel') or {}, workers=args.workers)
+        with instrumentation_options(qp):
+            model = build_surrogate(qp)
+        output = args.output or get_surrogate_params(qp)['path']
+        model.save(output)
+        print(f"Surrogate saved to {output}, built in {model.info['build_time']:.1f} s")
+    else:
+        load_start = time.perf_counter()
+        model = Surrogate.load(args.path)
+        load_time = time.perf_counter() - load_start
+        query = {name: float(value) for name, value in
+                 (item.split('=', 1) for item in args.values)}
+        for name, value in model.predict(query, args.channels).items():
+            print(f"{name}: {float(value):.6g}")
+        print(f"Loaded in {load_time * 1e3:.1f} ms")
@@ -0,0 +1,361 @@
+"""
+Parallel executor for parameter sweeps.
+Every grid point of a sweep (run_calculation + run_simulation pair) is independent,
+so points are fanned out over a process pool and gathered back in grid order.
+"""
+import collections
+import itertools
+import math
+import os
+
+import numpy as np
+
+from cache import (
+    cached_run_calculation,
+    cached_run_simulation,
+    get_calc_cache,
+    get_sim_cache,
+)
+from estimators import (
+    run_simulation_batch_means,
+    run_simulation_control_variates,
+    run_simulation_to_precision,
+)
+from journal import get_journal, point_key
+from parallel import process_pool
+from run_one_calc_vs_sim import DEFAULT_ENGINE, run_calculation
+
+
+def get_parallel_params(qp: dict) -> dict:
+    """
+    Read the 'parallel' section of the experiment parameters, filling defaults.
+    :param qp: dictionary of parameters
+    :return: dict with keys workers, chunksize, blas_threads
+    """
+    params = qp.get('parallel') or {}
+    workers = params.get('workers')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return {
+        'workers': max(1, int(workers)),
+        'chunksize': max(1, int(params.get('chunksize') or 1)),
+        'blas_threads': params.get('blas_threads', 1),
+    }
+
+
+def make_point(qp: dict, b: list[float], b_w: list[float], b_c: list[float],
+               b_d: list[float], num_channels: int) -> dict:
+    """
+    Collect all arguments of one sweep point.
+    :param qp: dictionary of parameters
+    :param b: E[X^k] k=0, 1, 2. for the service time distribution.
+    :param b_w: E[X^k] k=0, 1, 2. for the warmup time distribution.
+    :param b_c: E[X^k] k=0, 1, 2. for the cooling time distribution.
+    :param b_d: E[X^k] k=0, 1, 2. for the delay time distribution.
+    :param num_channels: number of channels
+    :return: point dict, that can be sent to worker process
+    """
+    sim_params = qp.get('simulation') or {}
+    precision = sim_params.get('precision') or {}
+    batch_means = sim_params.get('batch_means') or {}
+    control_variates = sim_params.get('control_variates') or {}
+    calc_params = qp.get('calculation') or {}
+
+    return {
+        'arrival_rate': qp['arrival_rate'],
+        'b': list(b), 'b_w': list(b_w), 'b_c': list(b_c), 'b_d': list(b_d),
+        'num_channels': int(num_channels),
+        'accuracy': calc_params.get('accuracy'),
+        'num_of_jobs': qp['jobs_per_sim'],
+        'ave_num': qp['sim_to_average'],
+        'sim_workers': sim_params.get('workers', 1),
+        'sim_engine': sim_params.get('engine', DEFAULT_ENGINE),
+        'crn': sim_params.get('common_random_numbers', False),
+        'precision': precision if precision.get('enabled', False) else None,
+        'batch_means': batch_means if batch_means.get('enabled', False) else None,
+        'control_variates': (control_variates if control_variates.get('enabled', False)
+                             else None),
+    }
+
+
+def run_point(point: dict) -> tuple[dict, dict]:
+    """
+    Run calculation and simulation for one sweep point.
+    Results of points replayed from the journal are returned as is,
+    results of new points are recorded to the journal, if the point has one.
+    :param point: point dict, see make_point
+    :return: (num_results, sim_results)
+    """
+    if 'replay' in point:
+        return point['replay']
+
+    num_results, sim_results = _run_point(point)
+    if point.get('journal') is not None:
+        point['journal'].append(point['journal_key'], num_results, sim_results)
+    return num_results, sim_results
+
+
+def _run_point(point: dict) -> tuple[dict, dict]:
+    """
+    Run calculation (unless it is already in point['num_results']) and simulation.
+    """
+    params = {name: point[name] for name in
+              ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels')}
+
+    num_results = point.get('num_results')
+    if num_results is None:
+        num_results = cached_run_calculation(**params, accuracy=point.get('accuracy'),
+                                             cache=point.get('calc_cache'))
+
+    batch_means = point.get('batch_means')
+    if batch_means:
+        sim_results = run_simulation_batch_means(
+            **params, num_of_jobs=batch_means.get('num_of_jobs', point['num_of_jobs']),
+            num_batches=batch_means.get('num_batches', 20),
+            mser_batch_size=batch_means.get('mser_batch_size', 5),
+            confidence=batch_means.get('confidence', 0.95),
+            seed=point.get('seed'), crn=point.get('crn', False))
+        return num_results, sim_results
+
+    precision = point.get('precision')
+    if precision:
+        sim_results = run_simulation_to_precision(
+            **params, num_of_jobs=precision.get('jobs_per_replication', point['num_of_jobs']),
+            rel_half_width=precision['rel_half_width'],
+            confidence=precision.get('confidence', 0.95),
+            targets=precision.get('targets', ['w1']),
+            min_replications=precision.get('min_replications', 3),
+            max_jobs=precision.get('max_jobs', point['num_of_jobs']*point['ave_num']),
+            seed=point.get('seed'), workers=point.get('sim_workers', 1),
+            engine=point.get('sim_engine', DEFAULT_ENGINE), crn=point.get('crn', False),
+            cache=point.get('sim_cache'))
+        return num_results, sim_results
+
+    control_variates = point.get('control_variates')
+    if control_variates:
+        sim_results = run_simulation_control_variates(
+            **params, num_of_jobs=point['num_of_jobs'], ave_num=point['ave_num'],
+            confidence=control_variates.get('confidence', 0.95), seed=point.get('seed'),
+            workers=point.get('sim_workers', 1), crn=point.get('crn', False),
+            cache=point.get('sim_cache'))
+        return num_results, sim_results
+
+    sim_results = cached_run_simulation(**params, num_of_jobs=point['num_of_jobs'],
+                                        ave_num=point['ave_num'], seed=point.get('seed'),
+                                        workers=point.get('sim_workers', 1),
+                                        engine=point.get('sim_engine', DEFAULT_ENGINE),
+                                        crn=point.get('crn', False),
+                                        cache=point.get('sim_cache'))
+    return num_results, sim_results
+
+
+def iter_calculations_along(points, calc_cache=None, reference: bool = False,
+                            summary: bool = True):
+    """
+    Solve points in grid order, each solve starts from the converged state
+    of the previous point (continuation along the sweep).
+    Points are consumed lazily, the summary of iterations is printed at the end.
+    :param points: iterable of point dicts
+    :param calc_cache: CalcCache or None
+    :param reference: whether to solve warm-started points from scratch too,
+        to measure the saving of iterations
+    :param summary: whether to print the summary of iterations
+    :return: iterator over points with 'num_results'
+    """
+    results = []
+    state = None
+    for point in points:
+        if 'replay' in point:
+            yield point
+            continue
+        params = {name: point[name] for name in
+                  ('arrival_rate', 'b', 'b_w', 'b_c', 'b_d', 'num_channels')}
+        num_results = cached_run_calculation(**params, accuracy=point.get('accuracy'),
+                                             warm_start=state, return_state=True,
+                                             cache=calc_cache)
+        state = num_results.pop('solver_state', None)
+        if reference and num_results['warm_started']:
+            num_results['cold_num_of_iter'] = run_calculation(
+                **params, accuracy=point.get('accuracy'))['num_of_iter']
+        results.append(num_results)
+        yield dict(point, num_results=num_results)
+
+    if summary:
+        print_iterations_summary(results)
+
+
+def run_calculations_along(points: list[dict], calc_cache=None,
+                           reference: bool = False) -> list[dict]:
+    """
+    Solve all points as a continuation along the sweep, see iter_calculations_along.
+    :return: list of num_results
+    """
+    return [point['num_results'] for point in
+            iter_calculations_along(points, calc_cache, reference)]
+
+
+def print_iterations_summary(num_results: list[dict]):
+    """
+    Print number of solver iterations of a sweep and the saving of warm starts,
+    if reference cold solves were made.
+    :param num_results: list of run_calculation results
+    """
+    solved = [res for res in num_results if not res.get('cache_hit')]
+    warm = [res for res in solved if res.get('warm_started')]
+
+    summary = (f"Solver iterations: {sum(res['num_of_iter'] for res in solved)} "
+               f"for {len(solved)} solves ({len(num_results) - len(solved)} cache hits, "
+               f"{len(warm)} warm starts)")
+
+    with_reference = [res for res in warm if 'cold_num_of_iter' in res]
+    if with_reference:
+        warm_iter = sum(res['num_of_iter'] for res in with_reference)
+        cold_iter = sum(res['cold_num_of_iter'] for res in with_reference)
+        summary += (f", warm starts took {warm_iter} iterations vs {cold_iter} "
+                    f"from scratch, saved {1.0 - warm_iter / cold_iter:.0%}")
+    print(summary)
+
+
+def _run_chunk(func, chunk: list[dict]) -> list:
+    """
+    Run func for a chunk of points in a worker process.
+    """
+    return [func(point) for point in chunk]
+
+
+def _run_chunk_along(func, chunk: list[dict], calc_cache=None,
+                     reference: bool = False) -> tuple[list, list[dict]]:
+    """
+    Run func for a chunk of consecutive points in a worker process, calculations
+    are solved first as a continuation along the chunk, see iter_calculations_along.
+    :return: (results of func, num_results of the continuation)
+    """
+    points = list(iter_calculations_along(chunk, calc_cache, reference, summary=False))
+    return ([func(point) for point in points],
+            [point['num_results'] for point in points if 'num_results' in point])
+
+
+def _iter_chunks(points, chunksize: int):
+    """
+    Split iterable of points into lists of chunksize points.
+    """
+    chunk = []
+    for point in points:
+        chunk.append(point)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _replay_from_journal(points, journal):
+    """
+    Attach the journal to points, finished points get their results as 'replay'.
+    """
+    finished = journal.load()
+    replayed = 0
+    for point in points:
+        key = point_key(point)
+        if key in finished:
+            replayed += 1
+            yield dict(point, replay=finished[key])
+        else:
+            yield dict(point, journal=journal, journal_key=key)
+    if replayed:
+        print(f"Replayed {replayed} finished points from journal {journal.path}")
+
+
+def run_points(qp: dict, points, func=run_point, num_points: int = None):
+    """
+    Run func for all points of a sweep, in parallel if more than one worker is configured.
+    Results are yielded in grid order as soon as they (and all previous points) are ready.
+    Points are consumed lazily: only a few chunks per worker are in flight at once,
+    so points may be a generator over a large grid.
+    Each point gets its own simulation seed spawned from the master seed
+    of the 'simulation' section (no seed if the master seed is not set)
+    and the caches of the 'cache' section. With simulation.common_random_numbers
+    all points get the same seed, so their replications use synchronized streams
+    (the master seed must be set).
+    If calculation.warm_start is set, calculations are solved as a continuation along
+    the grid: in the main process without workers, otherwise along chunks of consecutive
+    points in every worker (chunks are enlarged to about 2 per worker).
+    If qp['journal'] is set, finished points are appended to the journal and
+    points found in it are not computed again.
+    :param qp: dictionary of parameters, 'parallel', 'simulation', 'calculation'
+        and 'cache' sections are used
+    :param points: iterable of point dicts
+    :param func: picklable function, that takes point and returns its results
+    :param num_points: number of points, if points has no len()
+    :return: iterator over results in grid order
+    """
+    params = get_parallel_params(qp)
+    if num_points is None:
+        num_points = len(points)
+    workers = min(params['workers'], num_points)
+
+    master_seed = (qp.get('simulation') or {}).get('seed')
+    if (qp.get('simulation') or {}).get('common_random_numbers', False):
+        if master_seed is None:
+            # a seed drawn from OS entropy would change every run: no reuse of the journal
+            # and the simulation cache, no reproducible results
+            raise ValueError("simulation.common_random_numbers needs simulation.seed, "
+                             "main.run_all draws and stores one for a new experiment")
+        common_seed = np.random.SeedSequence(master_seed)
+        point_seeds = itertools.repeat(common_seed)
+    elif master_seed is not None:
+        # children are spawned one by one, the i-th point gets the same seed as
+        # with SeedSequence(master_seed).spawn(num_points)[i]
+        seed_seq = np.random.SeedSequence(master_seed)
+        point_seeds = (seed_seq.spawn(1)[0] for _ in itertools.count())
+    else:
+        point_seeds = itertools.repeat(None)
+
+    calc_cache = get_calc_cache(qp)
+    sim_cache = get_sim_cache(qp)
+    points = (dict(point, seed=seed, calc_cache=calc_cache, sim_cache=sim_cache)
+              for point, seed in zip(points, point_seeds))
+
+    journal = get_journal(qp)
+    if journal is not None:
+        points = _replay_from_journal(points, journal)
+
+    calc_params = qp.get('calculation') or {}
+    warm_start = calc_params.get('warm_start', False)
+    reference = calc_params.get('warm_start_reference', False)
+    if warm_start and workers <= 1:
+        points = iter_calculations_along(points, calc_cache, reference=reference)
+
+    if workers <= 1:
+        for point in points:
+            yield func(point)
+        return
+
+    chunksize = params['chunksize']
+    if warm_start:
+        # continuation runs along consecutive points of a chunk, two chunks per worker
+        chunksize = max(chunksize, math.ceil(num_points / (2 * workers)))
+    solved = []
+
+    def collect(future):
+        if not warm_start:
+            return future.result()
+        results, chunk_solved = future.result()
+        solved.extend(chunk_solved)
+        return results
+
+    with process_pool(workers, params['blas_threads']) as executor:
+        pending = collections.deque()
+        for chunk in _iter_chunks(points, chunksize):
+            if warm_start:
+                pending.append(executor.submit(_run_chunk_along, func, chunk, calc_cache,
+                                               reference))
+            else:
+                pending.append(executor.submit(_run_chunk, func, chunk))
+            if len(pending) >= 2 * workers:
+                yield from collect(pending.popleft())
+        while pending:
+            yield from collect(pending.popleft())
+
+    if warm_start:
+        print_iterations_summary(solved)
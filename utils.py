@@ -1,25 +1,13 @@
-
 """
 Utils module for vacations paper
 """
 import math
 import os
+import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
 import yaml
 
-SMALL_SIZE = 12
-MEDIUM_SIZE = 14
-BIGGER_SIZE = 16
-
-plt.rc('font', size=SMALL_SIZE)          # controls default text sizes
-plt.rc('axes', titlesize=MEDIUM_SIZE)     # fontsize of the axes title
-plt.rc('axes', labelsize=MEDIUM_SIZE)    # fontsize of the x and y labels
-plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('legend', fontsize=MEDIUM_SIZE)    # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
 
 def calc_rel_error_percent(sim_value: float, calc_value: float) -> float:
     """Calculate the relative error percent between a simulation value and a calculated value."""
@@ -42,115 +30,55 @@ def calc_moments_by_mean_and_coev(mean, coev):
     return b
 
 
-def plot_w1(xs, w1_num, w1_sim, x_label: str, save_path=None, is_xs_int=False, color=None):
-    """
-    Plot the wait time averages for both calculation and simulation.
-    :param xs: list of x-axis values.
-    :param x_label: The label for the x-axis
-    :param w1_num: The calculated wait time average.
-    :param w1_sim: The simulated wait time average.
-    :param save_path: The path to save the plot.
-    :param is_xs_int: Whether the x-axis values are integers.
-    """
-    _fig, ax = plt.subplots()
-    # plot first with dash -- line, black, second - with line, black
-    
-    ax.plot(xs, w1_num, label="num", color=color, linestyle="--")
-    ax.plot(xs, w1_sim, label="sim", color=color)
-    ax.legend()
-    ax.set_xlabel(x_label)
-    # set xticks to be integers
-    if is_xs_int:
-        ax.set_xticks(np.arange(min(xs), max(xs)+1, 1.0))
-    ax.set_ylabel(r"$\omega_{1}$")
-
-    if save_path:
-        plt.savefig(save_path, dpi=300)
-    else:
-        plt.show()
-
-    plt.close(_fig)
-
-
-def plot_w1_errors(xs, w1_rel_errors, x_label, save_path=None, is_xs_int=False, color = None):
+def save_parameters_as_yaml(qp: dict, save_path: str):
     """
-    Plot the wait time relative errors
-    :param xs: The x-axis values.
-    :param w1_rel_errors: The relative errors of omega_1.
-    :param x_label: The label for the x-axis.
-    :param save_path: The path to save the plot.
-    :param is_xs_int: Whether the x-axis values are integers.
+    dict qp, that contains all parameters for the experiment
+    should be saved as yaml file.
     """
-    _fig, ax = plt.subplots()
-    
-    ax.plot(xs, w1_rel_errors, color=color)
-    ax.set_xlabel(x_label)
-    # set xticks to be integers
-    if is_xs_int:
-        ax.set_xticks(np.arange(min(xs), max(xs)+1, 1.0))
-    ax.set_ylabel(r"$\varepsilon$, %")
+    yaml_path = os.path.join(save_path, "parameters.yaml")
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        yaml.dump(qp, f)
 
-    if save_path:
-        plt.savefig(save_path, dpi=300)
-    else:
-        plt.show()
 
-    plt.close(_fig)
+def read_parameters_from_yaml(file_path: str) -> dict:
+    """
+    Read a YAML file and return the content as a dictionary.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
 
 
-def plot_probs(xs, probs_num, probs_sim, x_label, save_path=None, color=None):
+class _NoProgress:
     """
-    Plot the probabilities of different states
-    :param xs: The x-axis values.
-    :param probs_num: The probabilities from numerical calculation.
-    :param probs_sim: The probabilities from simulation.
-    :param x_label: The label for the x-axis.
-    :param save_path: The path to save the plot.
+    Silent stand-in for tqdm progress bar.
     """
-    _fig, ax = plt.subplots()
-    
-    ax.plot(xs, probs_num, label="num", color=color, linestyle="--")
-    ax.plot(xs, probs_sim, label="sim", color=color)
-    ax.legend()
-    ax.set_xlabel(x_label)
-    ax.set_ylabel("Probability")
 
-    if save_path:
-        plt.savefig(save_path, dpi=300)
-    else:
-        plt.show()
+    def __init__(self, iterable=None):
+        self.iterable = iterable
 
-    plt.close(_fig)
+    def __iter__(self):
+        return iter(self.iterable)
 
+    def __enter__(self):
+        return self
 
-def create_new_experiment_dir(directory):
-    """
-    All directories has names like 'directory/exp_1', 'directory/exp_2', etc.
-    If the directory already exists, it will be incremented by 1 and created.
-    Return the new directory path.
-    """
-    i = 1
-    while True:
-        exp_dir = os.path.join(directory, f"exp_{i}")
-        if not os.path.exists(exp_dir):
-            os.makedirs(exp_dir)
-            return exp_dir
-        i += 1
+    def __exit__(self, *args):
+        return False
 
+    def update(self, n=1):
+        """
+        Do nothing, as tqdm.update.
+        """
 
-def save_parameters_as_yaml(qp: dict, save_path: str):
-    """
-    dict qp, that contains all parameters for the experiment
-    should be saved as yaml file.
-    """
-    yaml_path = os.path.join(save_path, "parameters.yaml")
-    with open(yaml_path, "w", encoding="utf-8") as f:
-        yaml.dump(qp, f)
 
-
-def read_parameters_from_yaml(file_path: str) -> dict:
+def progress(iterable=None, **kwargs):
     """
-    Read a YAML file and return the content as a dictionary.
+    tqdm progress bar in an interactive terminal, silent in batch runs.
+    tqdm is imported only when the bar is shown.
+    :param iterable: iterable to wrap, or None for a bar updated manually
+    :param kwargs: arguments of tqdm, like total and desc
     """
-    with open(file_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    if not sys.stderr.isatty():
+        return _NoProgress(iterable)
+    from tqdm import tqdm
+    return tqdm(iterable, **kwargs)
@@ -0,0 +1,440 @@
+"""
+Specialised simulator of the M/G/n queue with warm-up, cooling and delay before cooling starts.
+
+The model is the same as in most_queue VacationQueueingSystemSimulator:
+- when the system becomes empty, the delay before cooling starts,
+- a job arriving during the delay cancels it and is served at once,
+- otherwise cooling starts at the end of the delay, jobs arriving during cooling wait,
+- after cooling the system warms up if jobs are waiting, otherwise it stays cold
+  and the next arrival starts warm-up; jobs arriving during warm-up wait,
+- at the end of warm-up all channels are available, jobs are served in FIFO order.
+
+Jobs enter channels in the order of arrival, so the simulation is a recursion over jobs
+instead of an event loop: the start of service of a job is the maximum of its arrival
+and the earliest free channel (a heap of channel free times), and a vacation cycle is
+played only when a job arrives to the empty system. Random variates of each stream
+are generated in NumPy blocks, waiting and sojourn moments, state and vacation
+probabilities are computed from the arrays of arrival, start and end times at the end.
+
+With common random numbers (crn) every variate is an inverse transform of one uniform
+of its stream, so runs with the same seed and different parameters use the same uniforms:
+the k-th job has the same arrival and service quantile, and a vacation cycle started by
+the arrival of the k-th job has the same delay, cooling and warm-up quantiles. Differences
+between neighbouring points of a sweep then have much lower variance than with independent
+runs. Vacation quantiles are indexed by jobs, not by cycles, since the number of cycles
+differs between points and cycle numbers get out of step quickly.
+"""
+import heapq
+import os
+import time
+
+import numpy as np
+from scipy import special
+
+# independent random streams of the model, one generator per stream
+STREAMS = ('arrival', 'service', 'warmup', 'cooling', 'delay')
+
+# number of variates of vacation phases generated at once
+PHASE_BLOCK = 4096
+
+
+def get_gamma_params(b: list[float]) -> tuple[float, float]:
+    """
+    Shape and scale of the gamma distribution with given E[X], E[X^2].
+    """
+    mean = b[0]
+    variance = b[1] - mean ** 2
+    return mean ** 2 / variance, variance / mean
+
+
+def stream_generators(seed) -> dict:
+    """
+    Generators of all streams, spawned from the seed of a replication.
+    Stream i gets i-th child of the seed, as SeedSequence.spawn does.
+    :param seed: int, np.random.SeedSequence or None for OS entropy
+    :return: {stream name: np.random.Generator}
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return {name: np.random.default_rng(np.random.SeedSequence(
+        seed.entropy, spawn_key=seed.spawn_key + (i,), pool_size=seed.pool_size))
+        for i, name in enumerate(STREAMS)}
+
+
+def gamma_variates(rng: np.random.Generator, shape: float, scale: float, size: int,
+                   crn: bool = False) -> np.ndarray:
+    """
+    Gamma distributed variates.
+    :param crn: whether to use the inverse transform of uniforms, one uniform per variate
+    """
+    if crn:
+        return scale * special.gammaincinv(shape, rng.random(size))
+    return rng.gamma(shape, scale, size)
+
+
+def exponential_variates(rng: np.random.Generator, mean: float, size: int,
+                         crn: bool = False) -> np.ndarray:
+    """
+    Exponentially distributed variates.
+    :param crn: whether to use the inverse transform of uniforms, one uniform per variate
+    """
+    if crn:
+        return -mean * np.log1p(-rng.random(size))
+    return rng.exponential(mean, size)
+
+
+class _GammaVariates:
+    """
+    Gamma distributed durations of a vacation phase, generated by blocks.
+    """
+
+    def __init__(self, rng: np.random.Generator, b: list[float], block: int = PHASE_BLOCK):
+        self.rng = rng
+        self.shape, self.scale = get_gamma_params(b)
+        self.block = block
+        self.values = []
+        self.pos = 0
+
+    def extend(self, size: int):
+        """
+        Do nothing, durations do not depend on jobs.
+        """
+
+    def next(self, job: int) -> float:
+        """
+        Next duration of the phase.
+        :param job: index of the job, that starts the phase, not used
+        """
+        if self.pos == len(self.values):
+            self.values = self.rng.gamma(self.shape, self.scale, self.block).tolist()
+            self.pos = 0
+        self.pos += 1
+        return self.values[self.pos - 1]
+
+
+class _CrnGammaVariates:
+    """
+    Gamma distributed durations of a vacation phase for common random numbers:
+    one uniform per job, the duration of a phase started by a job is the quantile
+    of its uniform. Quantiles are computed only for jobs, that start phases.
+    """
+
+    def __init__(self, rng: np.random.Generator, b: list[float]):
+        self.rng = rng
+        self.shape, self.scale = get_gamma_params(b)
+        self.uniforms = np.empty(0)
+
+    def extend(self, size: int):
+        """
+        Draw uniforms of the next size jobs.
+        """
+        self.uniforms = np.concatenate((self.uniforms, self.rng.random(size)))
+
+    def next(self, job: int) -> float:
+        """
+        Duration of the phase started by the job.
+        """
+        return self.scale * float(special.gammaincinv(self.shape, self.uniforms[job]))
+
+
+def _run_jobs(arrivals: list, services: list, state: dict, phases: dict, starts: list):
+    """
+    Start times of a block of jobs. Channel heap, completion time of the last job
+    and vacation phases are kept in state between blocks.
+    :param arrivals: arrival times of the block
+    :param services: service times of the block
+    :param state: {'heap', 'last_done', 'cold'}
+    :param phases: {phase name: (_GammaVariates or _CrnGammaVariates,
+        list of (start, end) of played phases)}
+    :param starts: list, start times are appended to it
+    """
+    heap = state['heap']
+    last_done = state['last_done']
+    cold = state['cold']
+    num_channels = len(heap)
+    warmup, warmups = phases['warmup']
+    cooling, coolings = phases['cooling']
+    delay, delays = phases['delay']
+    heapreplace = heapq.heapreplace
+    append = starts.append
+
+    for job, (arrival, service) in enumerate(zip(arrivals, services), len(starts)):
+        if arrival > last_done:
+            # the system is empty since last_done, a cold system warms up at the arrival
+            warmup_start = arrival
+            if not cold:
+                delay_end = last_done + delay.next(job)
+                if arrival < delay_end:
+                    # the job cancels the delay and is served at once
+                    delays.append((last_done, arrival))
+                    warmup_start = None
+                else:
+                    delays.append((last_done, delay_end))
+                    cooling_end = delay_end + cooling.next(job)
+                    coolings.append((delay_end, cooling_end))
+                    # the job waits for the end of cooling
+                    warmup_start = max(arrival, cooling_end)
+            if warmup_start is not None:
+                warmup_end = warmup_start + warmup.next(job)
+                warmups.append((warmup_start, warmup_end))
+                heap = [warmup_end] * num_channels
+                cold = False
+
+        free = heap[0]
+        start = arrival if arrival > free else free
+        done = start + service
+        heapreplace(heap, done)
+        if done > last_done:
+            last_done = done
+        append(start)
+
+    state['heap'] = heap
+    state['last_done'] = last_done
+    state['cold'] = cold
+
+
+def _phase_prob(played: np.ndarray, end_time: float) -> float:
+    """
+    Fraction of time in a phase, only phases finished before end_time are counted
+    (as in most_queue simulator).
+    """
+    finished = played[:, 1] <= end_time
+    return float(np.sum(played[finished, 1] - played[finished, 0]) / end_time)
+
+
+def _calc_moments(values: np.ndarray, num: int = 3) -> list[float]:
+    return [float(np.mean(values ** k)) for k in range(1, num + 1)]
+
+
+def get_state_path(arrivals: np.ndarray, ends: np.ndarray,
+                   end_time: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Number of jobs in the system as a step function on [0, end_time].
+    :return: (times, levels): levels[i] jobs are in the system from times[i] to times[i + 1]
+        (to end_time for the last step), there are no jobs before times[0]
+    """
+    arrivals = arrivals[arrivals <= end_time]
+    ends = ends[ends <= end_time]
+    times = np.concatenate((arrivals, ends))
+    steps = np.concatenate((np.ones(len(arrivals), dtype=np.int64),
+                            -np.ones(len(ends), dtype=np.int64)))
+    order = np.argsort(times, kind='stable')
+    return times[order], np.cumsum(steps[order])
+
+
+def _calc_state_probs(arrivals: np.ndarray, ends: np.ndarray, end_time: float,
+                      p_size: int) -> list[float]:
+    """
+    Time-average probabilities of the number of jobs in the system on [0, end_time].
+    """
+    times, levels = get_state_path(arrivals, ends, end_time)
+    durations = np.diff(np.append(times, end_time))
+
+    probs = np.bincount(levels, weights=durations, minlength=p_size)
+    probs[0] += times[0]
+    return (probs[:p_size] / end_time).tolist()
+
+
+def _reference_wait(arrivals: list, services: list, num_channels: int) -> float:
+    """
+    Mean waiting time of the same jobs in the M/G/n queue without vacations,
+    that starts empty with all channels available.
+    """
+    heap = [0.0] * num_channels
+    heapreplace = heapq.heapreplace
+    total = 0.0
+    for arrival, service in zip(arrivals, services):
+        free = heap[0]
+        start = arrival if arrival > free else free
+        heapreplace(heap, start + service)
+        total += start - arrival
+    return total / len(arrivals)
+
+
+def calc_controls(trace: dict, num_channels: int, num_of_jobs: int) -> dict:
+    """
+    Control variates of a run: statistics of its first num_of_jobs jobs with known
+    expectations (see estimators.calc_control_means), that are correlated with the outputs.
+    :param trace: path of the run, see simulate_trace
+    :return: {'interarrival': mean interarrival time, 'service': mean service time,
+        'reference_wait': mean waiting time of the same jobs in the queue without vacations}
+    """
+    arrivals = trace['arrivals'][:num_of_jobs]
+    services = trace['services'][:num_of_jobs]
+    return {
+        'interarrival': float(arrivals[-1] / len(arrivals)),
+        'service': float(np.mean(services)),
+        'reference_wait': _reference_wait(arrivals.tolist(), services.tolist(), num_channels),
+    }
+
+
+def simulate_trace(arrival_rate: float, b: list[float],
+                   b_w: list[float], b_c: list[float], b_d: list[float],
+                   num_channels: int, num_of_jobs: int = 300_000, seed=None,
+                   crn: bool = False) -> dict:
+    """
+    Simulate the queue until num_of_jobs jobs are served and return the path of the run.
+    Args: see simulate_vacation_queue.
+    Returns:
+        dict: 'arrivals', 'starts', 'ends' - times of all simulated jobs in arrival order,
+            'services' - their service times,
+            'end_time' - time of the num_of_jobs-th service completion,
+            'phases' - {'warmup', 'cooling', 'delay'}: arrays of (start, end) of played phases.
+    """
+    rngs = stream_generators(seed)
+    service_shape, service_scale = get_gamma_params(b)
+    phase_variates = _CrnGammaVariates if crn else _GammaVariates
+    phases = {name: (phase_variates(rngs[name], moments), [])
+              for name, moments in (('warmup', b_w), ('cooling', b_c), ('delay', b_d))}
+    # the system starts empty and cold, the first arrival starts warm-up
+    state = {'heap': [0.0] * num_channels, 'last_done': 0.0, 'cold': True}
+
+    # jobs in the system at the end of the run are simulated by the margin
+    margin = max(1000, num_of_jobs // 100)
+    block = num_of_jobs + margin
+    arrival_blocks, service_blocks, starts = [], [], []
+    last_arrival = 0.0
+    while True:
+        arrivals = last_arrival + np.cumsum(
+            exponential_variates(rngs['arrival'], 1.0 / arrival_rate, block, crn))
+        services = gamma_variates(rngs['service'], service_shape, service_scale, block, crn)
+        for variates, _played in phases.values():
+            variates.extend(block)
+        _run_jobs(arrivals.tolist(), services.tolist(), state, phases, starts)
+        arrival_blocks.append(arrivals)
+        service_blocks.append(services)
+        last_arrival = arrivals[-1]
+
+        if len(starts) >= num_of_jobs:
+            ends = np.array(starts) + np.concatenate(service_blocks)
+            end_time = np.partition(ends, num_of_jobs - 1)[num_of_jobs - 1]
+            # every job, that could be served before end_time, is simulated
+            if last_arrival > end_time:
+                break
+        block = margin
+
+    return {
+        'arrivals': np.concatenate(arrival_blocks),
+        'services': np.concatenate(service_blocks),
+        'starts': np.array(starts),
+        'ends': ends,
+        'end_time': float(end_time),
+        'phases': {name: np.reshape(np.asarray(played, dtype=float), (-1, 2))
+                   for name, (_variates, played) in phases.items()},
+    }
+
+
+def simulate_vacation_queue(arrival_rate: float, b: list[float],
+                            b_w: list[float], b_c: list[float], b_d: list[float],
+                            num_channels: int, num_of_jobs: int = 300_000,
+                            p_size: int = 10, seed=None, crn: bool = False,
+                            controls: bool = False):
+    """
+    Run one replication of the simulation for an M/G/n queue with gamma service,
+    warm-up, cooling and delay before cooling starts, until num_of_jobs jobs are served.
+    Args:
+        arrival_rate, b, b_w, b_c, b_d, num_channels, num_of_jobs, p_size, seed:
+            see run_one_calc_vs_sim.simulate_replication. Each of STREAMS takes random
+            numbers from its own generator spawned from seed.
+        crn (bool): common random numbers, variates are inverse transforms of uniforms.
+        controls (bool): whether to add 'controls' of the run, see calc_controls.
+    Returns:
+        dict: statistics of the replication with the same keys as simulate_replication.
+    """
+    im_start = time.process_time()
+
+    trace = simulate_trace(arrival_rate, b, b_w, b_c, b_d, num_channels,
+                           num_of_jobs=num_of_jobs, seed=seed, crn=crn)
+    arrivals, starts, ends = trace['arrivals'], trace['starts'], trace['ends']
+    end_time = trace['end_time']
+    taken = starts <= end_time
+    served = ends <= end_time
+
+    stat = {
+        "w": _calc_moments(starts[taken] - arrivals[taken]),
+        "v": _calc_moments(ends[served] - arrivals[served]),
+        "p": _calc_state_probs(arrivals, ends, end_time, p_size),
+        "cold_prob": _phase_prob(trace['phases']['cooling'], end_time),
+        "cold_delay_prob": _phase_prob(trace['phases']['delay'], end_time),
+        "warmup_prob": _phase_prob(trace['phases']['warmup'], end_time),
+        "process_time": time.process_time() - im_start,
+        "num_of_jobs": int(np.sum(served)),
+        "num_of_waits": int(np.sum(taken)),
+        "sim_time": end_time,
+    }
+    if controls:
+        stat["controls"] = calc_controls(trace, num_channels, num_of_jobs)
+        stat["process_time"] = time.process_time() - im_start
+    return stat
+
+
+def validate(qp: dict, num_of_jobs: int = 300_000, ave_num: int = 10, seed: int = 1) -> dict:
+    """
+    Compare the NumPy simulator with most_queue simulator and the numerical solution
+    at the base point of parameters.
+    :param qp: dictionary of parameters
+    :param num_of_jobs: jobs per replication
+    :param ave_num: replications of each simulator
+    :param seed: master seed of replications
+    :return: {name: (calc value, (mean, half width) of most_queue, (mean, half width) of numpy)},
+        jobs per second of both simulators as 'jobs_per_second'
+    """
+    from estimators import calc_confidence_interval, get_replication_value
+    from run_one_calc_vs_sim import replication_seeds, run_calculation, simulate_replication
+    from utils import calc_moments_by_mean_and_coev
+
+    num_channels = qp['channels']['base']
+    params = {
+        'arrival_rate': qp['arrival_rate'],
+        'b': calc_moments_by_mean_and_coev(num_channels*qp['utilization']['base']/qp['arrival_rate'],
+                                           qp['service']['cv']['base']),
+        'b_w': calc_moments_by_mean_and_coev(qp['warmup']['mean']['base'], qp['warmup']['cv']['base']),
+        'b_c': calc_moments_by_mean_and_coev(qp['cooling']['mean']['base'], qp['cooling']['cv']['base']),
+        'b_d': calc_moments_by_mean_and_coev(qp['delay']['mean']['base'], qp['delay']['cv']['base']),
+        'num_channels': num_channels,
+    }
+    num_results = run_calculation(**params)
+
+    replications = {}
+    jobs_per_second = {}
+    for engine in ('most_queue', 'numpy'):
+        wall_start = time.perf_counter()
+        replications[engine] = [
+            simulate_replication(**params, num_of_jobs=num_of_jobs, seed=rep_seed, engine=engine)
+            for rep_seed in replication_seeds(seed, range(ave_num))]
+        jobs_per_second[engine] = num_of_jobs*ave_num/(time.perf_counter() - wall_start)
+
+    report = {}
+    for name in ('w1', 'w2', 'v1', 'warmup_prob', 'cold_prob', 'cold_delay_prob'):
+        report[name] = (float(np.real(get_replication_value(num_results, name))),) + tuple(
+            calc_confidence_interval([get_replication_value(rep, name) for rep in reps])
+            for reps in replications.values())
+    report['jobs_per_second'] = jobs_per_second
+    return report
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    from instrumentation import QUIET_ENV_VAR
+    from utils import read_parameters_from_yaml
+
+    parser = argparse.ArgumentParser(
+        description="Validate the NumPy simulator against most_queue simulator and the solver")
+    parser.add_argument('--jobs', type=int, default=300_000, help="jobs per replication")
+    parser.add_argument('--replications', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ[QUIET_ENV_VAR] = "1"
+    results = validate(read_parameters_from_yaml("base_parameters.yaml"), args.jobs,
+                       args.replications, args.seed)
+
+    speed = results.pop('jobs_per_second')
+    print(f"{'value':>16} {'calc':>10} {'most_queue':>22} {'numpy':>22}")
+    for name, (calc, (mq_mean, mq_half), (np_mean, np_half)) in results.items():
+        print(f"{name:>16} {calc:10.4g} {mq_mean:12.4g} ± {mq_half:7.2g} "
+              f"{np_mean:12.4g} ± {np_half:7.2g}")
+    print(f"jobs per second: most_queue {speed['most_queue']:.0f}, numpy {speed['numpy']:.0f} "
+          f"({speed['numpy']/speed['most_queue']:.1f} times faster)")